@@ -4,24 +4,319 @@
 # See this guide on how to implement these action:
 # https://rasa.com/docs/rasa/custom-actions
 
+import logging
+import os
+from typing import Any, Text, Dict, List, Optional, Tuple
 
-# This is a simple example for a custom action which utters "Hello World!"
+from rasa_sdk import Action, Tracker
+from rasa_sdk.events import SlotSet
+from rasa_sdk.executor import CollectingDispatcher
 
-# from typing import Any, Text, Dict, List
-#
-# from rasa_sdk import Action, Tracker
-# from rasa_sdk.executor import CollectingDispatcher
-#
-#
-# class ActionHelloWorld(Action):
-#
-#     def name(self) -> Text:
-#         return "action_hello_world"
-#
-#     def run(self, dispatcher: CollectingDispatcher,
-#             tracker: Tracker,
-#             domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
-#
-#         dispatcher.utter_message(text="Hello World!")
-#
-#         return []
+from actions.hot_reload import KnowledgeBaseReloader, Snapshot
+from actions.knowledge_base import SubstanceKnowledgeBase
+from actions.reagent_index import ReagentIndex
+from actions.response_cache import ResponseCache
+from actions.search_index import SearchIndex
+from actions.similarity_graph import SimilarityGraph
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ts_pn_data")
+PACKED_KB_PATH = os.path.join(DATA_DIR, "substances_data.kb")
+JSON_KB_PATH = os.path.join(DATA_DIR, "substances_data.json")
+FUZZY_INDEX_PATH = os.path.join(DATA_DIR, "fuzzy_index.jsonl")
+SEARCH_INDEX_PATH = os.path.join(DATA_DIR, "search_index.npz")
+REAGENT_INDEX_PATH = os.path.join(DATA_DIR, "reagent_index.npz")
+SIMILARITY_GRAPH_PATH = os.path.join(DATA_DIR, "similarity_graph.npz")
+# how many typos a substance name may have and still be recognised, 0 turns matching off
+FUZZY_DISTANCE = int(os.environ.get("SUBSTANCE_FUZZY_DISTANCE", 2))
+# seconds between checks for new substance data, 0 only loads it at startup
+RELOAD_INTERVAL = float(os.environ.get("SUBSTANCE_RELOAD_INTERVAL", 30))
+# answers cached per substance and data version, 0 turns caching off
+CACHE_SIZE = int(os.environ.get("SUBSTANCE_CACHE_SIZE", 512))
+CACHE_TTL = float(os.environ.get("SUBSTANCE_CACHE_TTL", 3600))
+# substances listed for a question that doesn't name one
+SEARCH_RESULTS = int(os.environ.get("SUBSTANCE_SEARCH_RESULTS", 5))
+
+
+def knowledge_base_path() -> Text:
+    # the packed file is mapped rather than parsed, so every worker shares one copy of it
+    if os.path.exists(PACKED_KB_PATH):
+        return PACKED_KB_PATH
+    logger.warning(
+        f"No packed knowledge base at {PACKED_KB_PATH}, parsing the JSON one instead. "
+        "Run `python3 ts_pn_data/getData.py export-packed-kb` to build it."
+    )
+    return JSON_KB_PATH
+
+
+def load_search_index(path: Text) -> Optional[SearchIndex]:
+    try:
+        return SearchIndex.load(path)
+    except FileNotFoundError:
+        logger.warning(
+            f"No search index at {path}, questions that don't name a substance go unanswered. "
+            "Run `python3 ts_pn_data/getData.py export-search` to build it."
+        )
+        return None
+
+
+def load_reagent_index(path: Text) -> Optional[ReagentIndex]:
+    try:
+        return ReagentIndex.load(path)
+    except FileNotFoundError:
+        logger.warning(
+            f"No reagent index at {path}, test kit results can't be looked up. "
+            "Run `python3 ts_pn_data/getData.py export-reagents` to build it."
+        )
+        return None
+
+
+def load_similarity_graph(path: Text) -> Optional[SimilarityGraph]:
+    try:
+        return SimilarityGraph.load(path)
+    except FileNotFoundError:
+        logger.warning(
+            f"No similarity graph at {path}, similar substances and cross-tolerances are unknown. "
+            "Run `python3 ts_pn_data/getData.py export-similarity` to build it."
+        )
+        return None
+
+
+# loaded once when the action server imports the actions package and reloaded in the background
+# when the pipeline writes new data, every request is answered from memory. the indexes hold
+# substance ids, a snapshot only has the ones built from its knowledge base
+substance_data = KnowledgeBaseReloader(
+    knowledge_base_path(),
+    FUZZY_INDEX_PATH if FUZZY_DISTANCE > 0 else None,
+    RELOAD_INTERVAL,
+    indexes={
+        "search": (SEARCH_INDEX_PATH, load_search_index),
+        "reagents": (REAGENT_INDEX_PATH, load_reagent_index),
+        "similarity": (SIMILARITY_GRAPH_PATH, load_similarity_graph),
+    },
+)
+response_cache = ResponseCache(CACHE_SIZE, CACHE_TTL)
+
+
+def drop_cached_answers(snapshot: Snapshot) -> None:
+    logger.info(
+        f"Substance answer cache before data version {snapshot.version}: "
+        f"{response_cache.stats()}"
+    )
+    response_cache.clear()
+
+
+substance_data.on_reload(drop_cached_answers)
+
+
+def requested_substance(tracker: Tracker) -> Text:
+    """Substance named in the latest message, falling back to the one we last talked about."""
+    return next(
+        tracker.get_latest_entity_values("substance"), None
+    ) or tracker.get_slot("substance")
+
+
+def describe_substance(substance: Dict[Text, Any]) -> Text:
+    text = substance.get("summary")
+    if not text:
+        classes = (substance.get("classes") or {}).get("psychoactive") or []
+        if classes:
+            text = f"{substance['name']} is a {' / '.join(classes).lower()}."
+        else:
+            text = f"I don't have a summary for {substance['name']} yet."
+    return f"{text}\nMore info: {substance['url']}"
+
+
+def what_is_answer(
+    knowledge_base: SubstanceKnowledgeBase, substance_id: int
+) -> Tuple[Text, Text]:
+    """The description of a substance and its canonical name, for the substance slot."""
+    substance = knowledge_base.get(substance_id)
+    return describe_substance(substance), substance["name"]
+
+
+class ActionWhatIsSubstance(Action):
+    def name(self) -> Text:
+        return "action_what_is_substance"
+
+    def run(
+        self,
+        dispatcher: CollectingDispatcher,
+        tracker: Tracker,
+        domain: Dict[Text, Any],
+    ) -> List[Dict[Text, Any]]:
+        snapshot = substance_data.snapshot()
+        knowledge_base = snapshot.knowledge_base
+        name = requested_substance(tracker)
+        substance_id = knowledge_base.resolve_id(name, FUZZY_DISTANCE)
+        if substance_id is None:
+            dispatcher.utter_message(response="utter_substance_unknown", substance=name)
+            return []
+
+        text, canonical_name = response_cache.get_or_compute(
+            (substance_id, "what_is", snapshot.version),
+            lambda: what_is_answer(knowledge_base, substance_id),
+        )
+        dispatcher.utter_message(text=text)
+        return [SlotSet("substance", canonical_name)]
+
+
+class ActionSearchSubstances(Action):
+    def name(self) -> Text:
+        return "action_search_substances"
+
+    def run(
+        self,
+        dispatcher: CollectingDispatcher,
+        tracker: Tracker,
+        domain: Dict[Text, Any],
+    ) -> List[Dict[Text, Any]]:
+        snapshot = substance_data.snapshot()
+        search_index = snapshot.indexes["search"]
+        query = tracker.latest_message.get("text") or ""
+        hits = search_index.search(query, SEARCH_RESULTS) if search_index else []
+        found = [snapshot.knowledge_base.get(hit.substance_id) for hit in hits]
+        if not found:
+            dispatcher.utter_message(response="utter_search_no_results")
+            return []
+
+        lines = "\n".join(f"- {s['name']}: {s['url']}" for s in found)
+        dispatcher.utter_message(
+            text=f"These might be what you're looking for:\n{lines}"
+        )
+        return []
+
+
+class ActionIdentifyByReagents(Action):
+    def name(self) -> Text:
+        return "action_identify_by_reagents"
+
+    def run(
+        self,
+        dispatcher: CollectingDispatcher,
+        tracker: Tracker,
+        domain: Dict[Text, Any],
+    ) -> List[Dict[Text, Any]]:
+        snapshot = substance_data.snapshot()
+        reagent_index = snapshot.indexes["reagents"]
+        observed, matches = (
+            reagent_index.identify(tracker.latest_message.get("text") or "")
+            if reagent_index
+            else ({}, [])
+        )
+        if not observed:
+            dispatcher.utter_message(response="utter_ask_reagent_results")
+            return []
+
+        found = [
+            (snapshot.knowledge_base.get(match.substance_id), match)
+            for match in matches[:SEARCH_RESULTS]
+        ]
+        if not found:
+            dispatcher.utter_message(response="utter_reagents_no_match")
+            return []
+
+        lines = "\n".join(
+            f"- {substance['name']}"
+            + (f" (no data for {match.unknown} of the tests)" if match.unknown else "")
+            for substance, match in found
+        )
+        dispatcher.utter_message(
+            text=f"Substances known to react like that:\n{lines}\n"
+            "A reagent test can't rule out other substances or tell you how pure it is."
+        )
+        return []
+
+
+class ActionSimilarSubstances(Action):
+    def name(self) -> Text:
+        return "action_similar_substances"
+
+    def run(
+        self,
+        dispatcher: CollectingDispatcher,
+        tracker: Tracker,
+        domain: Dict[Text, Any],
+    ) -> List[Dict[Text, Any]]:
+        snapshot = substance_data.snapshot()
+        knowledge_base = snapshot.knowledge_base
+        similarity_graph = snapshot.indexes["similarity"]
+        name = requested_substance(tracker)
+        substance_id = knowledge_base.resolve_id(name, FUZZY_DISTANCE)
+        if substance_id is None:
+            dispatcher.utter_message(response="utter_substance_unknown", substance=name)
+            return []
+
+        substance = knowledge_base.get(substance_id)
+        neighbours = (
+            similarity_graph.similar(substance_id, SEARCH_RESULTS)
+            if similarity_graph
+            else []
+        )
+        similar = [knowledge_base.get(n.substance_id)["name"] for n in neighbours]
+        if similar:
+            dispatcher.utter_message(
+                text=f"Substances in the same classes as {substance['name']}: "
+                f"{', '.join(similar)}."
+            )
+        else:
+            dispatcher.utter_message(
+                response="utter_no_similar_substances", substance=substance["name"]
+            )
+        return [SlotSet("substance", substance["name"])]
+
+
+class ActionCrossTolerance(Action):
+    def name(self) -> Text:
+        return "action_cross_tolerance"
+
+    def run(
+        self,
+        dispatcher: CollectingDispatcher,
+        tracker: Tracker,
+        domain: Dict[Text, Any],
+    ) -> List[Dict[Text, Any]]:
+        snapshot = substance_data.snapshot()
+        knowledge_base = snapshot.knowledge_base
+        similarity_graph = snapshot.indexes["similarity"]
+        names = list(tracker.get_latest_entity_values("substance"))
+        # "does it cross-tolerate with X" is about the substance we last talked about
+        if len(names) == 1 and tracker.get_slot("substance"):
+            names.insert(0, tracker.get_slot("substance"))
+        if len(names) < 2:
+            dispatcher.utter_message(response="utter_ask_cross_tolerance")
+            return []
+
+        substances = []
+        for name in names[:2]:
+            substance_id = knowledge_base.resolve_id(name, FUZZY_DISTANCE)
+            if substance_id is None:
+                dispatcher.utter_message(
+                    response="utter_substance_unknown", substance=name
+                )
+                return []
+            substances.append(knowledge_base.get(substance_id))
+
+        first, second = substances
+        if first["id"] == second["id"]:
+            # e.g. the slot and the only substance named are the same, or two names of one substance
+            dispatcher.utter_message(response="utter_ask_cross_tolerance")
+            return []
+        groups = (
+            similarity_graph.cross_tolerance(first["id"], second["id"])
+            if similarity_graph
+            else []
+        )
+        if groups:
+            text = (
+                f"Yes, {first['name']} and {second['name']} are cross-tolerant "
+                f"({', '.join(groups)}): taking one lowers the effect of the other for a while."
+            )
+        else:
+            text = (
+                f"I don't know of a cross-tolerance between {first['name']} and "
+                f"{second['name']}."
+            )
+        dispatcher.utter_message(text=text)
+        return []
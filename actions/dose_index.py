@@ -0,0 +1,248 @@
+"""Numeric dose and duration ranges for every substance.
+
+``substances_data.json`` only keeps ROA dosage and duration as free text
+("0.5 - 1 mL", "< 0.5 mL", "4-6 hours"). The data pipeline parses those once
+into min/max/unit columns and stores them with NumPy in
+``ts_pn_data/dose_index.npz``, so the action server can answer dose questions
+with an array slice instead of regex-parsing strings per request.
+
+Units are normalized: masses to mg (or µg when the source is in µg), volumes
+to mL and durations to minutes. Open ranges use 0 for a missing lower bound
+("< 2 mg") and infinity for a missing upper bound ("40 mg +").
+"""
+
+import math
+import re
+from typing import Any, Dict, List, NamedTuple, Optional, Text, Tuple
+
+import numpy as np
+
+KINDS = ["dosage", "duration"]
+
+# micrograms per unit, ranges mixing units are expressed in the smallest one
+_MASS_UG = {"ug": 1, "µg": 1, "μg": 1, "mg": 1000, "g": 1000000}
+_MASS_NAMES = {1: "µg", 1000: "mg", 1000000: "mg"}
+_VOLUME = {"ml": "mL"}
+_OTHER_DOSE = {
+    "mg/kg": "mg/kg",
+    "mg/kg of body weight": "mg/kg",
+    "seeds": "seeds",
+    "units": "units",
+}
+_MINUTES = {
+    "s": 1 / 60,
+    "sec": 1 / 60,
+    "secs": 1 / 60,
+    "second": 1 / 60,
+    "seconds": 1 / 60,
+    "min": 1,
+    "mins": 1,
+    "minute": 1,
+    "minutes": 1,
+    "h": 60,
+    "hr": 60,
+    "hrs": 60,
+    "hour": 60,
+    "hours": 60,
+    "day": 1440,
+    "days": 1440,
+}
+
+_NUMBER = r"(\d+(?:\.\d+)?|\.\d+)"
+_UNIT = r"([a-zµμ]+(?:/kg(?: of body weight)?)?)"
+_PART = re.compile(rf"^{_NUMBER}\s*(\+)?\s*{_UNIT}?\s*(\+)?$")
+_PREFIX = re.compile(r"^(<|>|~|up to)\s*")
+_NOTE = re.compile(r"\s*\([^)]*\)$")
+
+
+def _parse_part(part: Text) -> Optional[Tuple[float, Optional[Text], bool]]:
+    match = _PART.match(part)
+    if not match:
+        return None
+    number, plus, unit, trailing_plus = match.groups()
+    return float(number), unit, bool(plus or trailing_plus)
+
+
+def _unit_factors(
+    kind: Text, units: List[Optional[Text]]
+) -> Optional[Tuple[Text, List[float]]]:
+    """Normalized unit for a value and the factor to apply to each of its numbers."""
+    given = [u for u in units if u]
+    if not given:
+        return "", [1.0] * len(units)
+    # "10 - 20 mg": the unit written once applies to the whole range
+    units = [u or given[-1] for u in units]
+
+    if kind == "duration":
+        if all(u in _MINUTES for u in units):
+            return "minutes", [_MINUTES[u] for u in units]
+        return None
+
+    if all(u in _MASS_UG for u in units):
+        smallest = min(_MASS_UG[u] for u in units)
+        base = 1000 if smallest == 1000000 else smallest
+        return _MASS_NAMES[smallest], [_MASS_UG[u] / base for u in units]
+    if all(u in _VOLUME for u in units):
+        return _VOLUME[units[0]], [1.0] * len(units)
+    if len(set(units)) == 1 and units[0] in _OTHER_DOSE:
+        return _OTHER_DOSE[units[0]], [1.0] * len(units)
+    return None
+
+
+def parse_amount(
+    value: Optional[Text], kind: Text
+) -> Optional[Tuple[float, float, Text]]:
+    """Parse a dosage or duration string into ``(min, max, unit)``.
+
+    Returns ``None`` for values that aren't numeric ranges ("Within minutes",
+    "???", "-").
+    """
+    if not value:
+        return None
+    text = value.replace("\xa0", " ").strip().lower()
+    text = _NOTE.sub("", text).rstrip(".").strip()
+
+    prefix = _PREFIX.match(text)
+    if prefix:
+        text = text[prefix.end() :]
+
+    parts = [_parse_part(p.strip()) for p in re.split(r"\s*-\s*", text, maxsplit=1)]
+    if not parts or any(p is None for p in parts):
+        return None
+
+    normalized = _unit_factors(kind, [unit for _, unit, _ in parts])
+    if normalized is None:
+        return None
+    unit, factors = normalized
+    numbers = [number * factor for (number, _, _), factor in zip(parts, factors)]
+
+    low, high = numbers[0], numbers[-1]
+    if parts[-1][2]:
+        high = math.inf
+    if prefix and prefix.group(1) in ["<", "up to"]:
+        low = 0.0
+    elif prefix and prefix.group(1) == ">":
+        high = math.inf
+    if low > high:
+        return None
+    return low, high, unit
+
+
+def build_dose_index(substances: List[Dict[Text, Any]]) -> Dict[Text, np.ndarray]:
+    """Columnar ranges for all substances, ordered by substance id.
+
+    Rows for substance ``i`` are ``offsets[i]:offsets[i + 1]``. Values that
+    can't be parsed are left out and listed in ``unparsed``.
+    """
+    roas, levels, units = [], [], []
+    columns = {k: [] for k in ["roa", "kind", "level", "min", "max", "unit"]}
+    offsets = [0]
+    unparsed = []
+
+    def code(table: List[Text], name: Text) -> int:
+        if name not in table:
+            table.append(name)
+        return table.index(name)
+
+    for substance in sorted(substances, key=lambda s: s["id"]):
+        # ids are positions, keep offsets aligned even if an id were skipped
+        while len(offsets) <= substance["id"]:
+            offsets.append(offsets[-1])
+        count = 0
+        for roa in substance.get("roas") or []:
+            for kind_code, kind in enumerate(KINDS):
+                for entry in roa.get(kind) or []:
+                    parsed = parse_amount(entry.get("value"), kind)
+                    if parsed is None:
+                        if entry.get("value"):
+                            unparsed.append(entry["value"])
+                        continue
+                    columns["roa"].append(code(roas, roa["name"]))
+                    columns["kind"].append(kind_code)
+                    columns["level"].append(code(levels, entry["name"]))
+                    columns["min"].append(parsed[0])
+                    columns["max"].append(parsed[1])
+                    columns["unit"].append(code(units, parsed[2]))
+                    count += 1
+        offsets.append(offsets[-1] + count)
+
+    return {
+        "offsets": np.array(offsets, dtype=np.int32),
+        "roa": np.array(columns["roa"], dtype=np.int16),
+        "kind": np.array(columns["kind"], dtype=np.int8),
+        "level": np.array(columns["level"], dtype=np.int16),
+        "min": np.array(columns["min"], dtype=np.float32),
+        "max": np.array(columns["max"], dtype=np.float32),
+        "unit": np.array(columns["unit"], dtype=np.int8),
+        "roa_names": np.array(roas),
+        "level_names": np.array(levels),
+        "unit_names": np.array(units),
+        "unparsed": np.array(unparsed),
+    }
+
+
+def save_dose_index(path: Text, index: Dict[Text, np.ndarray]) -> None:
+    with open(path, "wb") as f:
+        np.savez(f, **index)
+
+
+class DoseRange(NamedTuple):
+    roa: Text
+    kind: Text
+    level: Text
+    min: float
+    max: float
+    unit: Text
+
+
+class DoseIndex:
+    """Read side of ``dose_index.npz``, queried by substance id."""
+
+    def __init__(self, index: Dict[Text, np.ndarray]) -> None:
+        self.offsets = index["offsets"]
+        self.roa = index["roa"]
+        self.kind = index["kind"]
+        self.level = index["level"]
+        self.min = index["min"]
+        self.max = index["max"]
+        self.unit = index["unit"]
+        self.roa_names = [str(n) for n in index["roa_names"]]
+        self.level_names = [str(n) for n in index["level_names"]]
+        self.unit_names = [str(n) for n in index["unit_names"]]
+        # sources disagree on capitalisation ("Oral"/"oral"), so match ROAs case-insensitively
+        self.roa_codes = {}
+        for code, name in enumerate(self.roa_names):
+            self.roa_codes.setdefault(name.lower(), []).append(code)
+
+    @classmethod
+    def load(cls, path: Text) -> "DoseIndex":
+        with np.load(path) as index:
+            return cls({key: index[key] for key in index.files})
+
+    def lookup(
+        self,
+        substance_id: int,
+        roa: Optional[Text] = None,
+        kind: Optional[Text] = None,
+    ) -> List[DoseRange]:
+        """Ranges for one substance, optionally limited to a ROA and/or kind."""
+        if not 0 <= substance_id < len(self.offsets) - 1:
+            return []
+        rows = slice(self.offsets[substance_id], self.offsets[substance_id + 1])
+        mask = np.ones(rows.stop - rows.start, dtype=bool)
+        if roa is not None:
+            mask &= np.isin(self.roa[rows], self.roa_codes.get(roa.lower(), []))
+        if kind is not None:
+            mask &= self.kind[rows] == KINDS.index(kind)
+
+        return [
+            DoseRange(
+                self.roa_names[self.roa[i]],
+                KINDS[self.kind[i]],
+                self.level_names[self.level[i]],
+                float(self.min[i]),
+                float(self.max[i]),
+                self.unit_names[self.unit[i]],
+            )
+            for i in np.flatnonzero(mask) + rows.start
+        ]
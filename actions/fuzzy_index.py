@@ -0,0 +1,191 @@
+"""Approximate substance name matching for misspelled entities.
+
+A SymSpell-style deletion dictionary: every known name is indexed under all
+strings reachable by deleting up to ``max_distance`` characters. A query only
+has to generate its own deletes and look them up, then verify the handful of
+candidates with a real edit distance, instead of comparing against all names.
+
+The data pipeline's ``export-fuzzy`` stage builds the index into
+``ts_pn_data/fuzzy_index.jsonl``, the action server loads it at startup. The
+file is JSON lines (a header, then the deletes in chunks) so loading it can
+yield between chunks instead of holding the GIL for one big parse. Its header
+has the ``data_key`` of the substances it was built from.
+"""
+
+import json
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Set, Text, Tuple
+
+from actions.knowledge_base import data_key, name_index, normalize_name
+
+# names shorter than this many characters per allowed edit are matched more strictly,
+# otherwise any two-letter alias would be one edit away from dozens of others
+CHARS_PER_EDIT = 4
+# longer entity values are sentences rather than misspelled names
+MAX_QUERY_LENGTH = 40
+# deletes per line of the saved index
+ENTRIES_PER_LINE = 1000
+
+
+def deletes(word: Text, max_distance: int) -> Set[Text]:
+    """``word`` and every string made by deleting up to ``max_distance`` characters."""
+    variants = {word}
+    frontier = {word}
+    for _ in range(max_distance):
+        frontier = {w[:i] + w[i + 1 :] for w in frontier for i in range(len(w))}
+        variants |= frontier
+    return variants
+
+
+def edit_distance(a: Text, b: Text, limit: int) -> int:
+    """Optimal string alignment distance, gives up with ``limit + 1`` once it's exceeded."""
+    # a shared prefix or suffix never changes the distance, only the middles need comparing
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    end = 0
+    while end < len(a) - start and end < len(b) - start and a[-1 - end] == b[-1 - end]:
+        end += 1
+    a, b = a[start : len(a) - end], b[start : len(b) - end]
+
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    if not a or not b:
+        return max(len(a), len(b))
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(
+                previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost
+            )
+            if (
+                previous2 is not None
+                and i > 1
+                and j > 1
+                and a[i - 1] == b[j - 2]
+                and a[i - 2] == b[j - 1]
+            ):
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class FuzzyIndex:
+    def __init__(
+        self,
+        keys: List[Text],
+        ids: List[int],
+        popularity: List[int],
+        entries: Dict[Text, List[int]],
+        max_distance: int,
+        data_key: Optional[Text] = None,
+    ) -> None:
+        self.keys = keys
+        self.ids = ids
+        self.popularity = popularity
+        self.entries = entries
+        self.max_distance = max_distance
+        self.data_key = data_key
+
+    @classmethod
+    def build(cls, substances: Iterable[Dict], max_distance: int = 2) -> "FuzzyIndex":
+        substances = list(substances)
+        # same precedence as the exact lookup: canonical names first, then aliases
+        key_ids = name_index(substances)
+
+        # how many names a substance goes by is a decent stand-in for how commonly it's talked about
+        name_counts = {}
+        for substance_id in key_ids.values():
+            name_counts[substance_id] = name_counts.get(substance_id, 0) + 1
+
+        keys = list(key_ids)
+        entries = {}
+        for position, key in enumerate(keys):
+            for variant in sorted(deletes(key, max_distance)):
+                entries.setdefault(variant, []).append(position)
+        ids = [key_ids[k] for k in keys]
+        popularity = [name_counts[i] for i in ids]
+        return cls(keys, ids, popularity, entries, max_distance, data_key(substances))
+
+    def save(self, path: Text) -> None:
+        def line(data: Dict) -> Text:
+            return json.dumps(data, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+        header = {
+            "max_distance": self.max_distance,
+            "keys": self.keys,
+            "ids": self.ids,
+            "popularity": self.popularity,
+            "data_key": self.data_key,
+        }
+        entries = list(self.entries.items())
+        # replaced in one step, a running action server may be reloading it
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(line(header))
+            for start in range(0, len(entries), ENTRIES_PER_LINE):
+                f.write(line(dict(entries[start : start + ENTRIES_PER_LINE])))
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path: Text) -> "FuzzyIndex":
+        with open(path, encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            entries = {}
+            for line in f:
+                entries.update(json.loads(line))
+                # let request threads run between chunks when this is a background reload
+                time.sleep(0)
+        return cls(
+            header["keys"],
+            header["ids"],
+            header["popularity"],
+            entries,
+            header["max_distance"],
+            header.get("data_key"),
+        )
+
+    def lookup(
+        self, name: Text, max_distance: Optional[int] = None
+    ) -> Optional[Tuple[int, int]]:
+        """``(substance id, distance)`` of the closest known name, or None.
+
+        The allowed distance is capped by the index's build distance and by
+        the length of ``name`` (one edit per ``CHARS_PER_EDIT`` characters).
+        """
+        query = normalize_name(name)
+        if not query or len(query) > MAX_QUERY_LENGTH:
+            return None
+        if max_distance is None:
+            max_distance = self.max_distance
+        limit = min(max_distance, self.max_distance, len(query) // CHARS_PER_EDIT)
+
+        best = None
+        seen = set()
+        for variant in deletes(query, limit):
+            for position in self.entries.get(variant, ()):
+                if position in seen:
+                    continue
+                seen.add(position)
+                distance = edit_distance(query, self.keys[position], limit)
+                if distance > limit:
+                    continue
+                # closest first, then the same length (a typo rather than a dropped letter),
+                # then the better known substance, then the earlier (canonical) key
+                length_difference = abs(len(self.keys[position]) - len(query))
+                candidate = (
+                    distance,
+                    length_difference,
+                    -self.popularity[position],
+                    position,
+                )
+                if best is None or candidate < best:
+                    best = candidate
+        if best is None:
+            return None
+        return self.ids[best[-1]], best[0]
@@ -0,0 +1,233 @@
+"""Pairwise TripSit combo interactions as a dense matrix.
+
+TripSit only publishes combos between its own groups ("LSD",
+"Benzodiazepines", "2C-x"), listed on the factsheets of 16 substances. The
+data pipeline maps every substance onto one of those groups and stores a
+symmetric group × group matrix of status codes in
+``ts_pn_data/interaction_matrix.npz``, so checking any two (or N) substances
+is an index into an array instead of scanning interaction lists.
+
+Where both groups' factsheets list the pair with different statuses, the more
+severe one is kept and the pair is reported in ``asymmetries``.
+"""
+
+import re
+from typing import Any, Dict, List, NamedTuple, Optional, Text, Tuple
+
+import numpy as np
+
+from actions.knowledge_base import normalize_name, substance_names
+
+# least to most severe, code 0 is "no data"
+STATUSES = [
+    "Low Risk & Synergy",
+    "Low Risk & No Synergy",
+    "Low Risk & Decrease",
+    "Caution",
+    "Unsafe",
+    "Dangerous",
+]
+
+# names a group goes by that aren't a name or alias of the substance it's named after
+COMBO_GROUP_NAMES = {
+    "GHB/GBL": ["ghb", "gbl"],
+    "Mushrooms": ["psilocin", "psilocybe cubensis"],
+    "Nitrous": ["n2o", "nitrous oxide"],
+}
+
+# families TripSit groups by name, checked in order against the canonical name
+COMBO_GROUP_PATTERNS = [
+    (re.compile(r"NBOMe$"), "NBOMes"),
+    (re.compile(r"^2C-T(-|$)"), "2C-T-x"),
+    (re.compile(r"^2C-"), "2C-x"),
+    (re.compile(r"^DO[A-Z]{1,3}$"), "DOx"),
+    # 5-MeO-DiBF is a benzofuran, every other 5-MeO- substance is a tryptamine
+    (re.compile(r"^5-MeO-(?!DiBF)"), "5-MeO-xxT"),
+]
+
+
+def combo_group(substance: Dict[Text, Any], groups: List[Text]) -> Optional[Text]:
+    """TripSit group whose combos apply to ``substance``, if any."""
+    by_name = {normalize_name(group): group for group in groups}
+    for group, names in COMBO_GROUP_NAMES.items():
+        for name in names:
+            by_name.setdefault(name, group)
+    for name in substance_names(substance):
+        group = by_name.get(normalize_name(name))
+        if group is not None:
+            return group
+
+    for pattern, group in COMBO_GROUP_PATTERNS:
+        if pattern.search(substance["name"]):
+            return group
+
+    classes = substance.get("classes") or {}
+    chemical = set(classes.get("chemical") or [])
+    psychoactive = set(classes.get("psychoactive") or [])
+    if chemical & {"Benzodiazepines", "Thienodiazepines"}:
+        return "Benzodiazepines"
+    if "Lysergamides" in chemical:
+        return "LSD"
+    if "Opioids" in psychoactive:
+        return "Opioids"
+    # entactogenic amphetamines (MDA, 3-FMA, PMA...) don't behave like the stimulant ones
+    if (
+        chemical & {"Amphetamine", "Substituted_amphetamines"}
+        and "Stimulants" in psychoactive
+        and "Entactogens" not in psychoactive
+    ):
+        return "Amphetamines"
+    return None
+
+
+def build_interaction_matrix(
+    substances: List[Dict[Text, Any]],
+) -> Dict[Text, np.ndarray]:
+    """Matrix, notes and substance -> group mapping for all substances."""
+    substances = sorted(substances, key=lambda s: s["id"])
+    groups = sorted(
+        {
+            interaction["name"]
+            for substance in substances
+            for interaction in substance.get("interactions") or []
+        }
+    )
+    group_codes = {group: code for code, group in enumerate(groups)}
+
+    substance_group = np.full(
+        (substances[-1]["id"] + 1) if substances else 0, -1, dtype=np.int16
+    )
+    # (group, other group) -> (status code, note) as listed on the group's own factsheet
+    declared = {}
+    for substance in substances:
+        group = combo_group(substance, groups)
+        if group is None:
+            continue
+        substance_group[substance["id"]] = group_codes[group]
+        for interaction in substance.get("interactions") or []:
+            if interaction["status"] not in STATUSES:
+                raise ValueError(
+                    f"unknown combo status {interaction['status']!r} for "
+                    f"{substance['name']} + {interaction['name']}"
+                )
+            declared[(group, interaction["name"])] = (
+                STATUSES.index(interaction["status"]) + 1,
+                interaction.get("note"),
+            )
+
+    matrix = np.zeros((len(groups), len(groups)), dtype=np.int8)
+    note = np.full((len(groups), len(groups)), -1, dtype=np.int16)
+    notes = []
+    asymmetries = []
+    for a, b in sorted({tuple(sorted(pair)) for pair in declared}):
+        if a == b:
+            continue
+        sides = [s for s in [declared.get((a, b)), declared.get((b, a))] if s]
+        if len(sides) == 2 and sides[0][0] != sides[1][0]:
+            asymmetries.append(
+                (group_codes[a], group_codes[b], sides[0][0], sides[1][0])
+            )
+        # disagreeing factsheets resolve to the more cautious answer
+        sides.sort(key=lambda side: side[0], reverse=True)
+        status = sides[0][0]
+        text = next((side[1] for side in sides if side[1]), None)
+
+        i, j = group_codes[a], group_codes[b]
+        matrix[i, j] = matrix[j, i] = status
+        if text:
+            if text not in notes:
+                notes.append(text)
+            note[i, j] = note[j, i] = notes.index(text)
+
+    return {
+        "groups": np.array(groups),
+        "statuses": np.array(STATUSES),
+        "matrix": matrix,
+        "note": note,
+        "notes": np.array(notes),
+        "substance_group": substance_group,
+        "asymmetries": np.array(sorted(asymmetries), dtype=np.int16).reshape(-1, 4),
+    }
+
+
+def save_interaction_matrix(path: Text, index: Dict[Text, np.ndarray]) -> None:
+    with open(path, "wb") as f:
+        np.savez(f, **index)
+
+
+class Interaction(NamedTuple):
+    status: Text
+    severity: int
+    note: Optional[Text]
+    groups: Tuple[Text, Text]
+
+
+class InteractionMatrix:
+    """Read side of ``interaction_matrix.npz``, queried by substance id."""
+
+    def __init__(self, index: Dict[Text, np.ndarray]) -> None:
+        self.groups = [str(g) for g in index["groups"]]
+        self.statuses = [str(s) for s in index["statuses"]]
+        self.matrix = index["matrix"]
+        self.note = index["note"]
+        self.notes = [str(n) for n in index["notes"]]
+        self.substance_group = index["substance_group"]
+        self.asymmetries = index["asymmetries"]
+
+    @classmethod
+    def load(cls, path: Text) -> "InteractionMatrix":
+        with np.load(path) as index:
+            return cls({key: index[key] for key in index.files})
+
+    def group(self, substance_id: int) -> Optional[Text]:
+        if not 0 <= substance_id < len(self.substance_group):
+            return None
+        code = self.substance_group[substance_id]
+        return None if code < 0 else self.groups[code]
+
+    def _interaction(self, i: int, j: int) -> Optional[Interaction]:
+        status = int(self.matrix[i, j])
+        if not status:
+            return None
+        note = int(self.note[i, j])
+        return Interaction(
+            self.statuses[status - 1],
+            status,
+            None if note < 0 else self.notes[note],
+            (self.groups[i], self.groups[j]),
+        )
+
+    def lookup(self, substance_id: int, other_id: int) -> Optional[Interaction]:
+        """How two substances interact, None when TripSit has no data for the pair."""
+        ids = [substance_id, other_id]
+        if not all(0 <= i < len(self.substance_group) for i in ids):
+            return None
+        i, j = self.substance_group[ids]
+        if i < 0 or j < 0:
+            return None
+        return self._interaction(i, j)
+
+    def check(self, substance_ids: List[int]) -> List[Tuple[int, int, Interaction]]:
+        """Every known interaction within a combination, most severe first."""
+        ids = np.array(
+            [i for i in substance_ids if 0 <= i < len(self.substance_group)],
+            dtype=np.int64,
+        )
+        codes = self.substance_group[ids]
+        known = codes >= 0
+        ids, codes = ids[known], codes[known]
+
+        statuses = np.triu(self.matrix[np.ix_(codes, codes)], k=1)
+        pairs = np.argwhere(statuses > 0)
+        found = [
+            (int(ids[a]), int(ids[b]), self._interaction(codes[a], codes[b]))
+            for a, b in pairs
+        ]
+        return sorted(found, key=lambda pair: pair[2].severity, reverse=True)
+
+    def asymmetry_report(self) -> List[Text]:
+        return [
+            f"{self.groups[a]} lists {self.groups[b]} as {self.statuses[ab - 1]}, "
+            f"{self.groups[b]} lists {self.groups[a]} as {self.statuses[ba - 1]}"
+            for a, b, ab, ba in self.asymmetries
+        ]
@@ -0,0 +1,168 @@
+"""In-memory substance knowledge base for the action server.
+
+``ts_pn_data/substances_data.json`` is parsed once when the action server
+starts. Substances are then found by id, canonical name or any alias with a
+single dict lookup, so answering a question needs no file I/O or JSON parsing.
+Names that don't match exactly can fall back to a ``FuzzyIndex`` for typos.
+
+Substance ids are positions in the merged data and can stand for another
+substance after the data is rebuilt. ``data_key`` digests which substance each
+id stands for; indexes built from the substances record it, so they're only
+used together with the knowledge base they were built from.
+"""
+
+import hashlib
+import json
+import os
+import re
+import time
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Optional, Text
+
+if TYPE_CHECKING:
+    from actions.fuzzy_index import FuzzyIndex
+
+DEFAULT_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "..",
+    "ts_pn_data",
+    "substances_data.json",
+)
+
+
+_QUALIFIER = re.compile(r"\s+\([^()]*\)")
+_OR = re.compile(r"(?:^|\s)or\s")
+
+
+def split_alias(alias: Text) -> List[Text]:
+    """The names in one scraped alias.
+
+    Aliases are scraped from prose, so they come through as "x or y", with
+    qualifiers in parentheses, or cut apart at the commas inside one:
+
+    >>> split_alias("caapi or yagé")
+    ['caapi', 'yagé']
+    >>> split_alias("or one four b-d-o")
+    ['one four b-d-o']
+    >>> split_alias("a or b or c")
+    ['a', 'b', 'c']
+    >>> split_alias("vicodin (with paracetamol)")
+    ['vicodin']
+    >>> split_alias("stp (serenity")
+    ['stp']
+    >>> split_alias("and peace)")
+    []
+    >>> split_alias("chronogesic,")
+    ['chronogesic']
+    >>> split_alias("2-(p-tolyl)acetamide")
+    ['2-(p-tolyl)acetamide']
+    """
+    alias = _QUALIFIER.sub("", alias)
+    if alias.count(")") > alias.count("("):
+        # the end of a parenthesis that was split at its commas, no name in it
+        return []
+    alias = alias.split(" (")[0]
+    names = [name.strip(' ,;"') for name in _OR.split(alias)]
+    return [name for name in names if name]
+
+
+def normalize_name(name: Text) -> Text:
+    """Key names are indexed under, so case and spacing differences still match."""
+    return " ".join(name.lower().split())
+
+
+def substance_names(substance: Dict[Text, Any]) -> Iterator[Text]:
+    """Every name a substance goes by, canonical name first."""
+    yield substance["name"]
+    for alias in substance.get("aliases") or []:
+        yield from split_alias(alias)
+
+
+def name_index(substances: List[Dict[Text, Any]]) -> Dict[Text, int]:
+    """Normalized name or alias -> substance id."""
+    by_name = {}
+    # canonical names win over another substance's alias
+    for substance in substances:
+        by_name.setdefault(normalize_name(substance["name"]), substance["id"])
+    for substance in substances:
+        for name in substance_names(substance):
+            key = normalize_name(name)
+            if key:
+                by_name.setdefault(key, substance["id"])
+    return by_name
+
+
+def data_key(substances: Iterable[Dict[Text, Any]]) -> Text:
+    """Digest of the id and canonical name of every substance."""
+    digest = hashlib.sha256()
+    for substance in sorted(substances, key=lambda s: s["id"]):
+        digest.update(f"{substance['id']}\t{substance['name']}\n".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+class SubstanceKnowledgeBase:
+    def __init__(
+        self,
+        substances: List[Dict[Text, Any]],
+        fuzzy_index: Optional["FuzzyIndex"] = None,
+    ) -> None:
+        self.fuzzy_index = fuzzy_index
+        self.substances = {substance["id"]: substance for substance in substances}
+        self.by_name = name_index(substances)
+
+    @classmethod
+    def load(
+        cls, path: Text = DEFAULT_PATH, fuzzy_index: Optional["FuzzyIndex"] = None
+    ) -> "SubstanceKnowledgeBase":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f)["substances"], fuzzy_index)
+
+    def __len__(self) -> int:
+        return len(self.substances)
+
+    def get(self, substance_id: int) -> Optional[Dict[Text, Any]]:
+        return self.substances.get(substance_id)
+
+    def data_key(self) -> Text:
+        """``data_key`` of the substances, worked out on first use."""
+        key = getattr(self, "_data_key", None)
+        if key is None:
+            key = self._data_key = data_key(self._yielding(self.substances.values()))
+        return key
+
+    @staticmethod
+    def _yielding(substances: Iterable[Dict[Text, Any]]) -> Iterator[Dict[Text, Any]]:
+        for count, substance in enumerate(substances):
+            # a packed knowledge base decodes every record, let request threads run meanwhile
+            if count % 64 == 0:
+                time.sleep(0)
+            yield substance
+
+    def find(self, name: Optional[Text]) -> Optional[Dict[Text, Any]]:
+        """Substance whose name or alias is ``name``."""
+        if not name:
+            return None
+        substance_id = self.by_name.get(normalize_name(name))
+        return None if substance_id is None else self.substances[substance_id]
+
+    def resolve_id(
+        self, name: Optional[Text], max_distance: Optional[int] = None
+    ) -> Optional[int]:
+        """Id of the substance ``resolve`` would return, without loading it."""
+        if not name:
+            return None
+        substance_id = self.by_name.get(normalize_name(name))
+        if substance_id is not None or self.fuzzy_index is None:
+            return substance_id
+        if max_distance is not None and max_distance <= 0:
+            return None
+        match = self.fuzzy_index.lookup(name, max_distance)
+        if match is None or match[0] not in self.substances:
+            return None
+        return match[0]
+
+    def resolve(
+        self, name: Optional[Text], max_distance: Optional[int] = None
+    ) -> Optional[Dict[Text, Any]]:
+        """Like ``find``, but falls back to the closest misspelling when there's a fuzzy index."""
+        substance_id = self.resolve_id(name, max_distance)
+        return None if substance_id is None else self.substances[substance_id]
@@ -0,0 +1,274 @@
+"""Binary knowledge base that is memory-mapped instead of parsed.
+
+``substances_data.json`` has to be parsed in full by every action server
+worker, and each keeps its own copy of the resulting dicts. The data
+pipeline also writes the same substances to ``ts_pn_data/substances_data.kb``:
+
+- a header with the section offsets
+- a string table: every distinct string stored once as UTF-8, with offsets
+- fixed-offset records: one tagged binary encoding per substance, where
+  strings are references into the string table
+- the name index: normalized names sorted by their UTF-8 bytes, with the
+  substance id each resolves to
+
+The file is ``mmap``ed read-only, so every worker shares the same page cache
+pages. A substance is only decoded into a dict when it's accessed, and names
+are found by binary search over the mapped index without decoding anything.
+"""
+
+import mmap
+import os
+import struct
+from array import array
+from itertools import accumulate
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Mapping, Optional, Text
+
+from actions.knowledge_base import SubstanceKnowledgeBase, name_index
+
+if TYPE_CHECKING:
+    from actions.fuzzy_index import FuzzyIndex
+
+MAGIC = b"PBKB"
+VERSION = 1
+
+# magic, version, substances, strings, names, then the offsets of the string offsets,
+# string data, record offsets, record data, name keys and name ids sections
+_HEADER = struct.Struct("<4sIIII6I")
+
+# value tags
+_NONE, _FALSE, _TRUE, _INT, _STR, _LIST, _DICT, _JOINED_ALIASES = range(8)
+_TAG = struct.Struct("<B")
+_TAG_U32 = struct.Struct("<BI")
+_TAG_I64 = struct.Struct("<Bq")
+_U32 = struct.Struct("<I")
+
+# the same list as "aliases", so it's rebuilt on decode rather than stored twice
+_JOINED_ALIASES_KEY = "aliasesStr"
+_JOINED_ALIASES_VALUE = object()
+
+
+class _StringTable:
+    def __init__(self) -> None:
+        self.ids = {}
+        self.strings = []
+
+    def intern(self, string: Text) -> int:
+        string_id = self.ids.get(string)
+        if string_id is None:
+            string_id = self.ids[string] = len(self.strings)
+            self.strings.append(string)
+        return string_id
+
+
+def _encode(value: Any, strings: _StringTable, out: bytearray) -> None:
+    if value is None:
+        out += _TAG.pack(_NONE)
+    elif value is True or value is False:
+        out += _TAG.pack(_TRUE if value else _FALSE)
+    elif isinstance(value, int):
+        out += _TAG_I64.pack(_INT, value)
+    elif isinstance(value, str):
+        out += _TAG_U32.pack(_STR, strings.intern(value))
+    elif isinstance(value, list):
+        out += _TAG_U32.pack(_LIST, len(value))
+        for item in value:
+            _encode(item, strings, out)
+    elif isinstance(value, dict):
+        out += _TAG_U32.pack(_DICT, len(value))
+        for key, item in value.items():
+            out += _U32.pack(strings.intern(key))
+            if key == _JOINED_ALIASES_KEY and item == ",".join(
+                value.get("aliases", [])
+            ):
+                out += _TAG.pack(_JOINED_ALIASES)
+            else:
+                _encode(item, strings, out)
+    else:
+        raise TypeError(f"can't pack {type(value).__name__} values")
+
+
+def _align(out: bytearray) -> int:
+    """Pad to 4 bytes so the arrays that follow can be mapped directly."""
+    out += b"\0" * (-len(out) % 4)
+    return len(out)
+
+
+def write_packed_kb(substances: List[Dict[Text, Any]], path: Text) -> None:
+    substances = sorted(substances, key=lambda s: s["id"])
+    if [s["id"] for s in substances] != list(range(len(substances))):
+        raise ValueError("substance ids must be their positions")
+
+    strings = _StringTable()
+    records = bytearray()
+    record_offsets = [0]
+    for substance in substances:
+        _encode(substance, strings, records)
+        record_offsets.append(len(records))
+
+    names = sorted(
+        name_index(substances).items(), key=lambda item: item[0].encode("utf-8")
+    )
+    name_keys = [strings.intern(key) for key, _ in names]
+    name_ids = [substance_id for _, substance_id in names]
+
+    encoded = [s.encode("utf-8") for s in strings.strings]
+    string_offsets = accumulate([len(s) for s in encoded], initial=0)
+
+    out = bytearray(_HEADER.size)
+    sections = []
+    for data in [
+        array("I", string_offsets).tobytes(),
+        b"".join(encoded),
+        array("I", record_offsets).tobytes(),
+        bytes(records),
+        array("I", name_keys).tobytes(),
+        array("I", name_ids).tobytes(),
+    ]:
+        sections.append(_align(out))
+        out += data
+    out[: _HEADER.size] = _HEADER.pack(
+        MAGIC, VERSION, len(substances), len(encoded), len(names), *sections
+    )
+    # replaced in one step, rewriting a file a running action server has mapped would crash it
+    with open(path + ".tmp", "wb") as f:
+        f.write(out)
+    os.replace(path + ".tmp", path)
+
+
+class PackedSubstances(Mapping):
+    """Substance id -> dict, decoding each record from the mapped file on access."""
+
+    def __init__(self, path: Text) -> None:
+        with open(path, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (
+            magic,
+            version,
+            self.count,
+            string_count,
+            name_count,
+            *sections,
+        ) = _HEADER.unpack_from(self.buffer)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} isn't a version {VERSION} packed knowledge base")
+
+        # views straight into the mapped pages, nothing is copied into the process
+        # (the arrays are written in native order, i.e. little-endian on every host we deploy to)
+        view = memoryview(self.buffer)
+
+        def array(offset: int, count: int) -> memoryview:
+            return view[offset : offset + 4 * count].cast("I")
+
+        self.string_offsets = array(sections[0], string_count + 1)
+        self.strings_start = sections[1]
+        self.record_offsets = array(sections[2], self.count + 1)
+        self.records_start = sections[3]
+        self.name_keys = array(sections[4], name_count)
+        self.name_ids = array(sections[5], name_count)
+        # strings are decoded at most once and shared by every record that uses them
+        self.decoded = [None] * string_count
+
+    def string_bytes(self, string_id: int) -> bytes:
+        start = self.strings_start + self.string_offsets[string_id]
+        end = self.strings_start + self.string_offsets[string_id + 1]
+        return self.buffer[start:end]
+
+    def string(self, string_id: int) -> Text:
+        string = self.decoded[string_id]
+        if string is None:
+            string = self.decoded[string_id] = self.string_bytes(string_id).decode(
+                "utf-8"
+            )
+        return string
+
+    def _decode(self, position: int) -> Any:
+        buffer = self.buffer
+        tag = buffer[position]
+        if tag == _NONE:
+            return None, position + 1
+        if tag == _JOINED_ALIASES:
+            return _JOINED_ALIASES_VALUE, position + 1
+        if tag == _FALSE or tag == _TRUE:
+            return tag == _TRUE, position + 1
+        if tag == _INT:
+            return _TAG_I64.unpack_from(buffer, position)[1], position + 9
+        (size,) = _U32.unpack_from(buffer, position + 1)
+        position += 5
+        if tag == _STR:
+            return self.string(size), position
+        if tag == _LIST:
+            items = []
+            for _ in range(size):
+                item, position = self._decode(position)
+                items.append(item)
+            return items, position
+        value = {}
+        for _ in range(size):
+            key = self.string(_U32.unpack_from(buffer, position)[0])
+            value[key], position = self._decode(position + 4)
+            if value[key] is _JOINED_ALIASES_VALUE:
+                value[key] = ",".join(value["aliases"])
+        return value, position
+
+    def __getitem__(self, substance_id: int) -> Dict[Text, Any]:
+        if not isinstance(substance_id, int) or not 0 <= substance_id < self.count:
+            raise KeyError(substance_id)
+        return self._decode(self.records_start + self.record_offsets[substance_id])[0]
+
+    def __contains__(self, substance_id: object) -> bool:
+        # Mapping's default would decode the record
+        return isinstance(substance_id, int) and 0 <= substance_id < self.count
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(self.count))
+
+    def __len__(self) -> int:
+        return self.count
+
+
+class PackedNames(Mapping):
+    """Normalized name -> substance id, binary searched in the mapped name index."""
+
+    def __init__(self, substances: PackedSubstances) -> None:
+        self.substances = substances
+
+    def _position(self, key: Text) -> Optional[int]:
+        target = key.encode("utf-8")
+        keys = self.substances.name_keys
+        low, high = 0, len(keys)
+        while low < high:
+            middle = (low + high) // 2
+            if self.substances.string_bytes(keys[middle]) < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(keys) and self.substances.string_bytes(keys[low]) == target:
+            return low
+        return None
+
+    def __getitem__(self, key: Text) -> int:
+        position = self._position(key)
+        if position is None:
+            raise KeyError(key)
+        return self.substances.name_ids[position]
+
+    def __iter__(self) -> Iterator[Text]:
+        return (self.substances.string(k) for k in self.substances.name_keys)
+
+    def __len__(self) -> int:
+        return len(self.substances.name_keys)
+
+
+class PackedKnowledgeBase(SubstanceKnowledgeBase):
+    """``SubstanceKnowledgeBase`` over a memory-mapped ``.kb`` file."""
+
+    def __init__(self, path: Text, fuzzy_index: Optional["FuzzyIndex"] = None) -> None:
+        self.fuzzy_index = fuzzy_index
+        self.substances = PackedSubstances(path)
+        self.by_name = PackedNames(self.substances)
+
+    @classmethod
+    def load(
+        cls, path: Text, fuzzy_index: Optional["FuzzyIndex"] = None
+    ) -> "PackedKnowledgeBase":
+        return cls(path, fuzzy_index)
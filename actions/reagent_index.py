@@ -0,0 +1,239 @@
+"""Reagent test kit results as bitsets, searchable by observed colours.
+
+TripSit's test kit results come through as one string per substance
+("Marquis: Orange > Black. | Mecke: Yellow > Green/Brown."). The data
+pipeline parses them once into a fixed vocabulary of reagents and colours and
+stores, for every (reagent, colour) pair, the set of substances that can show
+that colour as a packed bitset in ``ts_pn_data/reagent_index.npz``, along
+with the set of substances each reagent was tested on.
+
+An observation like "dark purple on Marquis, nothing on Mandelin" is then a
+few bitwise ORs and ANDs over 75-byte rows: a substance stays a candidate
+while every observed reagent either can show the observed colour or has no
+known result for it, and candidates are ranked by how many observations they
+actually match. Shades and speed ("slow", "dark", "fizzes") are dropped and
+every colour a result passes through counts, so partial observations match.
+Bit positions stand for the substance ids of the knowledge base with the
+index's ``data_key``.
+"""
+
+import re
+from typing import Any, Dict, List, NamedTuple, Optional, Text, Tuple
+
+import numpy as np
+
+from actions.knowledge_base import data_key
+
+REAGENTS = [
+    "Marquis",
+    "Mecke",
+    "Mandelin",
+    "Froehde",
+    "Liebermann",
+    "Ehrlich",
+    "Simon's",
+    "Gallic Acid",
+]
+NO_CHANGE = "no colour change"
+COLOURS = [
+    NO_CHANGE,
+    "black",
+    "blue",
+    "brown",
+    "clear",
+    "green",
+    "orange",
+    "pink",
+    "purple",
+    "red",
+    "yellow",
+]
+# words for a colour that aren't its name
+_COLOUR_WORDS = {
+    "violet": "purple",
+    "greenish": "green",
+    "bluish": "blue",
+    "nothing": NO_CHANGE,
+}
+_NO_CHANGE = re.compile(r"\bno (?:colou?r )?(?:change|reaction)\b|\bnothing\b")
+_WORD = re.compile(r"[a-z]+")
+_REAGENT = re.compile(
+    r"\b(marquis|mecke|mandelin|froehde|liebermann|ehrlich|simon|gallic acid)"
+    r"(?:'?s)?(?: reagent)?\b",
+    re.IGNORECASE,
+)
+_REAGENT_CODES = {
+    name.lower().replace("'s", ""): code for code, name in enumerate(REAGENTS)
+}
+
+
+def parse_colours(text: Text) -> List[int]:
+    """Codes of the colours in a result, every stage and alternative of it.
+
+    >>> [COLOURS[c] for c in parse_colours("Yellow > Green/Brown.")]
+    ['yellow', 'green', 'brown']
+    >>> [COLOURS[c] for c in parse_colours("Fizzes Pale Orange (Or Violet)")]
+    ['orange', 'purple']
+    >>> [COLOURS[c] for c in parse_colours("No colour change.")]
+    ['no colour change']
+    """
+    text = text.lower()
+    codes = []
+    if _NO_CHANGE.search(text):
+        codes.append(COLOURS.index(NO_CHANGE))
+        text = _NO_CHANGE.sub(" ", text)
+    for word in _WORD.findall(text):
+        colour = _COLOUR_WORDS.get(word, word)
+        if colour in COLOURS and COLOURS.index(colour) not in codes:
+            codes.append(COLOURS.index(colour))
+    return codes
+
+
+def parse_reagents(reagents: Optional[Text]) -> Dict[int, List[int]]:
+    """Reagent code -> colour codes of a substance's ``reagents`` string.
+
+    >>> parse_reagents("Marquis: Faint Brown. | Simon's Red > Brown. | Ehrlich's Reagent: ")
+    {0: [3], 6: [9, 3]}
+    """
+    results = {}
+    for test in (reagents or "").split("|"):
+        match = _REAGENT.search(test)
+        colours = parse_colours(test[match.end() :]) if match else []
+        if colours:
+            results[_REAGENT_CODES[match.group(1).lower()]] = colours
+    return results
+
+
+def parse_observation(text: Text) -> Dict[int, List[int]]:
+    """Reagent code -> colour codes of what someone says they saw.
+
+    Each reagent takes the colours between it and the previous reagent or
+    clause break, or after it when there are none before it.
+
+    >>> parse_observation("I got dark purple on Marquis and nothing on Mandelin, what could it be")
+    {0: [8], 2: [0]}
+    >>> parse_observation("marquis went orange then black, mecke: green")
+    {0: [6, 1], 1: [5]}
+    """
+    clauses = re.split(r"\s*(?:[,;.]|\band\b|\bbut\b)\s*", text)
+    observed = {}
+    for clause in clauses:
+        mentions = list(_REAGENT.finditer(clause))
+        previous = 0
+        for i, match in enumerate(mentions):
+            colours = parse_colours(clause[previous : match.start()])
+            if not colours:
+                end = mentions[i + 1].start() if i + 1 < len(mentions) else len(clause)
+                colours = parse_colours(clause[match.end() : end])
+            previous = match.end()
+            if colours:
+                observed[_REAGENT_CODES[match.group(1).lower()]] = colours
+    return observed
+
+
+def build_reagent_index(substances: List[Dict[Text, Any]]) -> Dict[Text, np.ndarray]:
+    """Packed substance bitsets per (reagent, colour) and per tested reagent."""
+    substances = sorted(substances, key=lambda s: s["id"])
+    can_show = np.zeros((len(REAGENTS), len(COLOURS), len(substances)), dtype=bool)
+    tested = np.zeros((len(REAGENTS), len(substances)), dtype=bool)
+    unparsed = []
+    for position, substance in enumerate(substances):
+        results = parse_reagents(substance.get("reagents"))
+        for reagent, colours in results.items():
+            tested[reagent, position] = True
+            can_show[reagent, colours, position] = True
+        unparsed += [
+            test.strip()
+            for test in (substance.get("reagents") or "").split("|")
+            if test.strip() and parse_reagents(test) == {}
+        ]
+
+    return {
+        "reagents": np.array(REAGENTS),
+        "colours": np.array(COLOURS),
+        "can_show": np.packbits(can_show, axis=-1),
+        "tested": np.packbits(tested, axis=-1),
+        "substance_ids": np.array([s["id"] for s in substances], dtype=np.int32),
+        "unparsed": np.array(unparsed),
+        "data_key": np.array(data_key(substances)),
+    }
+
+
+def save_reagent_index(path: Text, index: Dict[Text, np.ndarray]) -> None:
+    with open(path, "wb") as f:
+        np.savez(f, **index)
+
+
+class ReagentMatch(NamedTuple):
+    substance_id: int
+    # observed reagents whose known result includes the observed colour
+    matched: int
+    # observed reagents with no known result for the substance
+    unknown: int
+
+
+class ReagentIndex:
+    """Read side of ``reagent_index.npz``."""
+
+    def __init__(self, index: Dict[Text, np.ndarray]) -> None:
+        self.reagents = [str(r) for r in index["reagents"]]
+        self.colours = [str(c) for c in index["colours"]]
+        self.can_show = index["can_show"]
+        self.tested = index["tested"]
+        self.substance_ids = index["substance_ids"]
+        self.positions = {int(i): p for p, i in enumerate(self.substance_ids)}
+        self.data_key = str(index["data_key"]) if "data_key" in index else None
+
+    @classmethod
+    def load(cls, path: Text) -> "ReagentIndex":
+        with np.load(path) as index:
+            return cls({key: index[key] for key in index.files})
+
+    def _bits(self, packed: np.ndarray) -> np.ndarray:
+        return np.unpackbits(packed, axis=-1, count=len(self.substance_ids))
+
+    def candidates(self, observed: Dict[int, List[int]]) -> List[ReagentMatch]:
+        """Substances consistent with every observation and matching at least one, best first."""
+        allowed = np.full(self.tested.shape[1], 0xFF, dtype=np.uint8)
+        matched = np.zeros(len(self.substance_ids), dtype=np.int32)
+        for reagent, colours in observed.items():
+            consistent = np.bitwise_or.reduce(self.can_show[reagent, colours], axis=0)
+            allowed &= consistent | ~self.tested[reagent]
+            matched += self._bits(consistent)
+
+        positions = np.flatnonzero(self._bits(allowed).astype(bool) & (matched > 0))
+        order = np.argsort(-matched[positions], kind="stable")
+        return [
+            ReagentMatch(
+                int(self.substance_ids[p]),
+                int(matched[p]),
+                len(observed) - int(matched[p]),
+            )
+            for p in positions[order]
+        ]
+
+    def identify(self, text: Text) -> Tuple[Dict[Text, List[Text]], List[ReagentMatch]]:
+        """What a message says was observed, by name, and the substances that fit it."""
+        observed = parse_observation(text)
+        named = {
+            self.reagents[r]: [self.colours[c] for c in colours]
+            for r, colours in observed.items()
+        }
+        return named, self.candidates(observed) if observed else []
+
+    def results(self, substance_id: int) -> Dict[Text, List[Text]]:
+        """Known results of a substance, reagent -> colours it can show."""
+        position = self.positions.get(substance_id)
+        if position is None:
+            return {}
+        byte, bit = divmod(position, 8)
+        mask = np.uint8(0x80 >> bit)
+        return {
+            reagent: [
+                colour
+                for c, colour in enumerate(self.colours)
+                if self.can_show[r, c, byte] & mask
+            ]
+            for r, reagent in enumerate(self.reagents)
+            if self.tested[r, byte] & mask
+        }
@@ -0,0 +1,117 @@
+"""Cache answers that only depend on the substance data.
+
+For a given data version, the answer about a substance is the same every
+time, and most questions are about the same few dozen substances. Caching
+the rendered answer under ``(substance id, answer type, data version)`` lets
+a repeated question skip loading the record and formatting it.
+
+Entries are evicted least recently used first once ``max_size`` is reached,
+and expire ``ttl`` seconds after they were stored. The data version in the key
+already keeps old answers from being served after a reload; clearing the
+cache on reload (``KnowledgeBaseReloader.on_reload``) frees them too.
+
+The counters are logged every ``log_interval`` seconds, on the lookup that
+finds the interval has passed.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Text
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class ResponseCache:
+    """LRU cache with a time to live, counting hits, misses and evictions.
+
+    ``max_size`` 0 disables caching, ``ttl`` 0 keeps entries until they're
+    evicted or the cache is cleared.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 512,
+        ttl: float = 3600.0,
+        log_interval: float = 300.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.log_interval = log_interval
+        self.clock = clock
+        self.last_log = clock()
+        # the reloader clears the cache from its own thread
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.clears = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value = self._lookup(key, default)
+        if self.clock() - self.last_log >= self.log_interval:
+            self.last_log = self.clock()
+            logger.info(f"Substance answer cache: {self.stats()}")
+        return value
+
+    def _lookup(self, key: Hashable, default: Any) -> Any:
+        with self.lock:
+            entry = self.entries.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            stored_at, value = entry
+            if self.ttl > 0 and self.clock() - stored_at > self.ttl:
+                del self.entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (self.clock(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """Cached value for ``key``, computing and storing it on a miss."""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.clears += 1
+
+    def stats(self) -> Dict[Text, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "clears": self.clears,
+            }
@@ -0,0 +1,238 @@
+"""Full-text search over what the knowledge base says about each substance.
+
+Questions like "what turns marquis purple" or "which stimulants cause liver
+toxicity" don't name a substance. The data pipeline builds a BM25 inverted
+index over the summary, reagent results, toxicity, classes and addiction
+potential of every substance and stores it with NumPy in
+``ts_pn_data/search_index.npz``: the sorted vocabulary, one posting list per
+term (CSR style, ``offsets`` into ``documents``) and the BM25 weight of every
+posting, computed at build time. A query is a handful of slice additions into
+a score array and an ``argpartition`` for the top k.
+
+Fields are weighted before BM25 sees them, so a term in a substance's classes
+counts as much as two in its summary. Reagent results also index every colour
+word together with its reagent ("marqui:purple"), and a query looks those up
+for every pair of its words, so "marquis purple" finds substances that turn
+Marquis purple rather than ones that turn Marquis brown and Ehrlich purple.
+
+The ``data_key`` of the substances it was built from is stored with it, hits
+are substance ids and only mean the same with that knowledge base.
+"""
+
+import math
+import re
+from typing import Any, Dict, Iterator, List, NamedTuple, Text
+
+import numpy as np
+
+from actions.knowledge_base import data_key
+
+# field -> weight of a term occurring in it
+FIELDS = {
+    "summary": 1.0,
+    "reagents": 1.0,
+    "toxicity": 1.0,
+    "classes": 2.0,
+    "addictionPotential": 1.0,
+}
+# a reagent's result, like a class, is worth more than a word in the text around it
+REAGENT_RESULT = 3.0
+K1 = 1.2
+B = 0.75
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+# question words and filler, everything else is left to the idf
+STOP_WORDS = {
+    "a",
+    "an",
+    "and",
+    "any",
+    "are",
+    "as",
+    "be",
+    "can",
+    "do",
+    "does",
+    "drug",
+    "drugs",
+    "for",
+    "give",
+    "i",
+    "in",
+    "is",
+    "it",
+    "like",
+    "me",
+    "of",
+    "on",
+    "or",
+    "show",
+    "similar",
+    "something",
+    "substance",
+    "substances",
+    "that",
+    "the",
+    "to",
+    "what",
+    "which",
+    "with",
+}
+
+
+def stem(token: Text) -> Text:
+    """Folds plurals, so "stimulants" finds the "Stimulants" class and "stimulant" too.
+
+    >>> [stem(t) for t in ["stimulants", "entactogens", "opioids", "amphetamines"]]
+    ['stimulant', 'entactogen', 'opioid', 'amphetamine']
+    >>> [stem(t) for t in ["properties", "glass", "lsd"]]
+    ['property', 'glass', 'lsd']
+    """
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 3 and token.endswith("s") and not token.endswith(("ss", "us")):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: Text) -> List[Text]:
+    return [
+        stem(token) for token in _TOKEN.findall(text.lower()) if token not in STOP_WORDS
+    ]
+
+
+def field_text(substance: Dict[Text, Any], field: Text) -> Text:
+    value = substance.get(field)
+    if isinstance(value, dict):
+        # classes: {"chemical": [...], "psychoactive": [...]}
+        value = [item for items in value.values() for item in items or []]
+    if isinstance(value, list):
+        value = " ".join(str(item) for item in value)
+    # class names are written like "Substituted_amphetamines"
+    return (value or "").replace("_", " ")
+
+
+def reagent_terms(reagents: Text) -> Iterator[Text]:
+    """ "reagent:word" for every word of each reagent's result.
+
+    >>> list(reagent_terms("Marquis: Slow Purple. | Ehrlich's Reagent: No colour change."))
+    ['marqui:slow', 'marqui:purple', 'ehrlich:no', 'ehrlich:colour', 'ehrlich:change']
+    """
+    for test in reagents.split("|"):
+        reagent, _, result = test.partition(":")
+        reagent = tokenize(reagent)
+        if reagent:
+            for token in tokenize(result):
+                yield f"{reagent[0]}:{token}"
+
+
+def query_terms(query: Text) -> List[Text]:
+    """Terms of a query, its words then every ordered pair of them for reagent results."""
+    tokens = tokenize(query)
+    pairs = [f"{a}:{b}" for i, a in enumerate(tokens) for b in tokens[i + 1 :]]
+    return tokens + pairs
+
+
+def document_terms(substance: Dict[Text, Any]) -> Dict[Text, float]:
+    """Field-weighted term frequencies of a substance."""
+    terms = {}
+    for field, weight in FIELDS.items():
+        for token in tokenize(field_text(substance, field)):
+            terms[token] = terms.get(token, 0.0) + weight
+    for term in reagent_terms(substance.get("reagents") or ""):
+        terms[term] = terms.get(term, 0.0) + REAGENT_RESULT
+    return terms
+
+
+def build_search_index(substances: List[Dict[Text, Any]]) -> Dict[Text, np.ndarray]:
+    """Vocabulary, posting lists and BM25 weights for all substances."""
+    substances = sorted(substances, key=lambda s: s["id"])
+    documents = [document_terms(substance) for substance in substances]
+    lengths = np.array([sum(terms.values()) for terms in documents], dtype=np.float64)
+    average_length = lengths.mean() if len(lengths) and lengths.mean() else 1.0
+
+    postings: Dict[Text, List[int]] = {}
+    for document, terms in enumerate(documents):
+        for term in terms:
+            postings.setdefault(term, []).append(document)
+
+    vocabulary = sorted(postings)
+    offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+    posting_documents = []
+    weights = []
+    for row, term in enumerate(vocabulary):
+        found = postings[term]
+        offsets[row + 1] = offsets[row] + len(found)
+        idf = math.log(1 + (len(documents) - len(found) + 0.5) / (len(found) + 0.5))
+        for document in found:
+            frequency = documents[document][term]
+            norm = K1 * (1 - B + B * lengths[document] / average_length)
+            weights.append(idf * frequency * (K1 + 1) / (frequency + norm))
+            posting_documents.append(document)
+
+    return {
+        "vocabulary": np.array(vocabulary, dtype=str),
+        "offsets": offsets,
+        "documents": np.array(posting_documents, dtype=np.int32),
+        "weights": np.array(weights, dtype=np.float32),
+        "substance_ids": np.array([s["id"] for s in substances], dtype=np.int32),
+        "data_key": np.array(data_key(substances)),
+    }
+
+
+def save_search_index(path: Text, index: Dict[Text, np.ndarray]) -> None:
+    with open(path, "wb") as f:
+        np.savez(f, **index)
+
+
+class SearchHit(NamedTuple):
+    substance_id: int
+    score: float
+
+
+class SearchIndex:
+    """Read side of ``search_index.npz``."""
+
+    def __init__(self, index: Dict[Text, np.ndarray]) -> None:
+        self.rows = {str(term): row for row, term in enumerate(index["vocabulary"])}
+        self.offsets = index["offsets"]
+        self.documents = index["documents"]
+        self.weights = index["weights"]
+        self.substance_ids = index["substance_ids"]
+        self.data_key = str(index["data_key"]) if "data_key" in index else None
+
+    @classmethod
+    def load(cls, path: Text) -> "SearchIndex":
+        with np.load(path) as index:
+            return cls({key: index[key] for key in index.files})
+
+    def __len__(self) -> int:
+        return len(self.substance_ids)
+
+    def terms(self, query: Text) -> Iterator[int]:
+        """Rows of the distinct query terms that are in the index."""
+        seen = set()
+        for term in query_terms(query):
+            row = self.rows.get(term)
+            if row is not None and row not in seen:
+                seen.add(row)
+                yield row
+
+    def search(self, query: Text, k: int = 5) -> List[SearchHit]:
+        """The ``k`` best matching substances, best first, only ones sharing a term with the query."""
+        scores = np.zeros(len(self.substance_ids), dtype=np.float32)
+        for row in self.terms(query):
+            start, end = self.offsets[row], self.offsets[row + 1]
+            # a posting list names each document once, so this adds every weight
+            scores[self.documents[start:end]] += self.weights[start:end]
+
+        matched = int(np.count_nonzero(scores))
+        k = min(k, matched)
+        if k <= 0:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [
+            SearchHit(int(self.substance_ids[document]), float(scores[document]))
+            for document in best
+        ]
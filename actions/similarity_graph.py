@@ -0,0 +1,231 @@
+"""Similar substances and cross-tolerances from classes.
+
+PsychonautWiki gives substances chemical and psychoactive classes and lists
+cross-tolerances by class name ("stimulant", "serotonergic",
+"benzodiazepines"). The data pipeline resolves every cross-tolerance name to
+a tolerance group of substance ids: the substances in the class of that name
+plus the ones that list it themselves. It then ranks each substance's
+neighbours by the classes and tolerance groups they share, each weighted by
+how rare it is, and stores both in ``ts_pn_data/similarity_graph.npz`` as CSR
+arrays:
+
+* ``neighbours`` / ``neighbour_scores`` at ``neighbour_offsets[i]:[i + 1]``,
+  the top k neighbours of substance ``i`` best first,
+* ``members`` at ``member_offsets[g]:[g + 1]``, the substances in tolerance
+  group ``g``, and ``listed`` at ``listed_offsets[i]:[i + 1]``, the groups
+  substance ``i`` lists as cross-tolerances.
+
+Building scores every substance a substance shares a feature with, adding up
+the shared weights through the postings of its features, and only then keeps
+the best ``k``: a candidate list cut short before scoring would be cut in id
+order and leave out the substances added last. The broad classes
+("Psychedelics") make this quadratic in the substances they hold, about 30ms
+for the ~600 known. Like the other indexes it stores the ``data_key`` of the
+substances it was built from.
+"""
+
+import heapq
+import math
+from typing import Any, Dict, List, NamedTuple, Set, Text, Tuple
+
+import numpy as np
+
+from actions.knowledge_base import data_key
+
+# names of one tolerance group, after lowercasing and dropping a plural "s"
+_SYNONYMS = {
+    "dopaminergic": "dopamine",
+    "serotonergic": "serotonin",
+    "gabaergic": "gaba",
+    "noradrenergic": "norepinephrine",
+    "thienzodiazepine": "thienodiazepine",
+    "trycyclic antidepressant": "tricyclic antidepressant",
+}
+
+
+def group_name(name: Text) -> Text:
+    """The tolerance group a cross-tolerance or class name belongs to.
+
+    >>> [group_name(n) for n in ["Stimulants", "stimulant", "GABAergic", "Substituted_tryptamines"]]
+    ['stimulant', 'stimulant', 'gaba', 'substituted tryptamine']
+    """
+    name = " ".join(name.lower().replace("_", " ").split())
+    if name.endswith("s") and not name.endswith("ss"):
+        name = name[:-1]
+    return _SYNONYMS.get(name, name)
+
+
+def cross_tolerances(substance: Dict[Text, Any]) -> List[Text]:
+    """Tolerance groups a substance lists, "serotonin|serotonergic" being one."""
+    groups = []
+    for listed in substance.get("crossTolerances") or []:
+        names = {group_name(name) for name in listed.split("|") if name.strip()}
+        # alternatives are the same group under a name and its adjective, keep the shortest
+        if names:
+            group = min(names, key=lambda n: (len(n), n))
+            if group not in groups:
+                groups.append(group)
+    return groups
+
+
+def class_names(substance: Dict[Text, Any]) -> List[Tuple[Text, Text]]:
+    """(kind, group name) of the chemical and psychoactive classes of a substance."""
+    classes = substance.get("classes") or {}
+    return [
+        (kind, group_name(name))
+        for kind in ["chemical", "psychoactive"]
+        for name in classes.get(kind) or []
+    ]
+
+
+def _csr(rows: List[List[Any]], dtype) -> Tuple[np.ndarray, np.ndarray]:
+    offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(row) for row in rows])
+    values = [value for row in rows for value in row]
+    return offsets, np.array(values, dtype=dtype)
+
+
+def build_similarity_graph(
+    substances: List[Dict[Text, Any]], k: int = 10
+) -> Dict[Text, np.ndarray]:
+    """Tolerance groups and top ``k`` neighbour lists for all substances."""
+    substances = sorted(substances, key=lambda s: s["id"])
+
+    listed = [cross_tolerances(substance) for substance in substances]
+    groups = sorted({group for names in listed for group in names})
+    group_codes = {group: code for code, group in enumerate(groups)}
+    members: List[Set[int]] = [set() for _ in groups]
+    features: List[Set[Text]] = []
+    for position, substance in enumerate(substances):
+        own = {f"{kind}:{name}" for kind, name in class_names(substance)}
+        for _, name in class_names(substance):
+            if name in group_codes:
+                members[group_codes[name]].add(position)
+        for name in listed[position]:
+            members[group_codes[name]].add(position)
+        features.append(own)
+    for code, group in enumerate(groups):
+        for position in members[code]:
+            features[position].add(f"tolerance:{group}")
+
+    postings: Dict[Text, List[int]] = {}
+    for position, own in enumerate(features):
+        for feature in own:
+            postings.setdefault(feature, []).append(position)
+    weight = {
+        feature: math.log(len(substances) / len(found))
+        for feature, found in postings.items()
+    }
+    norms = [math.sqrt(sum(weight[f] ** 2 for f in own)) for own in features]
+
+    neighbours, scores = [], []
+    for position, own in enumerate(features):
+        shared: Dict[int, float] = {}
+        for feature in own:
+            feature_weight = weight[feature] ** 2
+            for other in postings[feature]:
+                shared[other] = shared.get(other, 0.0) + feature_weight
+        shared.pop(position, None)
+
+        best = heapq.nlargest(
+            k,
+            (
+                (total / (norms[position] * norms[other] or 1.0), -other)
+                for other, total in shared.items()
+            ),
+        )
+        best = [(s, -other) for s, other in best if s > 0]
+        neighbours.append([other for _, other in best])
+        scores.append([s for s, _ in best])
+
+    neighbour_offsets, neighbour_positions = _csr(neighbours, np.int32)
+    _, neighbour_scores = _csr(scores, np.float32)
+    member_offsets, member_positions = _csr(
+        [sorted(found) for found in members], np.int32
+    )
+    listed_offsets, listed_groups = _csr(
+        [[group_codes[name] for name in names] for names in listed], np.int32
+    )
+    return {
+        "substance_ids": np.array([s["id"] for s in substances], dtype=np.int32),
+        "neighbour_offsets": neighbour_offsets,
+        "neighbours": neighbour_positions,
+        "neighbour_scores": neighbour_scores,
+        "groups": np.array(groups, dtype=str),
+        "member_offsets": member_offsets,
+        "members": member_positions,
+        "listed_offsets": listed_offsets,
+        "listed": listed_groups,
+        "data_key": np.array(data_key(substances)),
+    }
+
+
+def save_similarity_graph(path: Text, graph: Dict[Text, np.ndarray]) -> None:
+    with open(path, "wb") as f:
+        np.savez(f, **graph)
+
+
+class Neighbour(NamedTuple):
+    substance_id: int
+    score: float
+
+
+class SimilarityGraph:
+    """Read side of ``similarity_graph.npz``, queried by substance id."""
+
+    def __init__(self, graph: Dict[Text, np.ndarray]) -> None:
+        self.substance_ids = graph["substance_ids"]
+        self.positions = {int(i): p for p, i in enumerate(self.substance_ids)}
+        self.neighbour_offsets = graph["neighbour_offsets"]
+        self.neighbours = graph["neighbours"]
+        self.neighbour_scores = graph["neighbour_scores"]
+        self.groups = [str(g) for g in graph["groups"]]
+        self.member_offsets = graph["member_offsets"]
+        self.members = graph["members"]
+        self.listed_offsets = graph["listed_offsets"]
+        self.listed = graph["listed"]
+        self.data_key = str(graph["data_key"]) if "data_key" in graph else None
+
+    @classmethod
+    def load(cls, path: Text) -> "SimilarityGraph":
+        with np.load(path) as graph:
+            return cls({key: graph[key] for key in graph.files})
+
+    def similar(self, substance_id: int, k: int = 5) -> List[Neighbour]:
+        """Up to ``k`` most similar substances, most similar first."""
+        position = self.positions.get(substance_id)
+        if position is None:
+            return []
+        start = self.neighbour_offsets[position]
+        end = min(self.neighbour_offsets[position + 1], start + k)
+        return [
+            Neighbour(int(self.substance_ids[other]), float(score))
+            for other, score in zip(
+                self.neighbours[start:end], self.neighbour_scores[start:end]
+            )
+        ]
+
+    def _listed(self, position: int) -> np.ndarray:
+        return self.listed[
+            self.listed_offsets[position] : self.listed_offsets[position + 1]
+        ]
+
+    def _is_member(self, group: int, position: int) -> bool:
+        found = self.members[
+            self.member_offsets[group] : self.member_offsets[group + 1]
+        ]
+        i = np.searchsorted(found, position)
+        return i < len(found) and found[i] == position
+
+    def cross_tolerance(self, substance_id: int, other_id: int) -> List[Text]:
+        """Tolerance groups through which one of the substances lists the other, empty if none."""
+        a, b = self.positions.get(substance_id), self.positions.get(other_id)
+        if a is None or b is None:
+            return []
+        shared = {
+            int(group)
+            for position, other in [(a, b), (b, a)]
+            for group in self._listed(position)
+            if self._is_member(group, other)
+        }
+        return [self.groups[group] for group in sorted(shared)]
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+# measures request latency of a warm action server answering what_is_substance
+#
+#   rasa run actions &
+#   python3 benchmarks/bench_action_server.py --requests 2000 --concurrency 4
+#
+# substances are drawn from substances_data.json names and aliases (plus a few unknown names),
+# and a warmup round runs first so only the steady state is measured
+
+import argparse
+import json
+import os
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+parser = argparse.ArgumentParser(description="benchmark the action server")
+parser.add_argument("--url", default="http://localhost:5055/webhook")
+parser.add_argument("--action", default="action_what_is_substance")
+parser.add_argument("--requests", type=int, default=1000)
+parser.add_argument("--warmup", type=int, default=50)
+parser.add_argument("--concurrency", type=int, default=1)
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument(
+    "--data",
+    default=os.path.join(
+        os.path.dirname(__file__), "..", "ts_pn_data", "substances_data.json"
+    ),
+)
+
+
+def action_call(action, substance):
+    """the webhook payload rasa sends for a message naming a substance"""
+    entities = [{"entity": "substance", "value": substance}]
+    return {
+        "next_action": action,
+        "sender_id": "benchmark",
+        "tracker": {
+            "sender_id": "benchmark",
+            "slots": {"substance": substance},
+            "latest_message": {
+                "text": f"what is {substance}",
+                "intent": {"name": "what_is_substance", "confidence": 1.0},
+                "entities": entities,
+            },
+            "events": [],
+            "paused": False,
+            "followup_action": None,
+            "active_loop": {},
+            "latest_action_name": "action_listen",
+        },
+        "domain": {},
+        "version": "2.0.0",
+    }
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    rnd = random.Random(args.seed)
+    with open(args.data) as f:
+        substances = json.load(f)["substances"]
+    names = [s["name"] for s in substances] + [
+        a for s in substances for a in s["aliases"]
+    ]
+    names += ["not a real substance"] * (len(names) // 50)
+
+    session = requests.Session()
+
+    def call(substance):
+        start = time.perf_counter()
+        response = session.post(args.url, json=action_call(args.action, substance))
+        response.raise_for_status()
+        return (time.perf_counter() - start) * 1000
+
+    for _ in range(args.warmup):
+        call(rnd.choice(names))
+
+    sample = [rnd.choice(names) for _ in range(args.requests)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        latencies = sorted(executor.map(call, sample))
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"{len(latencies)} requests, concurrency {args.concurrency}: "
+        f"{len(latencies) / elapsed:.0f} req/s, "
+        f"mean {statistics.mean(latencies):.2f}ms, "
+        f"p50 {percentile(latencies, 50):.2f}ms, "
+        f"p95 {percentile(latencies, 95):.2f}ms, "
+        f"p99 {percentile(latencies, 99):.2f}ms"
+    )
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+
+# end-to-end latency, throughput and memory of the bot, saved as json to compare runs with
+#
+#   rasa train && rasa run --enable-api &
+#   python3 benchmarks/bench_bot.py --start-action-server --pid rasa=$(pgrep -f "rasa run") \
+#       --concurrency 1 4 16 --output before.json
+#   # change config.yml, retrain, restart rasa
+#   python3 benchmarks/bench_bot.py ... --output after.json --compare before.json
+#
+# the message corpus is every example in data/nlu.yml and data/kb_query.yml with the entity
+# annotations stripped, shuffled with --seed (--save-corpus/--corpus write and replay it as json
+# lines, so the same messages can be sent to different models). two targets are measured:
+#
+#   rest     each message posted to rasa's REST channel, which runs the NLU pipeline and policies
+#            and calls the action server when a story or rule needs it
+#   actions  messages naming a substance sent straight to the action server as the webhook call
+#            rasa would make for action_what_is_substance
+#
+# --start-action-server runs the actions package on the local rasa_sdk server (port 5055, where
+# endpoints.yml points rasa) for the duration of the run, otherwise servers already running at
+# --rasa-url/--action-url are used and a target that doesn't answer is skipped. memory is the RSS
+# of the action server it started and every --pid, sampled while each level runs
+
+import argparse
+import json
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+
+import requests
+
+from bench_action_server import action_call, percentile
+
+repo_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+parser = argparse.ArgumentParser(description="benchmark the bot end to end")
+parser.add_argument("--rasa-url", default="http://localhost:5005")
+parser.add_argument("--action-url", default="http://localhost:5055")
+parser.add_argument("--targets", nargs="+", default=["rest", "actions"])
+parser.add_argument("--requests", type=int, default=500, help="messages per level")
+parser.add_argument("--warmup", type=int, default=20)
+parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4])
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument(
+    "--data",
+    nargs="+",
+    default=[
+        os.path.join(repo_root, "data", "nlu.yml"),
+        os.path.join(repo_root, "data", "kb_query.yml"),
+    ],
+)
+parser.add_argument("--corpus", help="replay messages from this json lines file")
+parser.add_argument("--save-corpus", help="write the messages used to this file")
+parser.add_argument(
+    "--start-action-server",
+    action="store_true",
+    help="run the actions package on a local action server while benchmarking",
+)
+parser.add_argument(
+    "--pid",
+    action="append",
+    default=[],
+    help="NAME=PID of another process to track the memory of, e.g. the rasa server",
+)
+parser.add_argument("--output", help="write the results here as json")
+parser.add_argument("--compare", help="results json of an earlier run to compare with")
+
+example = re.compile(r"^\s*- (.*)$")
+intent_header = re.compile(r"^- intent: (.*)$")
+# [text](entity), [text](entity:value) and [text]{"entity": ..., "value": ...}
+annotation = re.compile(r"\[([^\]]*)\](?:\(([^)]*)\)|(\{[^}]*\}))")
+
+
+def parse_example(text):
+    """an annotated training example -> the plain message and its entities"""
+    entities = []
+
+    def strip(match):
+        value, entity = match.group(1), match.group(2)
+        if entity is not None:
+            entity, _, synonym = entity.partition(":")
+            entities.append({"entity": entity, "value": synonym or value})
+        else:
+            data = json.loads(match.group(3))
+            entities.append(
+                {"entity": data.get("entity"), "value": data.get("value", value)}
+            )
+        return value
+
+    return annotation.sub(strip, text), entities
+
+
+def build_corpus(paths):
+    messages = []
+    for path in paths:
+        intent = None
+        with open(path) as f:
+            for line in f:
+                header = intent_header.match(line.rstrip())
+                if header:
+                    intent = header.group(1)
+                    continue
+                match = example.match(line.rstrip())
+                if intent and match and line.startswith("    "):
+                    text, entities = parse_example(match.group(1))
+                    messages.append(
+                        {"text": text, "intent": intent, "entities": entities}
+                    )
+    return messages
+
+
+def read_corpus(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_corpus(path, messages):
+    with open(path, "w") as f:
+        for message in messages:
+            f.write(json.dumps(message, ensure_ascii=False) + "\n")
+
+
+def memory(pid):
+    """current and peak RSS of a process in KiB"""
+    status = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "VmHWM"):
+                status[key] = int(value.split()[0])
+    return status
+
+
+class MemorySampler(threading.Thread):
+    """highest RSS each process reaches while a level runs"""
+
+    def __init__(self, pids, interval=0.05):
+        super().__init__(daemon=True)
+        self.pids = pids
+        self.interval = interval
+        self.peaks = {name: 0 for name in pids}
+        self.stopped = threading.Event()
+
+    def sample(self):
+        for name, pid in self.pids.items():
+            try:
+                rss = memory(pid)["VmRSS"]
+            except OSError:
+                continue
+            self.peaks[name] = max(self.peaks[name], rss)
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.sample()
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.sample()
+        return {
+            name: {"peak_rss_kib": peak, **memory_or_none(self.pids[name])}
+            for name, peak in self.peaks.items()
+        }
+
+
+def memory_or_none(pid):
+    try:
+        status = memory(pid)
+    except OSError:
+        return {}
+    return {"rss_kib": status["VmRSS"], "hwm_kib": status["VmHWM"]}
+
+
+def rest_request(args, session, message, sender):
+    response = session.post(
+        f"{args.rasa_url}/webhooks/rest/webhook",
+        json={"sender": sender, "message": message["text"]},
+    )
+    response.raise_for_status()
+
+
+def action_request(args, session, message, sender):
+    substance = next(
+        e["value"] for e in message["entities"] if e["entity"] == "substance"
+    )
+    call = action_call("action_what_is_substance", substance)
+    call["sender_id"] = call["tracker"]["sender_id"] = sender
+    response = session.post(f"{args.action_url}/webhook", json=call)
+    response.raise_for_status()
+
+
+targets = {
+    "rest": (rest_request, lambda m: True, lambda args: f"{args.rasa_url}/"),
+    "actions": (
+        action_request,
+        lambda m: any(e["entity"] == "substance" for e in m["entities"]),
+        lambda args: f"{args.action_url}/health",
+    ),
+}
+
+
+def available(url):
+    try:
+        return requests.get(url, timeout=5).ok
+    except requests.RequestException:
+        return False
+
+
+def run_level(args, send, messages, concurrency, pids):
+    """send every message once, concurrency at a time, each worker as its own conversation"""
+    local = threading.local()
+
+    def call(indexed):
+        i, message = indexed
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        sender = f"benchmark-{concurrency}-{i % concurrency}"
+        start = time.perf_counter()
+        try:
+            send(args, local.session, message, sender)
+        except requests.RequestException:
+            return None
+        return (time.perf_counter() - start) * 1000
+
+    sampler = MemorySampler(pids)
+    sampler.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(call, enumerate(messages)))
+    elapsed = time.perf_counter() - start
+    latencies = sorted(r for r in results if r is not None)
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(messages),
+        "errors": len(messages) - len(latencies),
+        "elapsed_s": elapsed,
+        "messages_per_s": len(latencies) / elapsed,
+        "latency_ms": {
+            "mean": statistics.mean(latencies) if latencies else None,
+            "p50": percentile(latencies, 50) if latencies else None,
+            "p95": percentile(latencies, 95) if latencies else None,
+            "p99": percentile(latencies, 99) if latencies else None,
+            "max": latencies[-1] if latencies else None,
+        },
+        "memory": sampler.stop(),
+    }
+
+
+def start_action_server(args):
+    port = args.action_url.rsplit(":", 1)[-1].split("/")[0]
+    server = subprocess.Popen(
+        [sys.executable, "-m", "rasa_sdk", "--actions", "actions", "--port", port],
+        cwd=repo_root,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 60
+    while not available(f"{args.action_url}/health"):
+        if server.poll() is not None or time.time() > deadline:
+            server.kill()
+            sys.exit(f"action server didn't start on port {port}")
+        time.sleep(0.2)
+    return server
+
+
+def file_digest(path):
+    with open(path, "rb") as f:
+        return sha256(f.read()).hexdigest()
+
+
+def describe_run(args, corpus):
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=repo_root,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": commit,
+        "config_sha256": file_digest(os.path.join(repo_root, "config.yml")),
+        "corpus_messages": len(corpus),
+        "seed": args.seed,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+    }
+
+
+def report(target, level, baseline=None):
+    latency = level["latency_ms"]
+    line = (
+        f"{target:<8} x{level['concurrency']:<3} "
+        f"{level['messages_per_s']:8.1f} msg/s  "
+        f"p50 {latency['p50'] or 0:8.2f}ms  p95 {latency['p95'] or 0:8.2f}ms  "
+        f"p99 {latency['p99'] or 0:8.2f}ms  errors {level['errors']}"
+    )
+    if baseline and baseline["latency_ms"]["p50"] and latency["p50"]:
+        change = lambda new, old: f"{(new - old) / old * 100:+.0f}%"  # noqa: E731
+        line += (
+            f"  (vs baseline: {change(level['messages_per_s'], baseline['messages_per_s'])} msg/s, "
+            f"p50 {change(latency['p50'], baseline['latency_ms']['p50'])}, "
+            f"p99 {change(latency['p99'], baseline['latency_ms']['p99'])})"
+        )
+    print(line)
+    for name, usage in level["memory"].items():
+        print(f"{'':13}{name} rss peak {usage['peak_rss_kib'] / 1024:.0f} MiB")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    rnd = random.Random(args.seed)
+    if args.corpus:
+        corpus = read_corpus(args.corpus)
+    else:
+        corpus = build_corpus(args.data)
+        rnd.shuffle(corpus)
+    if args.save_corpus:
+        write_corpus(args.save_corpus, corpus)
+
+    pids = dict(pid.split("=", 1) for pid in args.pid)
+    server = start_action_server(args) if args.start_action_server else None
+    if server:
+        pids["action-server"] = server.pid
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            for result in json.load(f)["results"]:
+                for level in result["levels"]:
+                    baseline[result["target"], level["concurrency"]] = level
+
+    results = []
+    try:
+        for target in args.targets:
+            send, wanted, health_url = targets[target]
+            if not available(health_url(args)):
+                print(f"{target:<8} skipped, nothing answering at {health_url(args)}")
+                continue
+            messages = [m for m in corpus if wanted(m)]
+            if not messages:
+                print(f"{target:<8} skipped, no messages in the corpus for it")
+                continue
+            # cycle through the corpus so every level sends the same messages
+            sample = [messages[i % len(messages)] for i in range(args.requests)]
+            run_level(args, send, messages[: args.warmup], 1, {})
+
+            levels = []
+            for concurrency in args.concurrency:
+                level = run_level(args, send, sample, concurrency, pids)
+                report(target, level, baseline.get((target, concurrency)))
+                levels.append(level)
+            results.append({"target": target, "levels": levels})
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {"run": describe_run(args, corpus), "results": results}, f, indent=2
+            )
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+# checks that the knowledge base, lookup and intent exports stream instead of holding all the
+# substance data in memory
+#
+#   python3 benchmarks/bench_export_memory.py --substances 50000
+#
+# a synthetic merged dataset is made by copying the real substances under new names, then each way
+# of exporting runs in a fresh interpreter and reports its peak RSS above what it had after imports:
+#
+#   buffered   json.load the merged data, json.dump it as one dict, build the intents as one string
+#              (what the exports did before)
+#   streaming  read_records into write_kb, write_lookups and write_intents
+#
+# the outputs have to be byte-identical, and the streaming peak has to stay under --max-peak-mib.
+# exits non-zero otherwise, so this can run as a regression check
+
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+repo_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+parser = argparse.ArgumentParser(description="benchmark peak memory of the exports")
+parser.add_argument("--substances", type=int, default=50000)
+parser.add_argument(
+    "--max-peak-mib",
+    type=float,
+    default=64,
+    help="fail when streaming exports peak this far above the interpreter's baseline",
+)
+parser.add_argument(
+    "--data", default=os.path.join(repo_root, "ts_pn_data", "substances_data.json")
+)
+
+# runs in the child interpreter, prints one json line
+child = """
+import json, os, sys
+sys.path.insert(0, "ts_pn_data")
+from exportData import read_records, substance_alias_map, write_intents, write_kb, write_lookups
+from intentGen import intentGen
+
+# VmHWM rather than ru_maxrss, which carries over the forking parent's peak through exec
+def peak_kib():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+
+mode, merged, out = sys.argv[1:]
+baseline = peak_kib()
+if mode == "buffered":
+    with open(merged) as f:
+        substance_data = json.load(f)
+    with open(os.path.join(out, "kb.json"), "w") as f:
+        json.dump({"substances": substance_data}, f, ensure_ascii=False, indent=2)
+    write_lookups(substance_data, os.path.join(out, "lookups.yml"))
+    with open(os.path.join(out, "intents.yml"), "w") as f:
+        f.write(intentGen(substance_alias_map(substance_data), seed=0).what_is())
+else:
+    write_kb(read_records(merged), os.path.join(out, "kb.json"))
+    write_lookups(read_records(merged), os.path.join(out, "lookups.yml"))
+    write_intents(read_records(merged), os.path.join(out, "intents.yml"), seed=0)
+print(json.dumps({"baseline_kib": baseline, "peak_kib": peak_kib()}))
+"""
+
+outputs = ["kb.json", "lookups.yml", "intents.yml"]
+
+
+def synthetic_substances(substances, count):
+    """count substances shaped like the real ones, with names that don't collide"""
+    for i in range(count):
+        drug = dict(substances[i % len(substances)])
+        copy = i // len(substances)
+        if copy:
+            drug["name"] = f"{drug['name']} {copy}"
+            drug["aliases"] = [f"{alias} {copy}" for alias in drug["aliases"]]
+        yield drug
+
+
+def digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def measure(mode, merged, out):
+    os.makedirs(out)
+    output = subprocess.run(
+        [sys.executable, "-c", child, mode, merged, out],
+        cwd=repo_root,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    result = json.loads(output)
+    result["digests"] = [digest(os.path.join(out, name)) for name in outputs]
+    return result
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    with open(args.data) as f:
+        substances = json.load(f)["substances"]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        merged = os.path.join(tmp, "merged.json")
+        with open(merged, "w") as f:
+            f.write("[")
+            for i, drug in enumerate(synthetic_substances(substances, args.substances)):
+                f.write((", " if i else "") + json.dumps(drug, ensure_ascii=False))
+            f.write("]")
+        print(
+            f"{args.substances} substances, "
+            f"{os.path.getsize(merged) / 1024 / 1024:.0f} MiB merged json"
+        )
+
+        results = {}
+        for mode in ["buffered", "streaming"]:
+            results[mode] = measure(mode, merged, os.path.join(tmp, mode))
+            peak = results[mode]["peak_kib"] - results[mode]["baseline_kib"]
+            print(f"{mode:<10} peak +{peak / 1024:7.1f} MiB")
+
+    failed = False
+    for name, buffered, streaming in zip(
+        outputs, results["buffered"]["digests"], results["streaming"]["digests"]
+    ):
+        if buffered != streaming:
+            print(f"FAIL {name} differs between buffered and streaming exports")
+            failed = True
+    streaming_peak = (
+        results["streaming"]["peak_kib"] - results["streaming"]["baseline_kib"]
+    ) / 1024
+    if streaming_peak > args.max_peak_mib:
+        print(
+            f"FAIL streaming exports peaked at +{streaming_peak:.1f} MiB, "
+            f"over the {args.max_peak_mib:.0f} MiB limit"
+        )
+        failed = True
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+# compares loading the knowledge base from substances_data.json with mapping substances_data.kb
+#
+#   python3 ts_pn_data/getData.py export-packed-kb
+#   python3 benchmarks/bench_kb_load.py --runs 5
+#
+# every run loads the knowledge base in a fresh interpreter, like an action server worker starting
+# up, and reports how long the load took, the latency of answering one question afterwards and the
+# process memory it costs. private memory (RssAnon) is what each extra worker adds, file-backed
+# pages (RssFile) of the mapped file are shared between workers through the page cache
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+repo_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+parser = argparse.ArgumentParser(description="benchmark knowledge base loading")
+parser.add_argument("--runs", type=int, default=5)
+parser.add_argument(
+    "--json", default=os.path.join(repo_root, "ts_pn_data", "substances_data.json")
+)
+parser.add_argument(
+    "--packed", default=os.path.join(repo_root, "ts_pn_data", "substances_data.kb")
+)
+parser.add_argument("--name", default="molly", help="substance looked up after loading")
+
+# runs in the child interpreter, prints one json line
+child = """
+import json, sys, time
+
+def memory():
+    status = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("RssAnon", "RssFile"):
+                status[key] = int(value.split()[0])
+    return status
+
+format, path, name = sys.argv[1:]
+from actions.knowledge_base import SubstanceKnowledgeBase
+from actions.packed_kb import PackedKnowledgeBase
+
+before = memory()
+start = time.perf_counter()
+if format == "json":
+    knowledge_base = SubstanceKnowledgeBase.load(path)
+else:
+    knowledge_base = PackedKnowledgeBase.load(path)
+loaded = time.perf_counter()
+substance = knowledge_base.find(name)
+found = time.perf_counter()
+after = memory()
+
+print(json.dumps({
+    "load_ms": (loaded - start) * 1000,
+    "first_find_us": (found - loaded) * 1e6,
+    "substance": substance["name"],
+    "anon_kb": after["RssAnon"] - before["RssAnon"],
+    "file_kb": after["RssFile"] - before["RssFile"],
+}))
+"""
+
+
+def measure(format, path, name):
+    output = subprocess.run(
+        [sys.executable, "-c", child, format, path, name],
+        cwd=repo_root,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    for format, path in [("json", args.json), ("packed", args.packed)]:
+        runs = [measure(format, path, args.name) for _ in range(args.runs)]
+        print(
+            f"{format:<7} {os.path.getsize(path) / 1024:7.0f} KiB on disk, "
+            f"load {statistics.median(r['load_ms'] for r in runs):6.2f}ms, "
+            f"first find {statistics.median(r['first_find_us'] for r in runs):6.1f}µs, "
+            f"private +{statistics.median(r['anon_kb'] for r in runs):.0f} KiB, "
+            f"shared +{statistics.median(r['file_kb'] for r in runs):.0f} KiB "
+            f"({runs[0]['substance']})"
+        )
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+# times the RegexFeaturizer's work for the substance lookup on every training message
+#
+#   python3 benchmarks/bench_lookup_regex.py --repeat 5
+#
+# rasa isn't needed, the featurizer is replayed: a lookup table becomes one (a|b|c...) alternation
+# (use_word_boundaries: false) searched case-insensitively through each message, and every token a
+# match overlaps gets the feature. three lookups built from substances_data.json are compared:
+#
+#   legacy   every name and alias as the old writer listed them (duplicates, fragments, "e", "k")
+#   deduped  what write_lookups writes now
+#   trie     the same names as one prefix-factored regex (getData.py --lookup-regex)
+#
+# the last column counts messages whose flagged tokens differ from the deduped lookup. for the trie
+# these are names like "2C-T-2" where the alternation stops at the first listed entry that matches
+# ("2C-T") and the trie matches the whole name
+
+import argparse
+import glob
+import json
+import os
+import re
+import statistics
+import sys
+import time
+
+repo_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(repo_root, "ts_pn_data"))
+sys.path.insert(0, repo_root)
+
+from actions.knowledge_base import normalize_name  # noqa: E402
+from exportData import lookup_min_length, lookup_names  # noqa: E402
+from trieRegex import trie_regex  # noqa: E402
+
+parser = argparse.ArgumentParser(description="benchmark substance lookup featurization")
+parser.add_argument("--repeat", type=int, default=3, help="passes over the messages")
+parser.add_argument(
+    "--data", default=os.path.join(repo_root, "ts_pn_data", "substances_data.json")
+)
+
+token_pattern = re.compile(r"(?u)\b\w+\b")
+annotation = re.compile(r"\[([^\]]*)\]\([^)]*\)|\[([^\]]*)\]\{[^}]*\}")
+
+
+def legacy_split_alias(alias):
+    """the alias splitting the lookup writer used before"""
+    if " or " in alias:
+        aliases = alias.split(" or ")
+        return [aliases[0], aliases[1]]
+    elif "or " in alias:
+        aliases = alias.split("or ")
+        return [aliases[1]]
+    return [alias]
+
+
+def legacy_lookup(substances):
+    return [
+        name
+        for drug in substances
+        for name in [drug["name"]]
+        + [a for y in drug["aliases"] for a in legacy_split_alias(y)]
+    ]
+
+
+def lookup_alternation(names):
+    """the pattern rasa's RegexFeaturizer builds for a lookup table without word boundaries"""
+    return "(" + "|".join(re.escape(name) for name in names) + ")"
+
+
+def training_messages():
+    messages = []
+    for path in glob.glob(os.path.join(repo_root, "data", "*.yml")) + [
+        os.path.join(repo_root, "ts_pn_data", "generated_intents.yml")
+    ]:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith("- ") and not line.startswith("- intent:"):
+                    text = annotation.sub(lambda m: m.group(1) or m.group(2), line[2:])
+                    messages.append(text)
+    return messages
+
+
+def featurize(pattern, messages):
+    """per message: seconds spent and the indices of the tokens a match overlaps"""
+    timings, flagged = [], []
+    for message in messages:
+        start = time.perf_counter()
+        tokens = [(t.start(), t.end()) for t in token_pattern.finditer(message)]
+        hits = set()
+        for match in pattern.finditer(message):
+            for i, (token_start, token_end) in enumerate(tokens):
+                if token_start < match.end() and token_end > match.start():
+                    hits.add(i)
+        timings.append(time.perf_counter() - start)
+        flagged.append(hits)
+    return timings, flagged
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    with open(args.data) as f:
+        substances = json.load(f)["substances"]
+    messages = training_messages()
+
+    deduped = [
+        name
+        for names in lookup_names(substances).values()
+        for name in names
+        if len(normalize_name(name)) >= lookup_min_length
+    ]
+    variants = {
+        "legacy": (
+            len(legacy_lookup(substances)),
+            lookup_alternation(legacy_lookup(substances)),
+        ),
+        "deduped": (len(deduped), lookup_alternation(deduped)),
+        "trie": (
+            len(deduped),
+            trie_regex(sorted({normalize_name(name) for name in deduped})),
+        ),
+    }
+
+    print(f"{len(messages)} messages, {args.repeat} passes")
+    results = {}
+    for label, (entries, source) in variants.items():
+        start = time.perf_counter()
+        pattern = re.compile(source, re.IGNORECASE)
+        compile_ms = (time.perf_counter() - start) * 1000
+
+        timings = []
+        for _ in range(args.repeat):
+            run, flagged = featurize(pattern, messages)
+            timings.extend(run)
+        results[label] = (entries, source, compile_ms, sorted(timings), flagged)
+
+    reference = results["deduped"][4]
+    for label, (entries, source, compile_ms, timings, flagged) in results.items():
+        differ = sum(a != b for a, b in zip(flagged, reference))
+        print(
+            f"{label:<8} {entries:5} names, {len(source):6} chars, "
+            f"compile {compile_ms:7.1f}ms, "
+            f"per message mean {statistics.mean(timings) * 1e6:7.1f}µs "
+            f"p99 {timings[int(0.99 * (len(timings) - 1))] * 1e6:7.1f}µs, "
+            f"total {sum(timings) / args.repeat * 1000:7.1f}ms/pass, "
+            f"differ {differ}"
+        )
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+# times merge_substances on synthetic psychonautwiki/tripsit datasets of growing size
+#
+#   python3 benchmarks/bench_merge.py --sizes 1000,10000,20000
+#
+# the legacy column replays the old linear name scan (find + list.remove) on the same data,
+# it is quadratic so it only runs up to --legacy-max substances
+
+import argparse
+import copy
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "ts_pn_data"))
+
+from mergeData import merge_substances  # noqa: E402
+
+parser = argparse.ArgumentParser(description="benchmark the substance merge")
+parser.add_argument("--sizes", default="1000,2500,5000,10000,20000")
+parser.add_argument("--aliases", type=int, default=6, help="aliases per substance")
+parser.add_argument("--legacy-max", type=int, default=5000)
+parser.add_argument("--seed", type=int, default=0)
+
+
+def synthetic_sources(size, aliases, rnd):
+    """pw and ts lists where roughly half the substances appear in both sources"""
+    names = [f"substance-{i}" for i in range(size)]
+    pw, ts = [], []
+    for name in names:
+        alias_list = [f"{name}-alias-{a}" for a in range(aliases)]
+        if rnd.random() < 0.75:
+            pw.append(
+                {
+                    "url": f"https://example.org/{name}",
+                    "name": name.title(),
+                    "aliases": alias_list,
+                    "roas": [],
+                    "data": {},
+                }
+            )
+        if rnd.random() < 0.75:
+            ts.append(
+                {
+                    "name": name,
+                    "pretty_name": name.title(),
+                    "aliases": rnd.sample(alias_list, aliases // 2),
+                    "properties": {"summary": "summary"},
+                }
+            )
+    rnd.shuffle(pw)
+    rnd.shuffle(ts)
+    return pw, ts
+
+
+def legacy_lookups(pw, ts):
+    """the name matching part of the old merge, which is what dominated its runtime"""
+
+    def substance_name_match(name, substance):
+        lower_name = name.lower()
+        return any(
+            [
+                lower_name == substance[key].lower()
+                for key in ["name", "pretty_name"]
+                if key in substance
+            ]
+            + [lower_name == alias.lower() for alias in substance.get("aliases", [])]
+        )
+
+    def find_substance_in_data(data, name):
+        return next((s for s in data if substance_name_match(name, s)), None)
+
+    names = sorted(
+        set(s["name"].lower() for s in pw) | set(s["name"].lower() for s in ts)
+    )
+    for name in names:
+        for data in (pw, ts):
+            substance = find_substance_in_data(data, name)
+            if substance:
+                data.remove(substance)
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    rnd = random.Random(args.seed)
+
+    print(f"{'substances':>10} {'merge (s)':>10} {'legacy (s)':>11}")
+    for size in map(int, args.sizes.split(",")):
+        pw, ts = synthetic_sources(size, args.aliases, rnd)
+        merge_time = timed(merge_substances, copy.deepcopy(pw), copy.deepcopy(ts))
+        legacy = "-"
+        if size <= args.legacy_max:
+            legacy = f"{timed(legacy_lookups, pw, ts):.3f}"
+        print(f"{size:>10} {merge_time:>10.3f} {legacy:>11}")
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+# checks the strained lxml page parse against the original full html.parser parse on every page in
+# the psychonautwiki page cache, and reports how long each takes
+#
+#   python3 benchmarks/bench_pw_parse.py [--cache-dir ts_pn_data/_pw_cache] [--per-page]
+#
+# pages are cached by getData.py's fetch-pw stage, exits non-zero if any page parses differently
+
+import argparse
+import glob
+import gzip
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "ts_pn_data"))
+
+from pwScrape import pw_parse_substance  # noqa: E402
+
+parser = argparse.ArgumentParser(description="validate and time psychonautwiki parsing")
+parser.add_argument("--cache-dir", default="ts_pn_data/_pw_cache")
+parser.add_argument("--per-page", action="store_true", help="print timings per page")
+
+
+def timed_parse(substance, content, **kwargs):
+    start = time.perf_counter()
+    record = pw_parse_substance(substance, content, **kwargs)
+    return record, (time.perf_counter() - start) * 1000
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    pages = 0
+    mismatched = []
+    full_total = fast_total = 0.0
+    for html_path in sorted(glob.glob(os.path.join(args.cache_dir, "*.html.gz"))):
+        with open(html_path[: -len(".html.gz")] + ".json") as f:
+            entry = json.load(f)
+        if "name" not in entry:
+            continue
+        with gzip.open(html_path) as f:
+            content = f.read()
+
+        substance = {"url": entry["url"], "name": entry["name"]}
+        full, full_ms = timed_parse(
+            substance, content, parser="html.parser", parse_only=None
+        )
+        fast, fast_ms = timed_parse(substance, content)
+
+        pages += 1
+        full_total += full_ms
+        fast_total += fast_ms
+        if full != fast:
+            mismatched.append(entry["name"])
+        if args.per_page:
+            status = "ok" if full == fast else "MISMATCH"
+            print(f"{entry['name']:<40} {full_ms:>8.1f}ms {fast_ms:>8.1f}ms  {status}")
+
+    if not pages:
+        print(f"No cached pages in {args.cache_dir}, run getData.py fetch-pw first")
+        exit(1)
+
+    print(
+        f"{pages} pages: full parse {full_total / pages:.1f}ms/page, "
+        f"strained parse {fast_total / pages:.1f}ms/page "
+        f"({full_total / max(fast_total, 1e-9):.1f}x)"
+    )
+    if len(mismatched):
+        print(f"{len(mismatched)} page(s) parsed differently: {', '.join(mismatched)}")
+        exit(1)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+# measures how much reloading substance data in the background slows down requests
+#
+#   python3 benchmarks/bench_reload.py --reloads 10
+#
+# copies of the packed knowledge base and fuzzy index in a temp dir are replaced with prebuilt
+# revisions (the way the pipeline replaces them) while the main thread keeps resolving names against
+# the current snapshot. a reload that only touches the knowledge base is cheap, one that also touches
+# the fuzzy index has to parse it again, so both kinds are timed. the latency columns are for the
+# lookups that ran while reloads were happening
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+repo_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, repo_root)
+
+from actions.fuzzy_index import FuzzyIndex  # noqa: E402
+from actions.hot_reload import KnowledgeBaseReloader  # noqa: E402
+from actions.packed_kb import write_packed_kb  # noqa: E402
+
+parser = argparse.ArgumentParser(
+    description="benchmark background knowledge base reloads"
+)
+parser.add_argument("--reloads", type=int, default=10)
+parser.add_argument(
+    "--interval", type=float, default=0.05, help="reloader poll interval"
+)
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument(
+    "--data", default=os.path.join(repo_root, "ts_pn_data", "substances_data.json")
+)
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def revisions(path, build):
+    """contents of two revisions of an artifact, built with build(path, revision)"""
+    contents = []
+    for revision in range(2):
+        build(path, revision)
+        with open(path, "rb") as f:
+            contents.append(f.read())
+    return contents
+
+
+def replace(path, content):
+    with open(path + ".tmp", "wb") as f:
+        f.write(content)
+    os.replace(path + ".tmp", path)
+
+
+def measure(reloader, names, rnd, artifacts, reloads):
+    """lookup latencies (ms) while the artifacts are replaced reloads times, plus how long each
+    replacement took to be swapped in"""
+    latencies = []
+    durations = []
+    done = threading.Event()
+
+    def writer():
+        for i in range(reloads):
+            expected = []
+            for artifact, contents in artifacts:
+                content = contents[(i + 1) % 2]
+                replace(artifact.path, content)
+                expected.append((artifact, hashlib.sha256(content).hexdigest()))
+            start = time.perf_counter()
+            while any(artifact.digest != digest for artifact, digest in expected):
+                time.sleep(0.001)
+            durations.append((time.perf_counter() - start) * 1000)
+        done.set()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    while not done.is_set():
+        start = time.perf_counter()
+        reloader.snapshot().knowledge_base.resolve(rnd.choice(names))
+        latencies.append((time.perf_counter() - start) * 1000)
+    thread.join()
+    return sorted(latencies), durations
+
+
+def report(label, latencies, durations):
+    print(
+        f"{label:<22} swapped in {statistics.median(durations):7.1f}ms (median), "
+        f"lookups p50 {percentile(latencies, 50):.3f}ms "
+        f"p99 {percentile(latencies, 99):.3f}ms max {latencies[-1]:.1f}ms"
+    )
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    rnd = random.Random(args.seed)
+    with open(args.data) as f:
+        substances = json.load(f)["substances"]
+    names = [s["name"] for s in substances] + [
+        a for s in substances for a in s["aliases"]
+    ]
+    names += [name[:-1] for name in names if len(name) > 6][:200]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        kb_path = os.path.join(tmp, "substances_data.kb")
+        fuzzy_path = os.path.join(tmp, "fuzzy_index.jsonl")
+        fuzzy_index = FuzzyIndex.build(substances)
+
+        def build_kb(path, revision):
+            substances[0]["summary"] = f"revision {revision}"
+            write_packed_kb(substances, path)
+
+        def build_fuzzy(path, revision):
+            # a different header is enough to change the content (and so the digest)
+            fuzzy_index.max_distance = 2 + revision
+            fuzzy_index.save(path)
+
+        kb_revisions = revisions(kb_path, build_kb)
+        fuzzy_revisions = revisions(fuzzy_path, build_fuzzy)
+        replace(kb_path, kb_revisions[0])
+        replace(fuzzy_path, fuzzy_revisions[0])
+        reloader = KnowledgeBaseReloader(kb_path, fuzzy_path, args.interval)
+        kb_artifact = (reloader.substances, kb_revisions)
+        fuzzy_artifact = (reloader.fuzzy_index, fuzzy_revisions)
+
+        baseline = []
+        for _ in range(20000):
+            start = time.perf_counter()
+            reloader.snapshot().knowledge_base.resolve(rnd.choice(names))
+            baseline.append((time.perf_counter() - start) * 1000)
+        baseline.sort()
+        print(
+            f"{'no reloads':<22} {'':30}lookups p50 {percentile(baseline, 50):.3f}ms "
+            f"p99 {percentile(baseline, 99):.3f}ms max {baseline[-1]:.1f}ms"
+        )
+        report(
+            "knowledge base",
+            *measure(reloader, names, rnd, [kb_artifact], args.reloads),
+        )
+        report(
+            "kb + fuzzy index",
+            *measure(reloader, names, rnd, [kb_artifact, fuzzy_artifact], args.reloads),
+        )
+        shutil.rmtree(tmp, ignore_errors=True)
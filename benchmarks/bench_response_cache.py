@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+# measures what the substance answer cache saves in action_what_is_substance
+#
+#   python3 benchmarks/bench_response_cache.py --requests 20000
+#
+# the action runs in process (no HTTP) on names drawn with a zipf-like skew, so a few dozen
+# substances get most of the questions like in real traffic. it runs once with the cache off and
+# once with it on, and reports per-request latency and the cache counters
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+repo_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, repo_root)
+os.environ.setdefault("SUBSTANCE_RELOAD_INTERVAL", "0")
+
+from rasa_sdk import Tracker  # noqa: E402
+from rasa_sdk.executor import CollectingDispatcher  # noqa: E402
+
+from actions import actions  # noqa: E402
+from actions.response_cache import ResponseCache  # noqa: E402
+
+parser = argparse.ArgumentParser(description="benchmark the substance answer cache")
+parser.add_argument("--requests", type=int, default=20000)
+parser.add_argument("--cache-size", type=int, default=512)
+parser.add_argument("--skew", type=float, default=1.1, help="zipf exponent")
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument(
+    "--data", default=os.path.join(repo_root, "ts_pn_data", "substances_data.json")
+)
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def tracker(name):
+    latest_message = {
+        "text": f"what is {name}",
+        "intent": {"name": "what_is_substance", "confidence": 1.0},
+        "entities": [{"entity": "substance", "value": name}],
+    }
+    return Tracker(
+        "benchmark",
+        {"substance": None},
+        latest_message,
+        [],
+        False,
+        None,
+        {},
+        "action_listen",
+    )
+
+
+def measure(names):
+    action = actions.ActionWhatIsSubstance()
+    latencies = []
+    for name in names:
+        request = tracker(name)
+        start = time.perf_counter()
+        action.run(CollectingDispatcher(), request, {})
+        latencies.append((time.perf_counter() - start) * 1e6)
+    return sorted(latencies)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    rnd = random.Random(args.seed)
+    with open(args.data) as f:
+        substances = json.load(f)["substances"]
+    # popular substances first, the rest in a fixed random order, each asked about by one of its names
+    ranked = substances[:]
+    rnd.shuffle(ranked)
+    weights = [1 / (rank + 1) ** args.skew for rank in range(len(ranked))]
+    names = [
+        rnd.choice([s["name"]] + s["aliases"])
+        for s in rnd.choices(ranked, weights, k=args.requests)
+    ]
+
+    for label, cache in [
+        ("no cache", ResponseCache(0)),
+        ("cache", ResponseCache(args.cache_size)),
+    ]:
+        actions.response_cache = cache
+        latencies = measure(names)
+        stats = cache.stats()
+        print(
+            f"{label:<9} p50 {percentile(latencies, 50):6.1f}µs "
+            f"p99 {percentile(latencies, 99):6.1f}µs "
+            f"mean {sum(latencies) / len(latencies):6.1f}µs, "
+            f"hit rate {stats['hit_rate']:.1%} ({stats['evictions']} evictions)"
+        )
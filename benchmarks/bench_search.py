@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+
+# checks relevance and latency of the substance search index
+#
+#   python3 ts_pn_data/getData.py export-search
+#   python3 benchmarks/bench_search.py --k 5 --repeat 200
+#
+# relevance: every query in QUERIES lists the substances a person asking it would want to see, and
+# is scored by recall within the top k and the reciprocal rank of the first relevant hit.
+# latency: all queries (plus the search_substances examples in data/nlu.yml) are searched --repeat
+# times in process. exits 1 when mean recall is under --min-recall or p99 latency over --max-p99-ms
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+repo_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, repo_root)
+
+from actions.search_index import SearchIndex  # noqa: E402
+
+parser = argparse.ArgumentParser(description="benchmark the substance search index")
+parser.add_argument(
+    "--index", default=os.path.join(repo_root, "ts_pn_data", "search_index.npz")
+)
+parser.add_argument(
+    "--data", default=os.path.join(repo_root, "ts_pn_data", "substances_data.json")
+)
+parser.add_argument("--nlu", default=os.path.join(repo_root, "data", "nlu.yml"))
+parser.add_argument("--k", type=int, default=5)
+parser.add_argument("--repeat", type=int, default=200)
+# a regression floor, mean recall@5 is 0.80 on these queries
+parser.add_argument("--min-recall", type=float, default=0.75)
+parser.add_argument("--max-p99-ms", type=float, default=2.0)
+
+# query -> relevant substances. each group is labelled by a rule over the fields of
+# substances_data.json, read independently of the index, so a substance that fits the rule is
+# relevant even if the question doesn't use its wording
+QUERIES = {
+    # reagents: every substance whose result for the reagent shows the colour
+    "what turns marquis purple": ["1P-LSD", "25C-NBOMe"],
+    "what turns mandelin blue": ["2-AI", "25N-NBOMe"],
+    "dark green on marquis": ["25B-NBOMe", "25I-NBF"],
+    "mecke goes purple": ["2C-T-2", "2C-T-21", "2C-T-7"],
+    "purple with liebermann": ["2C-T-2", "2C-T-4", "2C-T-7"],
+    "fizzes orange in marquis": ["2C-T-2", "2C-T-21", "2C-T-7"],
+    "mandelin turns red and green": ["25B-NBOMe", "25D-NBOMe", "25iP-NBOMe"],
+    # classes: every substance in the psychoactive or chemical class
+    "benzodiazepines": [
+        "Alprazolam",
+        "Clonazepam",
+        "Clonazolam",
+        "Diazepam",
+        "Diclazepam",
+        "Flubromazepam",
+        "Flubromazolam",
+        "Lorazepam",
+        "Nifoxipam",
+        "Pyrazolam",
+        "Temazepam",
+    ],
+    "barbiturates": ["Pentobarbital", "Phenobarbital", "Secobarbital"],
+    "deliriants": ["Atropa belladonna", "Datura", "DPH", "Mirtazapine", "Myristicin"],
+    "synthetic cannabinoids": [
+        "5F-AKB48",
+        "AB-FUBINACA",
+        "APICA",
+        "JWH-073",
+        "STS-135",
+        "THJ-018",
+        "THJ-2201",
+    ],
+    "eugeroics that keep you awake": ["Armodafinil", "Modafinil"],
+    "lysergamides": [
+        "1B-LSD",
+        "1P-ETH-LAD",
+        "1P-LSD",
+        "AL-LAD",
+        "ALD-52",
+        "ETH-LAD",
+        "LSA",
+        "LSD",
+        "LSM-775",
+        "LSZ",
+        "MiPLA",
+        "PARGY-LAD",
+        "PRO-LAD",
+    ],
+    "dissociatives": [
+        "2-FDCK",
+        "3-HO-PCE",
+        "3-HO-PCP",
+        "3-MeO-PCE",
+        "3-MeO-PCP",
+        "4-MeO-PCP",
+        "Deschloroketamine",
+        "DXM",
+        "Diphenidine",
+        "Ephenidine",
+        "Ketamine",
+        "Memantine",
+        "MXE",
+        "Methoxphenidine",
+        "MXiPr",
+        "O-PCE",
+        "PCE",
+        "PCP",
+    ],
+    "empathogens like mdma": [
+        "2-FEA",
+        "3-FEA",
+        "3-FMA",
+        "3-MMC",
+        "4-FA",
+        "4-FMA",
+        "5-APB",
+        "5-MAPB",
+        "5-MeO-MiPT",
+        "6-APB",
+        "6-APDB",
+        "ΑMT",
+        "Butylone",
+        "Ephylone",
+        "MDA",
+        "MDAI",
+        "MDEA",
+        "MDPV",
+        "Mephedrone",
+        "Methylone",
+        "PMA",
+        "PMMA",
+    ],
+    # toxicity and addiction potential, alone or within a class
+    "which drugs have high toxicity": ["Pethidine", "Dextropropoxyphene", "U-47700"],
+    "fatal at heavy doses": [
+        "25B-NBOH",
+        "25B-NBOMe",
+        "25C-NBOH",
+        "25C-NBOMe",
+        "25I-NBOH",
+        "25I-NBOMe",
+        "25N-NBOMe",
+        "Acetylfentanyl",
+        "Fentanyl",
+        "Hydrocodone",
+        "Sufentanil",
+    ],
+    "moderate toxicity": [
+        "Carisoprodol",
+        "Methadone",
+        "Pentobarbital",
+        "Phenobarbital",
+        "Secobarbital",
+    ],
+    "addiction that can cause psychosis": [
+        "3-HO-PCE",
+        "3-HO-PCP",
+        "3-MeO-PCE",
+        "Datura",
+        "PCE",
+        "PCP",
+    ],
+    "non-addictive nootropics": [
+        "Aniracetam",
+        "Phenylpiracetam",
+        "Noopept",
+        "Oxiracetam",
+    ],
+    "which stimulants cause liver toxicity": ["Pemoline", "Adrafinil"],
+    "extremely addictive opioids": [
+        "Acetylfentanyl",
+        "Fentanyl",
+        "Heroin",
+        "Methadone",
+        "Pethidine",
+        "Sufentanil",
+    ],
+    "psychedelics with extremely low toxicity": [
+        "1B-LSD",
+        "1P-LSD",
+        "AL-LAD",
+        "ALD-52",
+        "DMT",
+        "LSD",
+        "Psilocin",
+    ],
+    # summaries: every substance whose summary says so
+    "something like GHB": ["GBL", "1,4-Butanediol"],
+    "found in cough medicine": ["Codeine", "DXM", "Dihydrocodeine", "Hydrocodone"],
+    "stimulants prescribed for adhd": [
+        "2-DPMP",
+        "Adderall",
+        "Dexedrine",
+        "Dexmethylphenidate",
+        "Methamphetamine",
+        "Methylphenidate",
+        "Pemoline",
+        "Vyvanse",
+    ],
+    "can cause dangerous vasoconstriction": [
+        "25B-NBOH",
+        "25C-NBOH",
+        "25D-NBOMe",
+        "25E-NBOMe",
+        "25G-NBOMe",
+        "25H-NBOMe",
+        "25I-NBOH",
+        "25iP-NBOMe",
+        "25N-NBOMe",
+        "Cocaine",
+    ],
+    "psychedelic cactus": ["Mescaline", "Peyote"],
+    "lowers the seizure threshold": ["Bupropion"],
+    "dissociative anaesthetics": [
+        "2-FDCK",
+        "4-MeO-PCP",
+        "Diphenidine",
+        "Ketamine",
+        "PCE",
+    ],
+}
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def nlu_queries(path):
+    """examples of the search_substances intent"""
+    queries = []
+    intent = None
+    with open(path) as f:
+        for line in f:
+            header = re.match(r"^- intent: (.+)$", line.rstrip())
+            if header:
+                intent = header.group(1)
+            elif intent == "search_substances" and line.startswith("    - "):
+                queries.append(line.strip()[2:])
+    return queries
+
+
+def relevance(index, ids, k):
+    recalls, reciprocal_ranks = [], []
+    for query, relevant in QUERIES.items():
+        wanted = {ids[name] for name in relevant}
+        found = [hit.substance_id for hit in index.search(query, k)]
+        recalls.append(len(wanted.intersection(found)) / min(k, len(wanted)))
+        rank = next((i + 1 for i, s in enumerate(found) if s in wanted), None)
+        reciprocal_ranks.append(1 / rank if rank else 0.0)
+        print(
+            f"  {query:<42} recall@{k} {recalls[-1]:.2f} "
+            f"first relevant at {rank or '-'}"
+        )
+    return sum(recalls) / len(recalls), sum(reciprocal_ranks) / len(reciprocal_ranks)
+
+
+def latency(index, queries, k, repeat):
+    latencies = []
+    for _ in range(repeat):
+        for query in queries:
+            start = time.perf_counter()
+            index.search(query, k)
+            latencies.append((time.perf_counter() - start) * 1000)
+    return sorted(latencies)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    start = time.perf_counter()
+    index = SearchIndex.load(args.index)
+    load_ms = (time.perf_counter() - start) * 1000
+    with open(args.data) as f:
+        ids = {s["name"]: s["id"] for s in json.load(f)["substances"]}
+
+    recall, mrr = relevance(index, ids, args.k)
+    print(
+        f"mean recall@{args.k} {recall:.2f}, MRR {mrr:.2f} over {len(QUERIES)} queries"
+    )
+
+    queries = list(QUERIES) + nlu_queries(args.nlu)
+    latencies = latency(index, queries, args.k, args.repeat)
+    print(
+        f"index loaded in {load_ms:.1f}ms, {len(latencies)} searches: "
+        f"p50 {percentile(latencies, 50):.3f}ms p99 {percentile(latencies, 99):.3f}ms "
+        f"max {latencies[-1]:.3f}ms"
+    )
+
+    failed = []
+    if recall < args.min_recall:
+        failed.append(f"recall {recall:.2f} < {args.min_recall}")
+    if percentile(latencies, 99) > args.max_p99_ms:
+        failed.append(f"p99 {percentile(latencies, 99):.3f}ms > {args.max_p99_ms}ms")
+    if failed:
+        print(f"FAILED: {', '.join(failed)}")
+        sys.exit(1)
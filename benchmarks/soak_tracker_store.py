@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+# soak test of the bounded tracker store: memory should stay flat however long conversations run
+#
+#   python3 benchmarks/soak_tracker_store.py --turns 1000000
+#   python3 benchmarks/soak_tracker_store.py --turns 200000 --unbounded
+#
+# simulates --users returning users (zipf-like, a few talk a lot) on a clock that advances --step
+# seconds per turn. every turn reads the conversation, appends what a what_is_substance turn adds
+# (user message with its parse data, slot, bot message, actions) and writes it back, like rasa does.
+# RSS is sampled --samples times. exits 1 when RSS grew more than --max-growth-mib over the second
+# half of the run, by when the store is full. --unbounded keeps every event like rasa's in-memory
+# store does, for comparison
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+repo_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, repo_root)
+
+from components.conversation_store import ConversationStore  # noqa: E402
+
+parser = argparse.ArgumentParser(description="soak test the bounded tracker store")
+parser.add_argument("--turns", type=int, default=1000000)
+parser.add_argument("--users", type=int, default=20000)
+parser.add_argument("--skew", type=float, default=1.1, help="zipf exponent")
+parser.add_argument(
+    "--step", type=float, default=0.5, help="simulated seconds per turn"
+)
+parser.add_argument("--max-events", type=int, default=200)
+parser.add_argument("--keep-turns", type=int, default=10)
+parser.add_argument("--idle-seconds", type=float, default=24 * 3600)
+parser.add_argument("--max-conversations", type=int, default=100000)
+parser.add_argument("--max-mb", type=float, default=256)
+parser.add_argument("--samples", type=int, default=20)
+parser.add_argument("--max-growth-mib", type=float, default=16)
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument(
+    "--unbounded",
+    action="store_true",
+    help="keep every event in a dict of json strings instead",
+)
+
+
+def rss_mib():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+class UnboundedStore:
+    """what rasa's InMemoryTrackerStore keeps: every event, serialized, forever"""
+
+    def __init__(self):
+        self.conversations = {}
+
+    def get(self, conversation_id):
+        stored = self.conversations.get(conversation_id)
+        return None if stored is None else json.loads(stored)
+
+    def put(self, conversation_id, events):
+        self.conversations[conversation_id] = json.dumps(events)
+        return events
+
+    def stats(self):
+        return {
+            "conversations": len(self.conversations),
+            "bytes": sum(len(s) for s in self.conversations.values()),
+        }
+
+
+def session_start(now):
+    return [
+        {"event": "action", "name": "action_session_start", "timestamp": now},
+        {"event": "session_started", "timestamp": now},
+        {"event": "action", "name": "action_listen", "timestamp": now},
+    ]
+
+
+def turn_events(rnd, turn, now, substances):
+    substance = rnd.choice(substances)
+    text = f"what is {substance}?"
+    intent = {"name": "what_is_substance", "confidence": 0.97}
+    ranking = [intent] + [
+        {"name": f"intent_{i}", "confidence": 0.003} for i in range(9)
+    ]
+    entity = {
+        "entity": "substance",
+        "start": 8,
+        "end": 8 + len(substance),
+        "value": substance,
+        "extractor": "DIETClassifier",
+        "confidence_entity": 0.99,
+    }
+    return [
+        {
+            "event": "user",
+            "timestamp": now,
+            "text": text,
+            "parse_data": {
+                "intent": intent,
+                "entities": [entity],
+                "text": text,
+                "message_id": f"{turn:032x}",
+                "metadata": {},
+                "intent_ranking": ranking,
+            },
+            "input_channel": "rest",
+            "message_id": f"{turn:032x}",
+            "metadata": {},
+        },
+        {"event": "slot", "timestamp": now, "name": "substance", "value": substance},
+        {
+            "event": "action",
+            "timestamp": now,
+            "name": "action_what_is_substance",
+            "policy": "RulePolicy",
+            "confidence": 1.0,
+        },
+        {
+            "event": "bot",
+            "timestamp": now,
+            "text": f"{substance} is a substance. More info: https://psychonautwiki.org/wiki/{substance}",
+            "data": {},
+            "metadata": {},
+        },
+        {"event": "action", "timestamp": now, "name": "action_listen"},
+    ]
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    rnd = random.Random(args.seed)
+    with open(os.path.join(repo_root, "ts_pn_data", "substances_data.json")) as f:
+        substances = [s["name"] for s in json.load(f)["substances"]]
+
+    clock = [0.0]
+    if args.unbounded:
+        store = UnboundedStore()
+    else:
+        store = ConversationStore(
+            max_events=args.max_events,
+            keep_turns=args.keep_turns,
+            idle_seconds=args.idle_seconds,
+            max_conversations=args.max_conversations,
+            max_bytes=int(args.max_mb * 1024 * 1024),
+            clock=lambda: clock[0],
+        )
+    users = [f"user-{i}" for i in range(args.users)]
+    weights = [1 / (rank + 1) ** args.skew for rank in range(len(users))]
+
+    start = time.perf_counter()
+    baseline = rss_mib()
+    every = max(1, args.turns // args.samples)
+    samples = []
+    turn = 0
+    while turn < args.turns:
+        for user in rnd.choices(users, weights, k=min(10000, args.turns - turn)):
+            clock[0] += args.step
+            events = store.get(user) or session_start(clock[0])
+            events += turn_events(rnd, turn, clock[0], substances)
+            store.put(user, events)
+            turn += 1
+            if turn % every == 0:
+                samples.append((turn, rss_mib() - baseline))
+                print(
+                    f"{turn:>9} turns  RSS +{samples[-1][1]:7.1f}MiB  "
+                    f"{(time.perf_counter() - start) / turn * 1e6:6.1f}µs/turn  "
+                    f"{store.stats()}",
+                    flush=True,
+                )
+
+    half = [rss for t, rss in samples if t > args.turns // 2]
+    growth = half[-1] - half[0] if len(half) > 1 else 0.0
+    print(f"RSS grew {growth:.1f}MiB over the second half of {args.turns} turns")
+    if growth > args.max_growth_mib:
+        print(f"FAILED: more than {args.max_growth_mib}MiB")
+        sys.exit(1)
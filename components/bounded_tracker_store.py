@@ -0,0 +1,80 @@
+"""A tracker store for long-running servers, bounded in events and conversations.
+
+Use it in ``endpoints.yml`` instead of the default in-memory store::
+
+    tracker_store:
+      type: components.bounded_tracker_store.BoundedTrackerStore
+      max_events: 200
+      keep_turns: 10
+      idle_seconds: 86400
+      max_conversations: 100000
+      max_mb: 256
+
+Trackers are stored in a ``components.conversation_store.ConversationStore``,
+which compacts long conversations and evicts idle ones, see there for what's
+kept. A tracker retrieved after compaction starts with the snapshot of its
+older events, so its slots and the last ``keep_turns`` turns are the same as
+before. The store's size and counters are logged every ``log_interval``
+seconds.
+"""
+
+import logging
+import time
+from typing import Any, Dict, Iterable, Optional, Text
+
+from rasa.core.brokers.broker import EventBroker
+from rasa.core.tracker_store import TrackerStore
+from rasa.shared.core.domain import Domain
+from rasa.shared.core.trackers import DialogueStateTracker
+
+from components.conversation_store import ConversationStore
+
+logger = logging.getLogger(__name__)
+
+
+class BoundedTrackerStore(TrackerStore):
+    def __init__(
+        self,
+        domain: Domain,
+        host: Optional[Text] = None,
+        event_broker: Optional[EventBroker] = None,
+        max_events: int = 200,
+        keep_turns: int = 10,
+        idle_seconds: float = 24 * 3600,
+        max_conversations: int = 100000,
+        max_mb: float = 256,
+        log_interval: float = 300,
+        **kwargs: Dict[Text, Any],
+    ) -> None:
+        self.store = ConversationStore(
+            max_events=int(max_events),
+            keep_turns=int(keep_turns),
+            idle_seconds=float(idle_seconds),
+            max_conversations=int(max_conversations),
+            max_bytes=int(float(max_mb) * 1024 * 1024),
+        )
+        self.log_interval = float(log_interval)
+        self.last_log = time.monotonic()
+        super().__init__(domain, event_broker, **kwargs)
+
+    def save(self, tracker: DialogueStateTracker) -> None:
+        if self.event_broker:
+            self.stream_events(tracker)
+        self.store.put(tracker.sender_id, [e.as_dict() for e in tracker.events])
+        if time.monotonic() - self.last_log >= self.log_interval:
+            self.last_log = time.monotonic()
+            logger.info(f"Tracker store: {self.store.stats()}")
+
+    def retrieve(self, sender_id: Text) -> Optional[DialogueStateTracker]:
+        events = self.store.get(sender_id)
+        if events is None:
+            return None
+        return DialogueStateTracker.from_dict(
+            sender_id,
+            events,
+            self.domain.slots if self.domain else None,
+            max_event_history=self.max_event_history,
+        )
+
+    def keys(self) -> Iterable[Text]:
+        return self.store.keys()
@@ -0,0 +1,220 @@
+"""Bounded storage for conversation event histories.
+
+Rasa's default in-memory tracker store keeps every event of every
+conversation for as long as the server runs, and with
+``carry_over_slots_to_new_session`` a returning user's history only grows.
+``ConversationStore`` keeps the same serialized events, but:
+
+* a conversation longer than ``max_events`` is compacted: the events before
+  its last ``keep_turns`` user messages are replaced by a snapshot of what
+  they left behind (session start, slot values, active loop), see ``compact``,
+* conversations nobody has written to for ``idle_seconds`` are evicted, and
+  the least recently used ones go first when there are more than
+  ``max_conversations`` or they take more than ``max_bytes``,
+* every conversation is stored as one compressed JSON blob and its size is
+  accounted for, ``usage`` and ``stats`` report it.
+
+The policies only look back ``max_history`` states (10 for TEDPolicy, 6 for
+AugmentedMemoizationPolicy in ``config.yml``), and every user message comes
+with at least two actions (the bot's and ``action_listen``), so keeping 10
+user turns keeps more than either of them featurizes.
+
+Events are the dicts Rasa serializes them to (``Event.as_dict``), so this
+works, and is measured by ``benchmarks/soak_tracker_store.py``, without Rasa.
+"""
+
+import json
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Text
+
+ACTION_LISTEN = "action_listen"
+ACTION_SESSION_START = "action_session_start"
+
+
+def _slot_state(events: List[Dict[Text, Any]]) -> Dict[Text, Any]:
+    """Slot values, active loop and whether a session started after replaying ``events``."""
+    slots = {}
+    active_loop = None
+    session_started = False
+    for event in events:
+        kind = event.get("event")
+        if kind == "slot":
+            slots[event["name"]] = event.get("value")
+        elif kind in ("session_started", "restart"):
+            # a new session only keeps the slots action_session_start sets again
+            slots = {}
+            active_loop = None
+            session_started = session_started or kind == "session_started"
+        elif kind == "reset_slots":
+            slots = {}
+        elif kind in ("active_loop", "form"):
+            active_loop = event.get("name")
+    return {"slots": slots, "active_loop": active_loop, "session": session_started}
+
+
+def compact(
+    events: List[Dict[Text, Any]], keep_turns: int, max_events: int
+) -> List[Dict[Text, Any]]:
+    """``events`` with everything before the last ``keep_turns`` user messages snapshotted.
+
+    The snapshot is what a tracker replaying the dropped events would have
+    ended with: a session start when one happened, a ``slot`` event per slot
+    set since, the active loop and the ``action_listen`` a user message
+    follows. If the kept turns alone are more than ``max_events``, only the
+    last ``max_events`` events (from a user message where there is one) are
+    kept.
+    """
+    users = [i for i, event in enumerate(events) if event.get("event") == "user"]
+    if len(users) <= keep_turns:
+        cut = 0
+    else:
+        cut = users[-keep_turns]
+    if len(events) - cut > max_events:
+        cut = len(events) - max_events
+        cut = next((i for i in users if i >= cut), cut)
+    if cut <= 0:
+        return events
+
+    state = _slot_state(events[:cut])
+    timestamp = events[cut - 1].get("timestamp")
+    snapshot = []
+    if state["session"]:
+        snapshot += [
+            {"event": "action", "name": ACTION_SESSION_START, "timestamp": timestamp},
+            {"event": "session_started", "timestamp": timestamp},
+        ]
+    snapshot += [
+        {"event": "slot", "name": name, "value": value, "timestamp": timestamp}
+        for name, value in state["slots"].items()
+    ]
+    if state["active_loop"]:
+        snapshot.append(
+            {
+                "event": "active_loop",
+                "name": state["active_loop"],
+                "timestamp": timestamp,
+            }
+        )
+    if events[cut].get("event") == "user":
+        snapshot.append(
+            {"event": "action", "name": ACTION_LISTEN, "timestamp": timestamp}
+        )
+    return snapshot + events[cut:]
+
+
+class ConversationStore:
+    """Compressed, compacted event lists per conversation, with eviction."""
+
+    def __init__(
+        self,
+        max_events: int = 200,
+        keep_turns: int = 10,
+        idle_seconds: float = 24 * 3600,
+        max_conversations: int = 100000,
+        max_bytes: int = 256 * 1024 * 1024,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.max_events = max_events
+        self.keep_turns = keep_turns
+        self.idle_seconds = idle_seconds
+        self.max_conversations = max_conversations
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.lock = threading.Lock()
+        # conversation -> (last write, blob), least recently written first
+        self.conversations: "OrderedDict[Text, Any]" = OrderedDict()
+        self.bytes = 0
+        self.compactions = 0
+        self.idle_evictions = 0
+        self.capacity_evictions = 0
+
+    @staticmethod
+    def _size(conversation_id: Text, blob: bytes) -> int:
+        return sys.getsizeof(conversation_id) + sys.getsizeof(blob)
+
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self.conversations)
+
+    def __contains__(self, conversation_id: Text) -> bool:
+        with self.lock:
+            return conversation_id in self.conversations
+
+    def keys(self) -> List[Text]:
+        with self.lock:
+            return list(self.conversations)
+
+    def get(self, conversation_id: Text) -> Optional[List[Dict[Text, Any]]]:
+        # only the lookup needs the lock, an OrderedDict can't be read while another thread
+        # evicts from it; blobs are never changed once stored
+        with self.lock:
+            entry = self.conversations.get(conversation_id)
+        if entry is None:
+            return None
+        return json.loads(zlib.decompress(entry[1]))
+
+    def put(
+        self, conversation_id: Text, events: List[Dict[Text, Any]]
+    ) -> List[Dict[Text, Any]]:
+        """Store a conversation's events, returns what was stored (compacted or not)."""
+        compacted = len(events) > self.max_events
+        if compacted:
+            events = compact(events, self.keep_turns, self.max_events)
+        blob = zlib.compress(
+            json.dumps(events, separators=(",", ":")).encode("utf-8"), 1
+        )
+        with self.lock:
+            self.compactions += compacted
+            old = self.conversations.pop(conversation_id, None)
+            if old is not None:
+                self.bytes -= self._size(conversation_id, old[1])
+            self.conversations[conversation_id] = (self.clock(), blob)
+            self.bytes += self._size(conversation_id, blob)
+            self._evict()
+        return events
+
+    def delete(self, conversation_id: Text) -> None:
+        with self.lock:
+            old = self.conversations.pop(conversation_id, None)
+            if old is not None:
+                self.bytes -= self._size(conversation_id, old[1])
+
+    def _evict(self) -> None:
+        idle_before = self.clock() - self.idle_seconds
+        while self.conversations:
+            conversation_id, (written, blob) = next(iter(self.conversations.items()))
+            if written < idle_before:
+                self.idle_evictions += 1
+            elif (
+                len(self.conversations) > self.max_conversations
+                or self.bytes > self.max_bytes
+            ):
+                self.capacity_evictions += 1
+            else:
+                return
+            del self.conversations[conversation_id]
+            self.bytes -= self._size(conversation_id, blob)
+
+    def usage(self, conversation_id: Text) -> int:
+        """Bytes a conversation takes in the store, 0 if it isn't stored."""
+        with self.lock:
+            entry = self.conversations.get(conversation_id)
+        return 0 if entry is None else self._size(conversation_id, entry[1])
+
+    def stats(self) -> Dict[Text, Any]:
+        with self.lock:
+            sizes = [self._size(c, blob) for c, (_, blob) in self.conversations.items()]
+            stored = self.bytes
+        return {
+            "conversations": len(sizes),
+            "bytes": stored,
+            "mean_bytes": stored / len(sizes) if sizes else 0.0,
+            "max_bytes": max(sizes, default=0),
+            "compactions": self.compactions,
+            "idle_evictions": self.idle_evictions,
+            "capacity_evictions": self.capacity_evictions,
+        }
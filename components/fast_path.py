@@ -0,0 +1,259 @@
+"""Answer templated substance questions without running the NLU pipeline.
+
+Most messages are one of a handful of phrasings around a substance name
+("what is X", "whats X", "tell me about X"), the same ones the training data
+is generated from. ``FastPath`` learns those phrasings as templates from the training
+examples and finds the substance names with an Aho-Corasick automaton over
+the entity vocabulary (the lookup table and synonyms). A message that is
+exactly a template around a known name gets its intent and entity in a few
+microseconds; anything else, including near misses, goes to the pipeline. A
+name on its own ("ice", "speed") isn't a template: whether that's a question
+about a substance is left to the model and the fallback classifier.
+"""
+
+import copy
+import time
+from collections import deque
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Text, Tuple
+
+# stands in for the entity in a template
+SLOT = "\0"
+# punctuation that doesn't change what a message asks
+TRAILING = "?!."
+
+
+def normalize_text(text: Text) -> Text:
+    return " ".join(text.lower().split())
+
+
+def template_key(text: Text) -> Text:
+    """A normalized template without trailing punctuation, "what is X?" and "what is X" are one."""
+    return text.rstrip(TRAILING).rstrip()
+
+
+def empty_response_selector(
+    selector_keys: Iterable[Text], all_retrieval_intents: Iterable[Text]
+) -> Dict[Text, Any]:
+    """A parse's ``response_selector`` with no response selected, shaped like Rasa's.
+
+    ``selector_keys`` are the ResponseSelectors' retrieval intents ("default"
+    for one trained on all of them).
+    """
+    no_response = {
+        "id": None,
+        "responses": None,
+        "confidence": 0.0,
+        "intent_response_key": None,
+        "utter_action": None,
+        "template_name": None,
+    }
+    selector = {"all_retrieval_intents": list(all_retrieval_intents)}
+    for key in selector_keys:
+        selector[key] = {"response": dict(no_response), "ranking": []}
+    return selector
+
+
+class AliasAutomaton:
+    """Aho-Corasick automaton finding every occurrence of a set of names."""
+
+    def __init__(self, names: Iterable[Text]) -> None:
+        # state -> char -> state, fail links and the lengths of names ending at each state
+        self.goto: List[Dict[Text, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[List[int]] = [[]]
+        for name in names:
+            self._add(name)
+        self._link()
+
+    def _add(self, name: Text) -> None:
+        if not name:
+            return
+        state = 0
+        for char in name:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            state = next_state
+        if len(name) not in self.output[state]:
+            self.output[state].append(len(name))
+
+    def _link(self) -> None:
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fail = self.fail[state]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                fallback = self.goto[fail].get(char, 0)
+                self.fail[next_state] = fallback if fallback != next_state else 0
+                self.output[next_state] += self.output[self.fail[next_state]]
+
+    def find(self, text: Text) -> Iterator[Tuple[int, int]]:
+        """(start, end) of every name occurring in ``text``."""
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for length in self.output[state]:
+                yield position + 1 - length, position + 1
+
+
+class FastPathStats:
+    """How many messages the fast path answered and the time that took."""
+
+    def __init__(self) -> None:
+        self.messages = 0
+        self.hits = 0
+        self.fast_seconds = 0.0
+        self.pipeline_seconds = 0.0
+
+    def report(self) -> Text:
+        misses = self.messages - self.hits
+        fast = self.fast_seconds / self.messages if self.messages else 0.0
+        pipeline = self.pipeline_seconds / misses if misses else 0.0
+        saved = self.hits * max(pipeline - fast, 0.0)
+        return (
+            f"Substance fast path answered {self.hits} of {self.messages} messages "
+            f"({self.hits / self.messages if self.messages else 0:.0%}), "
+            f"matching took {fast * 1e6:.1f}µs mean and the pipeline "
+            f"{pipeline * 1000:.2f}ms mean for the rest, about {saved:.1f}s saved"
+        )
+
+
+class FastPath:
+    def __init__(
+        self,
+        templates: Dict[Text, Text],
+        synonyms: Dict[Text, Text],
+        names: Iterable[Text],
+        entity: Text = "substance",
+        extractor: Text = "FastPath",
+        min_name_length: int = 3,
+    ) -> None:
+        # a bare name is as likely small talk ("ice", "dust") as a question about a substance
+        self.templates = {
+            template: intent
+            for template, intent in templates.items()
+            if template.strip() != SLOT
+        }
+        self.synonyms = synonyms
+        # "k" or "e" on their own are as likely to be "ok" or a typo, leave those to the model
+        self.names = sorted(
+            name
+            for name in {normalize_text(name) for name in names}
+            if len(name) >= min_name_length
+        )
+        self.entity = entity
+        self.extractor = extractor
+        self.automaton = AliasAutomaton(self.names)
+        self.stats = FastPathStats()
+        # what the pipeline's ResponseSelectors add to a parse, see empty_response_selector
+        self.response_selector: Optional[Dict[Text, Any]] = None
+
+    @classmethod
+    def learn(
+        cls,
+        examples: Iterable[Tuple[Text, Text, List[Dict[Text, Any]]]],
+        synonyms: Dict[Text, Text],
+        names: Iterable[Text],
+        entity: Text = "substance",
+        min_examples: int = 3,
+        **kwargs: Any,
+    ) -> "FastPath":
+        """Templates from (text, intent, entities) training examples.
+
+        A template is an example with its only entity, of type ``entity``,
+        cut out. It's used when it came up at least ``min_examples`` times
+        and always with the same intent.
+        """
+        counts: Dict[Text, Dict[Text, int]] = {}
+        names = set(names)
+        for text, intent, entities in examples:
+            if not intent or len(entities) != 1 or entities[0]["entity"] != entity:
+                continue
+            start, end = entities[0]["start"], entities[0]["end"]
+            template = template_key(normalize_text(text[:start] + SLOT + text[end:]))
+            by_intent = counts.setdefault(template, {})
+            by_intent[intent] = by_intent.get(intent, 0) + 1
+            names.add(text[start:end])
+
+        templates = {
+            template: next(iter(by_intent))
+            for template, by_intent in counts.items()
+            if len(by_intent) == 1 and sum(by_intent.values()) >= min_examples
+        }
+        synonyms = {alias.lower(): value for alias, value in synonyms.items()}
+        names.update(synonyms)
+        return cls(templates, synonyms, names, entity=entity, **kwargs)
+
+    def to_dict(self) -> Dict[Text, Any]:
+        return {
+            "entity": self.entity,
+            "templates": self.templates,
+            "synonyms": self.synonyms,
+            "names": self.names,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[Text, Any], **kwargs: Any) -> "FastPath":
+        return cls(
+            data["templates"],
+            data["synonyms"],
+            data["names"],
+            entity=data["entity"],
+            **kwargs,
+        )
+
+    def match(self, text: Text) -> Optional[Tuple[Text, Dict[Text, Any]]]:
+        """The intent and entity of a message that is exactly a template around a known name."""
+        stripped = text.strip()
+        lowered = stripped.lower()
+        # offsets into the lowered text have to be offsets into the message
+        if len(lowered) != len(stripped) or " ".join(lowered.split()) != lowered:
+            return None
+        offset = len(text) - len(text.lstrip())
+        body = template_key(lowered)
+        candidates = sorted(self.automaton.find(lowered), key=lambda m: m[0] - m[1])
+        for start, end in candidates:
+            if end > len(body):
+                continue
+            intent = self.templates.get(body[:start] + SLOT + body[end:])
+            if intent is None:
+                continue
+            raw = text[offset + start : offset + end]
+            entity = {
+                "entity": self.entity,
+                "start": offset + start,
+                "end": offset + end,
+                "value": self.synonyms.get(raw.lower(), raw),
+                "extractor": self.extractor,
+            }
+            return intent, entity
+        return None
+
+    def parse(self, text: Text) -> Optional[Dict[Text, Any]]:
+        """What ``Interpreter.parse`` would return for a matched message, None otherwise."""
+        start = time.perf_counter()
+        matched = self.match(text) if text else None
+        self.stats.messages += 1
+        self.stats.fast_seconds += time.perf_counter() - start
+        if matched is None:
+            return None
+        self.stats.hits += 1
+        intent, entity = matched
+        parsed = {
+            "text": text,
+            "intent": {"name": intent, "confidence": 1.0},
+            "entities": [entity],
+            "intent_ranking": [{"name": intent, "confidence": 1.0}],
+        }
+        if self.response_selector is not None:
+            parsed["response_selector"] = copy.deepcopy(self.response_selector)
+        return parsed
@@ -0,0 +1,35 @@
+"""Access to the interpreter a pipeline component is running in.
+
+Components only see one message at a time. The profiler and the fast path
+need the whole pipeline, so on their first ``process`` call they look up the
+stack for the frame where ``Interpreter.parse`` is looping over
+``self.pipeline``. It's usually one frame up, but another component can wrap
+``process`` (the profiler does), so the frames in between are skipped.
+"""
+
+import sys
+from typing import Any, Optional
+
+# frames looked at above the caller of ``process``, a few wrappers deep is plenty
+MAX_DEPTH = 10
+
+
+def calling_interpreter(component: Any, depth: int = 2) -> Optional[Any]:
+    """The interpreter whose pipeline is calling ``component.process``, if any.
+
+    ``depth`` counts frames from the caller of this function, 2 being the
+    caller of the component's ``process``, where the search starts.
+    """
+    try:
+        frame = sys._getframe(depth)
+    except ValueError:
+        return None
+    for _ in range(MAX_DEPTH):
+        if frame is None:
+            return None
+        interpreter = frame.f_locals.get("self")
+        pipeline = getattr(interpreter, "pipeline", None)
+        if isinstance(pipeline, list) and any(c is component for c in pipeline):
+            return interpreter
+        frame = frame.f_back
+    return None
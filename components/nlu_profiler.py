@@ -0,0 +1,78 @@
+"""A pipeline component that profiles the components after it.
+
+Put it first in the pipeline in ``config.yml``::
+
+    pipeline:
+      - name: components.nlu_profiler.NLUProfiler
+        sample_rate: 0.01
+        log_interval: 300
+        metrics_port: 9102
+      - name: WhitespaceTokenizer
+      ...
+
+On the first message it's asked to process it finds the interpreter running
+the pipeline (the caller of ``process``), wraps the components that follow it
+and the interpreter's ``parse``, which decides whether a message is sampled
+and records the sample when it returns. Messages the interpreter only
+featurizes (``featurize_message``) aren't counted or sampled. See
+``components.profiling`` for what's recorded. It does nothing during training
+and adds nothing to the parsed message.
+"""
+
+import logging
+from typing import Any, Dict, Optional, Text
+
+from rasa.nlu.components import Component
+from rasa.shared.nlu.training_data.message import Message
+
+from components.hooks import calling_interpreter
+from components.profiling import PipelineProfiler, serve_metrics
+
+logger = logging.getLogger(__name__)
+
+
+class NLUProfiler(Component):
+    """Samples per-component wall time and allocations of parsed messages."""
+
+    defaults = {
+        # share of messages profiled
+        "sample_rate": 0.01,
+        # also record the peak memory each component allocates (tracemalloc)
+        "track_allocations": True,
+        # seconds between log lines with the histograms
+        "log_interval": 300,
+        # serve the histograms at http://<host>:<port>/metrics when set
+        "metrics_port": None,
+    }
+
+    def __init__(self, component_config: Optional[Dict[Text, Any]] = None) -> None:
+        super().__init__(component_config)
+        self.profiler = PipelineProfiler(
+            sample_rate=self.component_config["sample_rate"],
+            track_allocations=self.component_config["track_allocations"],
+            log_interval=self.component_config["log_interval"],
+        )
+        self.instrumented = False
+
+    def process(self, message: Message, **kwargs: Any) -> None:
+        if not self.instrumented:
+            self.instrumented = True
+            # profiling starts with the next parse, this one's already running
+            self._instrument(calling_interpreter(self))
+
+    def _instrument(self, interpreter: Any) -> None:
+        if interpreter is None:
+            logger.warning(
+                "NLUProfiler couldn't find the pipeline it's running in, not profiling"
+            )
+            return
+        pipeline = interpreter.pipeline
+        position = pipeline.index(self)
+        self.profiler.instrument(pipeline[position + 1 :], first_index=position + 1)
+        interpreter.parse = self.profiler.profile_calls(interpreter.parse)
+        logger.info(
+            f"Profiling {len(self.profiler.components)} NLU components on "
+            f"{self.profiler.sample_rate:.1%} of messages"
+        )
+        if self.component_config["metrics_port"]:
+            serve_metrics(self.profiler, int(self.component_config["metrics_port"]))
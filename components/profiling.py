@@ -0,0 +1,332 @@
+"""Per-component timing and allocation statistics for the NLU pipeline.
+
+``PipelineProfiler.instrument`` wraps the ``process`` method of every
+component it's given and ``profile_calls`` wraps the function that runs them
+(the interpreter's ``parse``). A sampled call (``sample_rate`` of them) has
+each component's wall time and, with
+``track_allocations``, the peak Python memory it allocated (what it still
+holds on return, before Python 3.9) recorded into histograms when it
+returns, whichever components ran. Components run outside a profiled call
+(e.g. by ``featurize_message``, which skips the classifiers) and messages that
+aren't sampled only pay for one thread-local lookup per component.
+
+Allocations are what ``tracemalloc`` sees, Python objects and numpy buffers,
+not TensorFlow's own allocator. Tracing is only switched on for the sampled
+message, one message at a time.
+
+A failure of the profiler itself is logged and drops the sample, it never
+reaches the pipeline. The histograms are logged every ``log_interval``
+seconds and can be served in the Prometheus text format by
+``serve_metrics``.
+"""
+
+import logging
+import random
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Text
+
+logger = logging.getLogger(__name__)
+
+# Python 3.9+, older versions can only measure what's still allocated after a component
+_reset_peak = getattr(tracemalloc, "reset_peak", None)
+
+# upper bucket bounds, an overflow bucket follows the last one
+TIME_BUCKETS = (
+    0.00005,
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+)
+ALLOCATION_BUCKETS = tuple(1024 * 4**i for i in range(10))
+
+
+class Histogram:
+    """Counts of observations per bucket, plus their sum and maximum."""
+
+    def __init__(self, bounds: Sequence[float]) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        bucket = 0
+        while bucket < len(self.bounds) and value > self.bounds[bucket]:
+            bucket += 1
+        self.counts[bucket] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket the ``q`` quantile falls in (the maximum for the last one)."""
+        rank = q * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return self.bounds[bucket] if bucket < len(self.bounds) else self.max
+        return 0.0
+
+
+class _Sample:
+    """What's been measured so far for the message being sampled."""
+
+    def __init__(self, trace: bool) -> None:
+        self.trace = trace
+        self.start = time.perf_counter()
+        self.timings: List[Any] = []
+
+
+class PipelineProfiler:
+    def __init__(
+        self,
+        sample_rate: float = 0.01,
+        track_allocations: bool = True,
+        log_interval: float = 60.0,
+        random_source: Callable[[], float] = random.random,
+    ) -> None:
+        self.sample_rate = sample_rate
+        self.track_allocations = track_allocations
+        self.log_interval = log_interval
+        self.random = random_source
+        self.components: List[Text] = []
+        self.timings: Dict[Text, Histogram] = {}
+        self.allocations: Dict[Text, Histogram] = {}
+        self.total = Histogram(TIME_BUCKETS)
+        self.messages = 0
+        self.sampled = 0
+        self.lock = threading.Lock()
+        # tracemalloc is process wide, only one sampled message at a time traces allocations
+        self.tracing = threading.Lock()
+        self.local = threading.local()
+        self.last_log = time.monotonic()
+
+    def instrument(self, components: Iterable[Any], first_index: int = 0) -> None:
+        """Wrap the ``process`` method of the components, named by pipeline position and class."""
+        for offset, component in enumerate(components):
+            name = f"{first_index + offset}_{type(component).__name__}"
+            process = getattr(component.process, "__wrapped__", component.process)
+            component.process = self._wrap(name, process)
+            self.components.append(name)
+            self.timings[name] = Histogram(TIME_BUCKETS)
+            self.allocations[name] = Histogram(ALLOCATION_BUCKETS)
+
+    def profile_calls(self, run: Callable) -> Callable:
+        """Wrap ``run`` so each call is one message, sampled or not, closed when it returns."""
+        run = getattr(run, "__wrapped__", run)
+
+        def profiled_run(*args: Any, **kwargs: Any) -> Any:
+            try:
+                self.start_message()
+            except Exception:
+                logger.exception("NLU profiler failed, not sampling the message")
+            try:
+                return run(*args, **kwargs)
+            finally:
+                self.end_message()
+
+        profiled_run.__wrapped__ = run
+        return profiled_run
+
+    def start_message(self) -> None:
+        """Decide whether the message about to go through the pipeline is sampled."""
+        self.messages += 1
+        self.local.sample = None
+        if not self.components or self.random() >= self.sample_rate:
+            return
+        trace = self.track_allocations and self.tracing.acquire(blocking=False)
+        if trace and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        elif trace:
+            # someone else is tracing already, leave them to it
+            self.tracing.release()
+            trace = False
+        self.local.sample = _Sample(trace)
+
+    def end_message(self) -> None:
+        """Record the message's sample if it was sampled, and stop tracing allocations."""
+        sample = getattr(self.local, "sample", None)
+        if sample is None:
+            return
+        try:
+            self._finish(sample)
+        except Exception:
+            logger.exception("NLU profiler couldn't stop sampling")
+
+    def _wrap(self, name: Text, process: Callable) -> Callable:
+        def profiled(message: Any, **kwargs: Any) -> Any:
+            sample = getattr(self.local, "sample", None)
+            if sample is None:
+                return process(message, **kwargs)
+
+            try:
+                before = self._allocation_start(sample)
+                start = time.perf_counter()
+            except Exception:
+                self._failed(sample)
+                return process(message, **kwargs)
+            try:
+                result = process(message, **kwargs)
+            except BaseException:
+                # the component raised, the message never finishes
+                sample.timings = None
+                raise
+            try:
+                elapsed = time.perf_counter() - start
+                allocated = self._allocation_end(sample, before)
+                sample.timings.append((name, elapsed, allocated))
+            except Exception:
+                self._failed(sample)
+            return result
+
+        profiled.__wrapped__ = process
+        return profiled
+
+    @staticmethod
+    def _allocation_start(sample: _Sample) -> Optional[int]:
+        if not sample.trace:
+            return None
+        if _reset_peak is not None:
+            _reset_peak()
+        return tracemalloc.get_traced_memory()[0]
+
+    @staticmethod
+    def _allocation_end(sample: _Sample, before: Optional[int]) -> Optional[int]:
+        if before is None:
+            return None
+        current, peak = tracemalloc.get_traced_memory()
+        # without reset_peak (before Python 3.9) only what's still allocated can be measured
+        return (peak if _reset_peak is not None else current) - before
+
+    def _failed(self, sample: _Sample) -> None:
+        """Drop a sample the profiler itself failed on, never raising into the pipeline."""
+        logger.exception("NLU profiler failed, dropping the sampled message")
+        sample.timings = None
+        self.end_message()
+
+    def _finish(self, sample: _Sample) -> None:
+        self.local.sample = None
+        if sample.trace:
+            tracemalloc.stop()
+            self.tracing.release()
+        if sample.timings is None:
+            # a component raised, the message never finished
+            return
+        with self.lock:
+            self.sampled += 1
+            self.total.observe(time.perf_counter() - sample.start)
+            for name, elapsed, allocated in sample.timings:
+                self.timings[name].observe(elapsed)
+                if allocated is not None:
+                    self.allocations[name].observe(allocated)
+            log = time.monotonic() - self.last_log >= self.log_interval
+            if log:
+                self.last_log = time.monotonic()
+        if log:
+            for line in self.report():
+                logger.info(line)
+
+    def report(self) -> List[Text]:
+        lines = [
+            f"NLU profile: {self.sampled} of {self.messages} messages sampled, "
+            f"pipeline p50 {self.total.quantile(0.5) * 1000:.2f}ms "
+            f"p95 {self.total.quantile(0.95) * 1000:.2f}ms"
+        ]
+        for name in self.components:
+            timing = self.timings[name]
+            allocation = self.allocations[name]
+            line = (
+                f"  {name}: mean {timing.mean * 1000:.3f}ms "
+                f"p50 {timing.quantile(0.5) * 1000:.3f}ms "
+                f"p95 {timing.quantile(0.95) * 1000:.3f}ms "
+                f"max {timing.max * 1000:.3f}ms"
+            )
+            if allocation.count:
+                line += (
+                    f", allocated mean {allocation.mean / 1024:.1f}KiB "
+                    f"p95 {allocation.quantile(0.95) / 1024:.0f}KiB"
+                )
+            lines.append(line)
+        return lines
+
+    def prometheus(self) -> Text:
+        """The histograms in the Prometheus text exposition format."""
+        lines = [
+            "# TYPE nlu_messages_total counter",
+            f"nlu_messages_total {self.messages}",
+            "# TYPE nlu_messages_sampled_total counter",
+            f"nlu_messages_sampled_total {self.sampled}",
+        ]
+        with self.lock:
+            lines += _histogram_lines("nlu_pipeline_seconds", {"": self.total})
+            lines += _histogram_lines("nlu_component_seconds", self.timings)
+            lines += _histogram_lines(
+                "nlu_component_allocated_bytes",
+                {n: h for n, h in self.allocations.items() if h.count},
+            )
+        return "\n".join(lines) + "\n"
+
+
+def _histogram_lines(metric: Text, histograms: Dict[Text, Histogram]) -> List[Text]:
+    lines = [f"# TYPE {metric} histogram"]
+    for name, histogram in histograms.items():
+        labels = f'component="{name}",' if name else ""
+        cumulative = 0
+        for bound, count in zip(list(histogram.bounds) + ["+Inf"], histogram.counts):
+            cumulative += count
+            lines.append(f'{metric}_bucket{{{labels}le="{bound}"}} {cumulative}')
+        labels = f'{{component="{name}"}}' if name else ""
+        lines.append(f"{metric}_sum{labels} {histogram.sum}")
+        lines.append(f"{metric}_count{labels} {histogram.count}")
+    return lines
+
+
+def serve_metrics(
+    profiler: PipelineProfiler, port: int, host: Text = "0.0.0.0"
+) -> Optional[ThreadingHTTPServer]:
+    """Serve ``/metrics`` from a background thread, None when the port can't be bound."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = profiler.prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: Text, *args: Any) -> None:
+            pass
+
+    try:
+        server = ThreadingHTTPServer((host, port), Handler)
+    except OSError:
+        logger.exception(f"Couldn't serve NLU metrics on port {port}")
+        return None
+    threading.Thread(
+        target=server.serve_forever, name="nlu-metrics", daemon=True
+    ).start()
+    logger.info(f"Serving NLU profile metrics on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,158 @@
+"""A pipeline component that answers templated substance questions itself.
+
+Put it first in the pipeline in ``config.yml``::
+
+    pipeline:
+      - name: components.substance_fast_path.SubstanceFastPath
+      - name: WhitespaceTokenizer
+      ...
+
+Training learns the templates and the substance vocabulary from the training
+data (see ``components.fast_path``) and stores them with the model. When the
+model parses its first message the component wraps the interpreter's
+``parse``: a message the fast path matches is returned as parsed right away
+without running any component, everything else goes through the pipeline as
+before. How many messages it answered and the time that saved are logged
+every ``log_interval`` seconds.
+"""
+
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Optional, Text
+
+from rasa.nlu.components import Component
+from rasa.nlu.config import RasaNLUModelConfig
+from rasa.shared.nlu.constants import ENTITIES, INTENT, TEXT
+from rasa.shared.nlu.training_data.message import Message
+from rasa.shared.nlu.training_data.training_data import TrainingData
+
+from components.fast_path import FastPath, empty_response_selector
+from components.hooks import calling_interpreter
+
+logger = logging.getLogger(__name__)
+
+
+class SubstanceFastPath(Component):
+    """Classifies "what is X" style messages without the ML pipeline."""
+
+    defaults = {
+        # entity the templates are built around
+        "entity": "substance",
+        # times a template has to come up in the training data to be trusted
+        "min_examples": 3,
+        # shorter names are left to the model
+        "min_name_length": 3,
+        # seconds between log lines with how many messages were answered
+        "log_interval": 300,
+    }
+
+    def __init__(
+        self,
+        component_config: Optional[Dict[Text, Any]] = None,
+        fast_path: Optional[FastPath] = None,
+    ) -> None:
+        super().__init__(component_config)
+        self.fast_path = fast_path
+        self.hooked = False
+        self.last_log = time.monotonic()
+
+    def train(
+        self,
+        training_data: TrainingData,
+        config: Optional[RasaNLUModelConfig] = None,
+        **kwargs: Any,
+    ) -> None:
+        entity = self.component_config["entity"]
+        examples = [
+            (m.get(TEXT), m.get(INTENT), m.get(ENTITIES) or [])
+            for m in training_data.intent_examples
+        ]
+        names = [
+            element
+            for table in training_data.lookup_tables
+            if table.get("name") == entity and isinstance(table.get("elements"), list)
+            for element in table["elements"]
+        ]
+        self.fast_path = FastPath.learn(
+            examples,
+            training_data.entity_synonyms,
+            names,
+            entity=entity,
+            min_examples=self.component_config["min_examples"],
+            extractor=self.name,
+            min_name_length=self.component_config["min_name_length"],
+        )
+        logger.info(
+            f"Substance fast path learned {len(self.fast_path.templates)} templates "
+            f"over {len(self.fast_path.names)} names"
+        )
+
+    def process(self, message: Message, **kwargs: Any) -> None:
+        if not self.hooked:
+            self.hooked = True
+            self._hook(calling_interpreter(self))
+
+    def _hook(self, interpreter: Any) -> None:
+        if interpreter is None or self.fast_path is None:
+            logger.warning(
+                "SubstanceFastPath has no templates or couldn't find the pipeline "
+                "it's running in, every message goes through the pipeline"
+            )
+            return
+        selectors = [
+            c for c in interpreter.pipeline if type(c).__name__ == "ResponseSelector"
+        ]
+        if selectors:
+            # answers have the same keys as the pipeline's, with no response selected
+            self.fast_path.response_selector = empty_response_selector(
+                [getattr(c, "retrieval_intent", None) or "default" for c in selectors],
+                getattr(selectors[0], "all_retrieval_intents", []),
+            )
+        parse = interpreter.parse
+        stats = self.fast_path.stats
+
+        def fast_parse(text: Text, *args: Any, **kwargs: Any) -> Dict[Text, Any]:
+            parsed = self.fast_path.parse(text)
+            if parsed is None:
+                start = time.perf_counter()
+                parsed = parse(text, *args, **kwargs)
+                stats.pipeline_seconds += time.perf_counter() - start
+            if (
+                time.monotonic() - self.last_log
+                >= self.component_config["log_interval"]
+            ):
+                self.last_log = time.monotonic()
+                logger.info(stats.report())
+            return parsed
+
+        interpreter.parse = fast_parse
+
+    def persist(self, file_name: Text, model_dir: Text) -> Optional[Dict[Text, Any]]:
+        if self.fast_path is None:
+            return None
+        file_name = f"{file_name}.json"
+        with open(os.path.join(model_dir, file_name), "w", encoding="utf-8") as f:
+            json.dump(self.fast_path.to_dict(), f, ensure_ascii=False)
+        return {"file": file_name}
+
+    @classmethod
+    def load(
+        cls,
+        meta: Dict[Text, Any],
+        model_dir: Text,
+        model_metadata: Optional[Any] = None,
+        cached_component: Optional["SubstanceFastPath"] = None,
+        **kwargs: Any,
+    ) -> "SubstanceFastPath":
+        file_name = meta.get("file")
+        if not file_name:
+            return cls(meta)
+        with open(os.path.join(model_dir, file_name), encoding="utf-8") as f:
+            fast_path = FastPath.from_dict(
+                json.load(f),
+                extractor=cls.name,
+                min_name_length=meta.get("min_name_length", 3),
+            )
+        return cls(meta, fast_path)
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# the actions package and the ts_pn_data scripts are imported the way the action server and
+# getData.py import them, from the repo root and from ts_pn_data/
+repo_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, repo_root)
+sys.path.insert(0, os.path.join(repo_root, "ts_pn_data"))
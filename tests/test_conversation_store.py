@@ -0,0 +1,175 @@
+import pytest
+
+from components.conversation_store import ConversationStore, compact
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def turn(number, substance=None):
+    """the events a what_is_substance turn adds"""
+    events = [
+        {"event": "user", "text": f"message {number}", "timestamp": number},
+    ]
+    if substance:
+        events.append(
+            {
+                "event": "slot",
+                "name": "substance",
+                "value": substance,
+                "timestamp": number,
+            }
+        )
+    events += [
+        {"event": "bot", "text": f"answer {number}", "timestamp": number},
+        {"event": "action", "name": "action_listen", "timestamp": number},
+    ]
+    return events
+
+
+def conversation(turns, substance_every=None):
+    events = [
+        {"event": "action", "name": "action_session_start", "timestamp": 0},
+        {"event": "session_started", "timestamp": 0},
+        {"event": "action", "name": "action_listen", "timestamp": 0},
+    ]
+    for number in range(1, turns + 1):
+        substance = None
+        if substance_every and number % substance_every == 0:
+            substance = f"substance {number}"
+        events += turn(number, substance)
+    return events
+
+
+def user_texts(events):
+    return [e["text"] for e in events if e["event"] == "user"]
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def test_compaction_keeps_the_last_turns_and_a_slot_snapshot():
+    events = conversation(30, substance_every=7)
+    events.append({"event": "slot", "name": "intake", "value": "oral", "timestamp": 30})
+
+    compacted = compact(events, keep_turns=10, max_events=50)
+
+    assert user_texts(compacted) == [f"message {n}" for n in range(21, 31)]
+    snapshot = compacted[
+        : compacted.index(next(e for e in compacted if e["event"] == "user"))
+    ]
+    assert [e["event"] for e in snapshot] == [
+        "action",
+        "session_started",
+        "slot",
+        "action",
+    ]
+    assert snapshot[0]["name"] == "action_session_start"
+    # the slot as it was before the kept turns, set in turn 14
+    assert (snapshot[2]["name"], snapshot[2]["value"]) == ("substance", "substance 14")
+    assert snapshot[-1]["name"] == "action_listen"
+    # what the kept turns set is kept as it happened
+    assert compacted[-1] == events[-1]
+    assert compacted[len(snapshot) :] == events[-len(compacted) + len(snapshot) :]
+
+
+def test_compaction_forgets_slots_reset_by_a_restart():
+    events = conversation(5, substance_every=1)
+    events.append({"event": "restart", "timestamp": 5})
+    events += turn(6) + turn(7)
+
+    compacted = compact(events, keep_turns=2, max_events=50)
+
+    assert user_texts(compacted) == ["message 6", "message 7"]
+    assert not [e for e in compacted if e["event"] == "slot"]
+
+
+def test_short_conversation_isnt_compacted():
+    events = conversation(5)
+
+    assert compact(events, keep_turns=10, max_events=50) is events
+
+
+def test_turns_longer_than_max_events_are_cut_at_a_user_message():
+    events = conversation(10)
+
+    compacted = compact(events, keep_turns=10, max_events=7)
+
+    assert compacted[0]["event"] != "user"
+    assert user_texts(compacted) == ["message 9", "message 10"]
+
+
+def test_put_compacts_long_conversations(clock):
+    store = ConversationStore(max_events=40, keep_turns=5, clock=clock)
+
+    stored = store.put("alice", conversation(20, substance_every=3))
+
+    assert user_texts(stored) == [f"message {n}" for n in range(16, 21)]
+    assert store.get("alice") == stored
+    assert store.stats()["compactions"] == 1
+
+
+def test_idle_conversations_are_evicted(clock):
+    store = ConversationStore(idle_seconds=60, clock=clock)
+    store.put("alice", conversation(1))
+    clock.now += 30
+    store.put("bob", conversation(1))
+    clock.now += 31
+
+    # evicting happens on writes
+    store.put("carol", conversation(1))
+
+    assert store.get("alice") is None
+    assert "alice" not in store
+    assert store.get("bob") == conversation(1)
+    assert store.keys() == ["bob", "carol"]
+    assert store.stats()["idle_evictions"] == 1
+
+
+def test_least_recently_written_go_first_over_max_conversations(clock):
+    store = ConversationStore(max_conversations=2, clock=clock)
+    store.put("alice", conversation(1))
+    store.put("bob", conversation(1))
+    store.put("alice", conversation(2))
+
+    store.put("carol", conversation(1))
+
+    assert store.get("bob") is None
+    assert store.keys() == ["alice", "carol"]
+    assert len(store) == 2
+    assert store.stats()["capacity_evictions"] == 1
+
+
+def test_least_recently_written_go_first_over_max_bytes(clock):
+    probe = ConversationStore(clock=clock)
+    probe.put("alice", conversation(3))
+    size = probe.usage("alice")
+    store = ConversationStore(max_bytes=size * 2 + size // 2, clock=clock)
+    for name in ["alice", "bob", "carol"]:
+        store.put(name, conversation(3))
+
+    assert store.get("alice") is None
+    assert store.usage("alice") == 0
+    assert store.keys() == ["bob", "carol"]
+    assert store.stats()["bytes"] == store.usage("bob") + store.usage("carol")
+    assert store.stats()["bytes"] <= store.max_bytes
+
+
+def test_delete_and_overwrite_keep_the_byte_count(clock):
+    store = ConversationStore(clock=clock)
+    store.put("alice", conversation(3))
+    store.put("alice", conversation(8))
+    store.put("bob", conversation(1))
+
+    store.delete("alice")
+    store.delete("nobody")
+
+    assert store.get("alice") is None
+    assert store.stats()["bytes"] == store.usage("bob")
@@ -0,0 +1,166 @@
+import json
+import math
+import os
+import re
+
+import numpy as np
+import pytest
+
+from actions.dose_index import DoseIndex, build_dose_index, parse_amount
+
+KB_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "..",
+    "ts_pn_data",
+    "substances_data.json",
+)
+inf = math.inf
+
+
+# every format in substances_data.json, taken from the data as written
+@pytest.mark.parametrize(
+    "value, kind, expected",
+    [
+        # ranges, with and without spaces, units written once or on both ends
+        ("5 - 10 mg", "dosage", (5, 10, "mg")),
+        ("100-130mg", "dosage", (100, 130, "mg")),
+        ("50mg-100mg", "dosage", (50, 100, "mg")),
+        (".5-1mg", "dosage", (0.5, 1, "mg")),
+        ("100-135mg.", "dosage", (100, 135, "mg")),
+        ("2.5 - 5 mg (THC)", "dosage", (2.5, 5, "mg")),
+        ("3 mg", "dosage", (3, 3, "mg")),
+        ("5mg", "dosage", (5, 5, "mg")),
+        ("10-15", "dosage", (10, 15, "")),
+        # "+" open upper bounds, before or after the unit and after a range
+        ("40 mg +", "dosage", (40, inf, "mg")),
+        ("140 mg+", "dosage", (140, inf, "mg")),
+        ("200mg+", "dosage", (200, inf, "mg")),
+        ("150mg+.", "dosage", (150, inf, "mg")),
+        ("100+mg", "dosage", (100, inf, "mg")),
+        ("25+ mg", "dosage", (25, inf, "mg")),
+        ("200-350mg+", "dosage", (200, inf, "mg")),
+        ("25 - 30 mg +", "dosage", (25, inf, "mg")),
+        ("150-200+mg", "dosage", (150, inf, "mg")),
+        ("6+ hours", "duration", (360, inf, "minutes")),
+        ("4-24+ hours", "duration", (240, inf, "minutes")),
+        # open lower and upper bounds written as prefixes
+        ("< 2 mg", "dosage", (0, 2, "mg")),
+        ("> 55 mg", "dosage", (55, inf, "mg")),
+        ("up to 24 hours", "duration", (0, 1440, "minutes")),
+        # micrograms in every spelling stay µg, grams become mg
+        ("25 - 75 µg", "dosage", (25, 75, "µg")),
+        ("800 - 1300 μg", "dosage", (800, 1300, "µg")),
+        ("25-50ug", "dosage", (25, 50, "µg")),
+        ("166ug-416ug", "dosage", (166, 416, "µg")),
+        ("2000ug+", "dosage", (2000, inf, "µg")),
+        ("1400ug-2000ug+", "dosage", (1400, inf, "µg")),
+        ("1 - 5 g", "dosage", (1000, 5000, "mg")),
+        ("0.25 - 0.5g", "dosage", (250, 500, "mg")),
+        ("25g-30g", "dosage", (25000, 30000, "mg")),
+        ("3.5g+", "dosage", (3500, inf, "mg")),
+        # a range mixing µg and mg is expressed in µg
+        ("750ug-1mg", "dosage", (750, 1000, "µg")),
+        ("800ug-1mg.", "dosage", (800, 1000, "µg")),
+        # other units
+        ("0.5 - 1 mL", "dosage", (0.5, 1, "mL")),
+        ("0.3 - 0.9 ml", "dosage", (0.3, 0.9, "mL")),
+        ("4 mL +", "dosage", (4, inf, "mL")),
+        ("15 - 22 mg/kg of body weight", "dosage", (15, 22, "mg/kg")),
+        ("1-2seeds", "dosage", (1, 2, "seeds")),
+        ("1-2units", "dosage", (1, 2, "units")),
+        # durations in minutes
+        ("3 - 5 hours", "duration", (180, 300, "minutes")),
+        ("8-10 hours", "duration", (480, 600, "minutes")),
+        ("30-90 minutes", "duration", (30, 90, "minutes")),
+        ("15 - 120 seconds", "duration", (0.25, 2, "minutes")),
+        ("3 - 6 days", "duration", (4320, 8640, "minutes")),
+        ("5-30", "duration", (5, 30, "")),
+    ],
+)
+def test_parse_amount(value, kind, expected):
+    low, high, unit = parse_amount(value, kind)
+    assert (low, high, unit) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize(
+    "value, kind",
+    [
+        (None, "dosage"),
+        ("", "dosage"),
+        ("-", "duration"),
+        ("-  mg", "dosage"),
+        ("??? -\xa0???", "duration"),
+        ("Within minutes", "duration"),
+        ("Oral minutes", "duration"),
+        ("Rapid.", "duration"),
+        ("Risk", "duration"),
+        # a dose unit on a duration and the other way round
+        ("5 - 10 mg", "duration"),
+        ("3 - 5 hours", "dosage"),
+        # a range going down
+        ("10 - 5 mg", "dosage"),
+    ],
+)
+def test_unparsable(value, kind):
+    assert parse_amount(value, kind) is None
+
+
+@pytest.fixture(scope="module")
+def substances():
+    with open(KB_PATH) as f:
+        return json.load(f)["substances"]
+
+
+def test_build_dose_index_over_the_data(substances):
+    index = build_dose_index(substances)
+    dose_index = DoseIndex(index)
+    assert len(index["offsets"]) == max(s["id"] for s in substances) + 2
+    assert np.all(index["min"] <= index["max"])
+    assert set(dose_index.unit_names) <= {
+        "mg",
+        "µg",
+        "mL",
+        "mg/kg",
+        "seeds",
+        "units",
+        "minutes",
+        "",
+    }
+
+    for substance in substances:
+        expected = [
+            (roa["name"], kind, entry["name"], parse_amount(entry.get("value"), kind))
+            for roa in substance.get("roas") or []
+            for kind in ["dosage", "duration"]
+            for entry in roa.get(kind) or []
+        ]
+        expected = [
+            (roa, kind, level, *parsed)
+            for roa, kind, level, parsed in expected
+            if parsed
+        ]
+        found = dose_index.lookup(substance["id"])
+        assert [r[:3] for r in found] == [e[:3] for e in expected], substance["name"]
+        assert [r.unit for r in found] == [e[5] for e in expected], substance["name"]
+        # stored as float32
+        for r, e in zip(found, expected):
+            assert r.min == pytest.approx(e[3], rel=1e-6), substance["name"]
+            assert r.max == pytest.approx(e[4], rel=1e-6), substance["name"]
+
+
+def test_only_non_numeric_values_are_unparsed(substances):
+    index = build_dose_index(substances)
+    numeric_range = re.compile(
+        r"^\s*(?P<low>\d+(\.\d+)?)\s*-\s*(?P<high>\d+(\.\d+)?)\s*"
+        r"(mg|µg|ug|g|ml|hours|minutes)\s*$",
+        re.IGNORECASE,
+    )
+    assert len(index["unparsed"]) > 0
+    # ranges going down ("400 - 1 mg", the first number missing its µg) are left out too
+    assert not [
+        value
+        for value, match in (
+            (str(v), numeric_range.match(str(v))) for v in index["unparsed"]
+        )
+        if match and float(match.group("low")) <= float(match.group("high"))
+    ]
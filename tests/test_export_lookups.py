@@ -0,0 +1,55 @@
+import yaml
+
+from exportData import write_lookups
+
+
+def synonyms(path):
+    with open(path) as f:
+        nlu = yaml.safe_load(f)["nlu"]
+    return {
+        block["synonym"]: [line[2:] for line in block["examples"].splitlines()]
+        for block in nlu
+        if "synonym" in block
+    }
+
+
+def test_aliases_of_a_substance_whose_name_was_claimed_are_kept(tmp_path):
+    substances = [
+        {"name": "2C-B", "aliases": ["Nexus"]},
+        # only differs in case, so its canonical name is claimed by the substance above
+        {"name": "2c-b", "aliases": ["Bees", "Venus"]},
+        {"name": "MDMA", "aliases": ["Molly", "mdma"]},
+    ]
+    path = tmp_path / "lookups.yml"
+
+    write_lookups(substances, str(path))
+
+    assert synonyms(path) == {
+        "2C-B": ["Nexus"],
+        "2c-b": ["Bees", "Venus"],
+        "MDMA": ["Molly"],
+    }
+
+
+def lookup(path):
+    with open(path) as f:
+        nlu = yaml.safe_load(f)["nlu"]
+    (block,) = [block for block in nlu if "lookup" in block]
+    return [line[2:] for line in block["examples"].splitlines()]
+
+
+def test_short_names_are_left_out_of_the_lookup_and_returned(tmp_path):
+    substances = [
+        {"name": "2C-B", "aliases": ["2C", "Nexus"]},
+        {"name": "Ketamine", "aliases": ["K"]},
+    ]
+    path = tmp_path / "lookups.yml"
+
+    too_short = write_lookups(substances, str(path))
+
+    assert lookup(path) == ["2C-B", "Nexus", "Ketamine"]
+    assert too_short == ["2C", "K"]
+    assert synonyms(path) == {"2C-B": ["2C", "Nexus"], "Ketamine": ["K"]}
+
+    assert write_lookups(substances, str(path), min_length=1) == []
+    assert lookup(path) == ["2C-B", "2C", "Nexus", "Ketamine", "K"]
@@ -0,0 +1,203 @@
+import pytest
+
+from components.fast_path import (
+    SLOT,
+    AliasAutomaton,
+    FastPath,
+    empty_response_selector,
+)
+
+
+def example(before, name, after, intent="what_is_substance"):
+    text = before + name + after
+    entity = {
+        "entity": "substance",
+        "start": len(before),
+        "end": len(before) + len(name),
+        "value": name,
+    }
+    return text, intent, [entity]
+
+
+# the phrasings the generated intents use, each around a few substances
+EXAMPLES = (
+    [
+        example(before, name, after)
+        for before, after in [("what is ", "?"), ("whats ", ""), ("tell me about ", "")]
+        for name in ["LSD", "molly", "2C-B"]
+    ]
+    + [
+        # a bare name comes up in the training data too
+        example("", name, "")
+        for name in ["ketamine", "speed", "ice", "LSD"]
+    ]
+    + [
+        example("is ", name, " safe", intent="ask_safety")
+        for name in ["LSD", "molly", "2C-B"]
+    ]
+    + [
+        # a template seen with two intents is ambiguous
+        example("", name, " dose", intent=intent)
+        for name, intent in [
+            ("LSD", "ask_dose"),
+            ("molly", "ask_dose"),
+            ("2C-B", "faq"),
+        ]
+    ]
+    + [
+        # and one seen too rarely isn't trusted
+        example("how about ", "LSD", ""),
+        example("with ", "LSD", "", intent="ask_combo"),
+        # more than one entity isn't a template
+        (
+            "LSD and molly",
+            "ask_combo",
+            [
+                {"entity": "substance", "start": 0, "end": 3, "value": "LSD"},
+                {"entity": "substance", "start": 8, "end": 13, "value": "molly"},
+            ],
+        ),
+    ]
+)
+
+SYNONYMS = {"Molly": "MDMA", "Mandy": "MDMA", "Acid": "LSD"}
+NAMES = ["LSD", "MDMA", "2C-B", "2C-B-FLY", "ketamine", "meth", "methylone", "ice"]
+
+
+@pytest.fixture
+def fast_path():
+    return FastPath.learn(EXAMPLES, SYNONYMS, NAMES, min_examples=3)
+
+
+def matched(fast_path, text):
+    parsed = fast_path.parse(text)
+    if parsed is None:
+        return None
+    (entity,) = parsed["entities"]
+    assert text[entity["start"] : entity["end"]].lower() in fast_path.names
+    return parsed["intent"]["name"], entity["value"]
+
+
+def test_learns_templates_seen_often_enough_with_one_intent(fast_path):
+    assert fast_path.templates == {
+        f"what is {SLOT}": "what_is_substance",
+        f"whats {SLOT}": "what_is_substance",
+        f"tell me about {SLOT}": "what_is_substance",
+        f"is {SLOT} safe": "ask_safety",
+    }
+
+
+def test_vocabulary_takes_entities_synonyms_and_lookup_names(fast_path):
+    assert {"molly", "mandy", "acid", "2c-b-fly", "methylone"} <= set(fast_path.names)
+    # too short to trust on its own
+    assert "2c" not in FastPath({}, {}, ["2C"]).names
+
+
+def test_bare_name_is_left_to_the_pipeline(fast_path):
+    for text in ["ice", "LSD", "speed", "ketamine?", "  molly  "]:
+        assert fast_path.parse(text) is None
+    # persisted models with the bare template don't answer them either
+    restored = FastPath({SLOT: "what_is_substance"}, {}, ["ice"])
+    assert restored.parse("ice") is None
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("what is LSD?", ("what_is_substance", "LSD")),
+        ("What is lsd", ("what_is_substance", "lsd")),
+        ("whats molly", ("what_is_substance", "MDMA")),
+        ("tell me about Acid!", ("what_is_substance", "LSD")),
+        ("is 2C-B safe?", ("ask_safety", "2C-B")),
+    ],
+)
+def test_matches_a_template_around_a_known_name(fast_path, text, expected):
+    assert matched(fast_path, text) == expected
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "what is lsd like",
+        "what is unknownium",
+        "what  is lsd",
+        "LSD dose",
+        "how about LSD",
+        "what is lsd and molly",
+        "",
+    ],
+)
+def test_anything_else_goes_to_the_pipeline(fast_path, text):
+    assert fast_path.parse(text) is None
+
+
+@pytest.mark.parametrize(
+    "text, name",
+    [
+        # a name is a prefix of another one
+        ("what is 2C-B", "2C-B"),
+        ("what is 2C-B-FLY", "2C-B-FLY"),
+        ("what is meth", "meth"),
+        ("what is methylone", "methylone"),
+        # names inside other names and the template's words
+        ("tell me about ice", "ice"),
+    ],
+)
+def test_overlapping_names_match_the_whole_name(fast_path, text, name):
+    assert matched(fast_path, text) == ("what_is_substance", name)
+
+
+def test_offsets_account_for_surrounding_whitespace(fast_path):
+    parsed = fast_path.parse("  whats ketamine?")
+
+    (entity,) = parsed["entities"]
+    assert (entity["start"], entity["end"], entity["value"]) == (8, 16, "ketamine")
+
+
+def test_automaton_finds_every_occurrence():
+    automaton = AliasAutomaton(["he", "she", "his", "hers"])
+
+    assert sorted(automaton.find("ushers")) == [(1, 4), (2, 4), (2, 6)]
+    assert list(AliasAutomaton(["meth", "methylone"]).find("methylone")) == [
+        (0, 4),
+        (0, 9),
+    ]
+    assert list(AliasAutomaton(["aa"]).find("aaa")) == [(0, 2), (1, 3)]
+
+
+def test_parse_has_the_pipelines_keys(fast_path):
+    fast_path.response_selector = empty_response_selector(
+        ["out_of_scope", "faq"], ["out_of_scope", "faq", "chitchat"]
+    )
+
+    parsed = fast_path.parse("what is LSD")
+
+    assert set(parsed) == {
+        "text",
+        "intent",
+        "entities",
+        "intent_ranking",
+        "response_selector",
+    }
+    selector = parsed["response_selector"]
+    assert selector["all_retrieval_intents"] == ["out_of_scope", "faq", "chitchat"]
+    assert selector["faq"]["ranking"] == []
+    assert selector["faq"]["response"]["confidence"] == 0.0
+    # every parse gets its own copy
+    selector["faq"]["ranking"].append("changed")
+    assert fast_path.parse("what is LSD")["response_selector"]["faq"]["ranking"] == []
+
+
+def test_round_trips_through_to_dict(fast_path):
+    restored = FastPath.from_dict(fast_path.to_dict())
+
+    assert restored.templates == fast_path.templates
+    assert restored.names == fast_path.names
+    assert matched(restored, "whats molly") == ("what_is_substance", "MDMA")
+
+
+def test_counts_answered_messages(fast_path):
+    for text in ["what is LSD", "ice", "what is molly"]:
+        fast_path.parse(text)
+
+    assert (fast_path.stats.messages, fast_path.stats.hits) == (3, 2)
@@ -0,0 +1,167 @@
+import gc
+import json
+import os
+
+import pytest
+
+from actions.hot_reload import KnowledgeBaseReloader
+from actions.knowledge_base import data_key
+from actions.packed_kb import write_packed_kb
+
+
+class Index:
+    """an index file holding the data_key of what it was built from"""
+
+    def __init__(self, path):
+        with open(path) as f:
+            self.data_key = json.load(f)["data_key"]
+
+
+def substances(*names):
+    return [
+        {"id": number, "name": name, "aliases": []} for number, name in enumerate(names)
+    ]
+
+
+class Files:
+    def __init__(self, directory, extension):
+        self.kb = str(directory / f"substances{extension}")
+        self.index = str(directory / "index.json")
+        self.mtime = 1_600_000_000
+
+    def write_kb(self, data):
+        if self.kb.endswith(".kb"):
+            write_packed_kb(data, self.kb)
+        else:
+            with open(self.kb, "w") as f:
+                json.dump({"substances": data}, f)
+        self._touch(self.kb)
+
+    def write_index(self, data):
+        with open(self.index, "w") as f:
+            json.dump({"data_key": data_key(data)}, f)
+        self._touch(self.index)
+
+    def _touch(self, path):
+        # a distinct mtime per write, however coarse the file system's clock
+        self.mtime += 10
+        os.utime(path, (self.mtime, self.mtime))
+
+
+@pytest.fixture(params=[".json", ".kb"])
+def files(request, tmp_path):
+    yield Files(tmp_path, request.param)
+    gc.unfreeze()
+
+
+def names(snapshot):
+    knowledge_base = snapshot.knowledge_base
+    return sorted(knowledge_base.get(i)["name"] for i in range(len(knowledge_base)))
+
+
+def reloader_for(files):
+    reloader = KnowledgeBaseReloader(
+        files.kb, interval=0, indexes={"search": (files.index, Index)}
+    )
+    reloads = []
+    reloader.on_reload(reloads.append)
+    return reloader, reloads
+
+
+def test_index_is_used_with_the_data_it_was_built_from(files):
+    files.write_kb(substances("LSD", "MDMA"))
+    files.write_index(substances("LSD", "MDMA"))
+
+    reloader, _ = reloader_for(files)
+
+    snapshot = reloader.snapshot()
+    assert snapshot.version == 1
+    assert names(snapshot) == ["LSD", "MDMA"]
+    assert snapshot.indexes["search"].data_key == snapshot.knowledge_base.data_key()
+
+
+def test_index_from_other_data_isnt_used(files):
+    files.write_kb(substances("LSD", "MDMA"))
+    files.write_index(substances("LSD", "MDMA", "DMT"))
+
+    reloader, _ = reloader_for(files)
+
+    assert reloader.snapshot().indexes["search"] is None
+
+
+def test_change_is_only_loaded_once_the_file_settles(files):
+    files.write_kb(substances("LSD", "MDMA"))
+    files.write_index(substances("LSD", "MDMA"))
+    reloader, reloads = reloader_for(files)
+    first = reloader.snapshot()
+
+    files.write_kb(substances("LSD"))
+    # first poll only notices the change
+    assert not reloader.check()
+    # still being written
+    files.write_kb(substances("LSD", "MDMA", "DMT"))
+    assert not reloader.check()
+    assert reloader.snapshot() is first
+
+    # unchanged since the last poll, so it's loaded
+    assert reloader.check()
+
+    snapshot = reloader.snapshot()
+    assert snapshot.version == 2
+    assert names(snapshot) == ["DMT", "LSD", "MDMA"]
+    assert reloads == [snapshot]
+    # the snapshot taken before is left as it was
+    assert names(first) == ["LSD", "MDMA"]
+    assert first.indexes["search"] is not None
+
+
+def test_swaps_to_the_index_once_both_files_agree(files):
+    files.write_kb(substances("LSD", "MDMA"))
+    files.write_index(substances("LSD", "MDMA"))
+    reloader, _ = reloader_for(files)
+
+    # the pipeline rewrites the knowledge base first, the index a stage later
+    files.write_kb(substances("LSD", "MDMA", "DMT"))
+    reloader.check()
+    assert reloader.check()
+    between = reloader.snapshot()
+    assert names(between) == ["DMT", "LSD", "MDMA"]
+    assert between.indexes["search"] is None
+
+    files.write_index(substances("LSD", "MDMA", "DMT"))
+    reloader.check()
+    assert reloader.check()
+
+    snapshot = reloader.snapshot()
+    assert snapshot.version == 3
+    assert snapshot.indexes["search"].data_key == snapshot.knowledge_base.data_key()
+    assert between.indexes["search"] is None
+
+
+def test_rewrite_with_the_same_content_isnt_a_reload(files):
+    files.write_kb(substances("LSD", "MDMA"))
+    files.write_index(substances("LSD", "MDMA"))
+    reloader, reloads = reloader_for(files)
+
+    files.write_kb(substances("LSD", "MDMA"))
+    reloader.check()
+
+    assert not reloader.check()
+    assert reloader.version == 1
+    assert reloads == []
+
+
+def test_broken_file_keeps_the_old_data(files):
+    files.write_kb(substances("LSD", "MDMA"))
+    files.write_index(substances("LSD", "MDMA"))
+    reloader, reloads = reloader_for(files)
+    first = reloader.snapshot()
+
+    with open(files.kb, "w") as f:
+        f.write("{")
+    files._touch(files.kb)
+    reloader.check()
+
+    assert not reloader.check()
+    assert reloader.snapshot() is first
+    assert reloads == []
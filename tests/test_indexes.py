@@ -0,0 +1,338 @@
+import numpy as np
+import pytest
+
+from actions.fuzzy_index import MAX_QUERY_LENGTH, FuzzyIndex, edit_distance
+from actions.interaction_matrix import InteractionMatrix, build_interaction_matrix
+from actions.knowledge_base import data_key
+from actions.reagent_index import ReagentIndex, build_reagent_index
+from actions.similarity_graph import (
+    SimilarityGraph,
+    build_similarity_graph,
+    cross_tolerances,
+)
+
+
+def substance(substance_id, name, **fields):
+    return {"id": substance_id, "name": name, "aliases": [], **fields}
+
+
+# fuzzy index
+
+
+@pytest.mark.parametrize(
+    "a, b, distance",
+    [
+        ("ketamine", "ketamine", 0),
+        ("ketamine", "ketamnie", 1),
+        ("ketamine", "ketamin", 1),
+        ("ketamine", "kettamine", 1),
+        ("ketamine", "ketamone", 1),
+        ("ketamine", "katamnie", 2),
+        # optimal string alignment: a transposed pair can't be edited again
+        ("ca", "abc", 3),
+    ],
+)
+def test_edit_distance_is_osa(a, b, distance):
+    assert edit_distance(a, b, limit=5) == distance
+    assert edit_distance(b, a, limit=5) == distance
+
+
+def test_edit_distance_gives_up_past_the_limit():
+    assert edit_distance("ketamine", "methadone", limit=2) == 3
+    assert edit_distance("lsd", "lsdlsdlsd", limit=2) == 3
+
+
+@pytest.fixture
+def fuzzy():
+    return FuzzyIndex.build(
+        [
+            substance(0, "Ketamine", aliases=["k", "special k"]),
+            substance(1, "Methadone"),
+            substance(2, "LSD", aliases=["acid"]),
+            substance(3, "MDMA", aliases=["molly", "mandy"]),
+            substance(4, "MDA"),
+        ],
+        max_distance=2,
+    )
+
+
+@pytest.mark.parametrize(
+    "name, found",
+    [
+        ("ketamine", (0, 0)),
+        ("Ketamnie", (0, 1)),
+        ("katamnie", (0, 2)),
+        # 8 characters allow 2 edits, not 3
+        ("katmnei", None),
+        ("special l", (0, 1)),
+        ("metadone", (1, 1)),
+        # names under 4 characters per edit are matched exactly
+        ("lsd", (2, 0)),
+        ("lsb", None),
+        ("acdi", (2, 1)),
+        # as close to both, the same length wins over a dropped letter
+        ("mdma", (3, 0)),
+        ("mdna", (3, 1)),
+        ("", None),
+        ("k" * (MAX_QUERY_LENGTH + 1), None),
+    ],
+)
+def test_lookup_limits_the_distance_by_length(fuzzy, name, found):
+    assert fuzzy.lookup(name) == found
+
+
+def test_lookup_distance_is_capped_by_the_build(fuzzy):
+    assert fuzzy.lookup("katamnie", max_distance=1) is None
+    assert fuzzy.lookup("katamnie", max_distance=5) == (0, 2)
+
+
+def test_fuzzy_index_round_trips_with_its_data_key(fuzzy, tmp_path):
+    path = str(tmp_path / "fuzzy_index.jsonl")
+    fuzzy.save(path)
+
+    loaded = FuzzyIndex.load(path)
+
+    assert loaded.data_key == fuzzy.data_key
+    assert loaded.entries == fuzzy.entries
+    assert loaded.lookup("katamnie") == (0, 2)
+
+
+# interaction matrix
+
+
+def combo(name, status, note=None):
+    interaction = {"name": name, "status": status}
+    if note:
+        interaction["note"] = note
+    return interaction
+
+
+COMBO_SUBSTANCES = [
+    substance(
+        0,
+        "LSD",
+        interactions=[
+            combo("Cannabis", "Caution", "Can be intense"),
+            combo("MDMA", "Low Risk & Synergy"),
+            combo("Tramadol", "Dangerous"),
+        ],
+    ),
+    substance(
+        1,
+        "MDMA",
+        interactions=[combo("LSD", "Low Risk & Synergy"), combo("Tramadol", "Unsafe")],
+    ),
+    substance(
+        2,
+        "Cannabis",
+        interactions=[combo("LSD", "Low Risk & Synergy"), combo("MDMA", "Caution")],
+    ),
+    substance(3, "Tramadol", interactions=[combo("MDMA", "Dangerous")]),
+    substance(4, "1P-LSD", classes={"chemical": ["Lysergamides"]}),
+    substance(5, "Caffeine"),
+]
+
+
+@pytest.fixture
+def interactions():
+    return InteractionMatrix(build_interaction_matrix(COMBO_SUBSTANCES))
+
+
+def test_matrix_is_symmetric(interactions):
+    assert np.array_equal(interactions.matrix, interactions.matrix.T)
+    assert np.array_equal(interactions.note, interactions.note.T)
+    for a in range(4):
+        for b in range(4):
+            assert interactions.lookup(a, b) is None or (
+                interactions.lookup(a, b).severity == interactions.lookup(b, a).severity
+            )
+
+
+def test_disagreeing_factsheets_keep_the_more_severe_status(interactions):
+    lsd_cannabis = interactions.lookup(0, 2)
+    assert lsd_cannabis.status == "Caution"
+    assert lsd_cannabis.note == "Can be intense"
+    assert interactions.lookup(1, 3).status == "Dangerous"
+    assert interactions.asymmetry_report() == [
+        "Cannabis lists LSD as Low Risk & Synergy, LSD lists Cannabis as Caution",
+        "MDMA lists Tramadol as Unsafe, Tramadol lists MDMA as Dangerous",
+    ]
+
+
+def test_pair_listed_on_one_factsheet_only(interactions):
+    assert interactions.lookup(3, 0).status == "Dangerous"
+    assert interactions.lookup(0, 3).status == "Dangerous"
+
+
+def test_substances_are_checked_through_their_group(interactions):
+    assert interactions.group(4) == "LSD"
+    assert interactions.lookup(4, 1).status == "Low Risk & Synergy"
+    assert interactions.group(5) is None
+    assert interactions.lookup(5, 0) is None
+    assert interactions.lookup(99, 0) is None
+
+
+def test_combination_check_is_most_severe_first(interactions):
+    found = interactions.check([0, 1, 2, 3, 5, 99])
+
+    assert [(a, b, i.status) for a, b, i in found] == [
+        (0, 3, "Dangerous"),
+        (1, 3, "Dangerous"),
+        (0, 2, "Caution"),
+        (1, 2, "Caution"),
+        (0, 1, "Low Risk & Synergy"),
+    ]
+
+
+def test_unknown_status_is_refused():
+    with pytest.raises(ValueError, match="unknown combo status"):
+        build_interaction_matrix(
+            [
+                substance(0, "LSD", interactions=[combo("MDMA", "Probably fine")]),
+                substance(1, "MDMA", interactions=[combo("LSD", "Caution")]),
+            ]
+        )
+
+
+# reagent index
+
+
+@pytest.fixture
+def reagents():
+    return ReagentIndex(
+        build_reagent_index(
+            [
+                substance(
+                    0, "MDMA", reagents="Marquis: Purple > Black. | Mecke: Blue."
+                ),
+                substance(
+                    1, "MDA", reagents="Marquis: Purple > Black. | Mecke: Green."
+                ),
+                # never tested on Mecke
+                substance(2, "Methylone", reagents="Marquis: Yellow > Purple."),
+                substance(3, "Cocaine", reagents="Marquis: No colour change."),
+                substance(4, "Ketamine"),
+            ]
+        )
+    )
+
+
+def test_a_full_match_ranks_above_an_unknown_result(reagents):
+    names, matches = reagents.identify("purple on marquis and blue with mecke")
+
+    assert names == {"Marquis": ["purple"], "Mecke": ["blue"]}
+    assert [(m.substance_id, m.matched, m.unknown) for m in matches] == [
+        (0, 2, 0),
+        (2, 1, 1),
+    ]
+
+
+def test_a_known_different_result_rules_a_substance_out(reagents):
+    _, matches = reagents.identify("marquis went black, mecke green")
+
+    assert [m.substance_id for m in matches] == [1]
+
+
+def test_no_known_result_at_all_isnt_a_match(reagents):
+    _, matches = reagents.identify("nothing on marquis")
+
+    assert [m.substance_id for m in matches] == [3]
+    assert reagents.identify("it smelled funny") == ({}, [])
+
+
+def test_results_by_substance(reagents):
+    assert reagents.results(2) == {"Marquis": ["purple", "yellow"]}
+    assert reagents.results(4) == {}
+    assert reagents.results(99) == {}
+
+
+# similarity graph
+
+
+def test_cross_tolerance_names_resolve_to_one_group():
+    assert cross_tolerances(
+        {
+            "crossTolerances": [
+                "serotonin|serotonergic",
+                "Stimulants",
+                "stimulant",
+                "GABAergic",
+            ]
+        }
+    ) == ["serotonin", "stimulant", "gaba"]
+
+
+@pytest.fixture
+def similarity():
+    return SimilarityGraph(
+        build_similarity_graph(
+            [
+                substance(
+                    0,
+                    "MDMA",
+                    classes={"psychoactive": ["Entactogens", "Stimulants"]},
+                    crossTolerances=["serotonergic", "stimulant"],
+                ),
+                substance(1, "Amphetamine", classes={"psychoactive": ["Stimulants"]}),
+                substance(
+                    2,
+                    "LSD",
+                    classes={"psychoactive": ["Psychedelics"]},
+                    crossTolerances=["psychedelics"],
+                ),
+                substance(3, "Psilocin", classes={"psychoactive": ["Psychedelics"]}),
+                substance(
+                    4,
+                    "Sertraline",
+                    classes={"psychoactive": ["Antidepressant"]},
+                    crossTolerances=["serotonin"],
+                ),
+                substance(5, "Water"),
+            ],
+            k=3,
+        )
+    )
+
+
+def test_cross_tolerance_through_class_or_listing(similarity):
+    # amphetamine is in the stimulants class MDMA lists
+    assert similarity.cross_tolerance(0, 1) == ["stimulant"]
+    assert similarity.cross_tolerance(1, 0) == ["stimulant"]
+    # sertraline isn't in a serotonin class, it lists serotonin like MDMA does
+    assert similarity.cross_tolerance(0, 4) == ["serotonin"]
+    assert similarity.cross_tolerance(2, 3) == ["psychedelic"]
+    assert similarity.cross_tolerance(0, 2) == []
+    assert similarity.cross_tolerance(0, 99) == []
+
+
+def test_similar_substances_share_classes_or_tolerances(similarity):
+    assert [n.substance_id for n in similarity.similar(2)] == [3]
+    assert [n.substance_id for n in similarity.similar(0)][:2] in ([1, 4], [4, 1])
+    assert similarity.similar(5) == []
+    assert similarity.similar(99) == []
+
+
+def test_high_ids_in_broad_classes_are_ranked_fairly():
+    # three classes of over 200 substances each, only substance 0 and the last one share all three
+    x = {0, 399} | set(range(1, 251))
+    y = {0, 399} | set(range(150, 399))
+    z = {0, 399} | set(range(400, 651))
+    substances = [
+        substance(
+            i,
+            f"substance {i}",
+            classes={
+                "psychoactive": [
+                    c for c, members in [("X", x), ("Y", y), ("Z", z)] if i in members
+                ]
+            },
+        )
+        for i in range(651)
+    ]
+
+    graph = build_similarity_graph(substances, k=5)
+
+    similar = SimilarityGraph(graph).similar(0)
+    assert similar[0].substance_id == 399
+    assert similar[0].score > similar[1].score
+    assert str(graph["data_key"]) == data_key(substances)
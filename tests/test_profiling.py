@@ -0,0 +1,110 @@
+import tracemalloc
+
+import pytest
+
+from components.profiling import PipelineProfiler
+
+
+class Tokenizer:
+    def process(self, message, **kwargs):
+        message["tokens"] = message["text"].split()
+
+
+class Classifier:
+    def process(self, message, **kwargs):
+        message["intent"] = "what_is_substance"
+
+
+class Failing:
+    def process(self, message, **kwargs):
+        raise RuntimeError("component failed")
+
+
+class Interpreter:
+    """runs its pipeline like rasa's, featurize_message skips the classifiers"""
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+
+    def parse(self, text):
+        message = {"text": text}
+        for component in self.pipeline:
+            component.process(message)
+        return message
+
+    def featurize_message(self, message):
+        for component in self.pipeline:
+            if not isinstance(component, Classifier):
+                component.process(message)
+        return message
+
+
+def profiled(pipeline, sample_rate=1.0):
+    interpreter = Interpreter(pipeline)
+    profiler = PipelineProfiler(sample_rate=sample_rate, random_source=lambda: 0.5)
+    profiler.instrument(interpreter.pipeline)
+    interpreter.parse = profiler.profile_calls(interpreter.parse)
+    return interpreter, profiler
+
+
+@pytest.fixture(autouse=True)
+def not_tracing():
+    assert not tracemalloc.is_tracing()
+    yield
+    tracemalloc.stop()
+
+
+def test_sampled_message_stops_tracing_when_parse_returns():
+    interpreter, profiler = profiled([Tokenizer(), Classifier()])
+
+    assert interpreter.parse("what is molly")["intent"] == "what_is_substance"
+
+    assert not tracemalloc.is_tracing()
+    assert (profiler.messages, profiler.sampled) == (1, 1)
+    assert [h.count for h in profiler.timings.values()] == [1, 1]
+    assert [h.count for h in profiler.allocations.values()] == [1, 1]
+
+
+def test_featurized_message_isnt_counted_or_sampled():
+    interpreter, profiler = profiled([Tokenizer(), Classifier()])
+
+    message = interpreter.featurize_message({"text": "what is molly"})
+
+    assert message["tokens"] == ["what", "is", "molly"]
+    assert not tracemalloc.is_tracing()
+    assert (profiler.messages, profiler.sampled) == (0, 0)
+    # the next parse is sampled whole, not mixed up with the featurized message
+    interpreter.parse("what is molly")
+    assert (profiler.messages, profiler.sampled) == (1, 1)
+    assert [h.count for h in profiler.timings.values()] == [1, 1]
+
+
+def test_unsampled_message_doesnt_trace():
+    interpreter, profiler = profiled([Tokenizer(), Classifier()], sample_rate=0.1)
+
+    interpreter.parse("what is molly")
+
+    assert not tracemalloc.is_tracing()
+    assert (profiler.messages, profiler.sampled) == (1, 0)
+
+
+def test_failing_component_drops_the_sample_and_stops_tracing():
+    interpreter, profiler = profiled([Tokenizer(), Failing(), Classifier()])
+
+    with pytest.raises(RuntimeError):
+        interpreter.parse("what is molly")
+
+    assert not tracemalloc.is_tracing()
+    assert (profiler.messages, profiler.sampled) == (1, 0)
+    assert profiler.timings["0_Tokenizer"].count == 0
+
+
+def test_tracing_someone_else_started_is_left_on():
+    interpreter, profiler = profiled([Tokenizer(), Classifier()])
+    tracemalloc.start()
+
+    interpreter.parse("what is molly")
+
+    assert tracemalloc.is_tracing()
+    assert profiler.sampled == 1
+    assert profiler.allocations["0_Tokenizer"].count == 0
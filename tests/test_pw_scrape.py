@@ -0,0 +1,200 @@
+import copy
+import json
+import os
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from pwScrape import PwScrapeError, PwScraper
+from stubPwApi import StubPage, api_substance, make_handler, substance_page
+
+cached_substances = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "..",
+    "ts_pn_data",
+    "_cached_pw_substances.json",
+)
+
+
+class StubPwApi:
+    """the stub api and wiki pages served from a thread, for one test"""
+
+    def __init__(self, count=23, fail_offsets=()):
+        with open(cached_substances) as f:
+            self.substances = list(map(api_substance, json.load(f)[:count]))
+        self.fail_offsets = set(fail_offsets)
+        self.pages = {}
+        self.log = []
+        self.server = ThreadingHTTPServer(
+            ("localhost", 0),
+            make_handler(self.substances, self.fail_offsets, self.pages, self.log),
+        )
+        self.url = f"http://localhost:{self.server.server_address[1]}"
+        for number, substance in enumerate(self.substances):
+            path = f"/wiki/substance_{number}"
+            self.pages[path] = StubPage(
+                substance_page(substance["name"], [f"alias {number}"])
+            )
+            substance["url"] = self.url + path
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def requests(self, method):
+        return [(target, headers) for m, target, headers in self.log if m == method]
+
+    def page_path(self, number):
+        return f"/wiki/substance_{number}"
+
+
+@pytest.fixture
+def stub():
+    api = StubPwApi()
+    api.thread.start()
+    yield api
+    api.server.shutdown()
+    api.server.server_close()
+
+
+def scraper(stub, tmp_path, **kwargs):
+    options = dict(
+        workers=4,
+        rate_limit=0,
+        retries=0,
+        page_size=5,
+        api_url=stub.url,
+        cache_dir=str(tmp_path / "cache"),
+    )
+    options.update(kwargs)
+    return PwScraper(**options)
+
+
+def scrape_one(stub, tmp_path, number=0, **kwargs):
+    return scraper(stub, tmp_path, **kwargs).scrape_substance(
+        copy.deepcopy(stub.substances[number])
+    )
+
+
+def test_listing_pages_until_a_short_page(stub, tmp_path):
+    substances = scraper(stub, tmp_path).list_substances()
+
+    assert [s["name"] for s in substances] == [s["name"] for s in stub.substances]
+    # 23 substances in pages of 5, the fifth page is short and ends the listing
+    assert [target for target, _ in stub.requests("POST")] == [
+        (0, 5),
+        (5, 5),
+        (10, 5),
+        (15, 5),
+        (20, 5),
+    ]
+
+
+def test_listing_ends_on_an_empty_page(stub, tmp_path):
+    del stub.substances[20:]
+
+    substances = scraper(stub, tmp_path).list_substances()
+
+    assert len(substances) == 20
+    assert [target for target, _ in stub.requests("POST")][-1] == (20, 5)
+
+
+def test_null_page_is_bisected_down_to_the_broken_substance(stub, tmp_path):
+    stub.fail_offsets.update({7, 12})
+
+    substances = scraper(stub, tmp_path).list_substances()
+
+    expected = [s["name"] for i, s in enumerate(stub.substances) if i not in (7, 12)]
+    assert [s["name"] for s in substances] == expected
+    requested = [target for target, _ in stub.requests("POST")]
+    # the pages holding a broken substance are split in halves until it's alone
+    assert requested[:6] == [(0, 5), (5, 5), (5, 2), (7, 3), (7, 1), (8, 2)]
+    assert (7, 1) in requested and (12, 1) in requested
+    # pages without a broken substance are fetched whole
+    assert (15, 5) in requested and (20, 5) in requested
+
+
+def test_scrape_fetches_every_page_in_listing_order(stub, tmp_path):
+    records = scraper(stub, tmp_path).scrape()
+
+    assert [r["name"] for r in records] == [s["name"] for s in stub.substances]
+    assert records[3]["aliases"] == ["alias 3"]
+    assert records[3]["data"]["class"] == stub.substances[3]["class"]
+    assert len(stub.requests("GET")) == len(stub.substances)
+
+
+def test_fresh_cache_is_used_without_a_request(stub, tmp_path):
+    record, status = scrape_one(stub, tmp_path)
+    assert status == "Done with"
+    assert record["name"] == stub.substances[0]["name"]
+
+    again, status = scrape_one(stub, tmp_path)
+
+    assert status == "Cached"
+    assert again == record
+    assert len(stub.requests("GET")) == 1
+
+
+def test_stale_cache_is_revalidated_with_the_etag(stub, tmp_path):
+    record, _ = scrape_one(stub, tmp_path)
+
+    again, status = scrape_one(stub, tmp_path, max_age=0)
+
+    assert status == "Unchanged"
+    assert again == record
+    _, headers = stub.requests("GET")[-1]
+    assert headers["If-None-Match"] == stub.pages[stub.page_path(0)].etag
+
+
+def test_stale_cache_is_revalidated_with_last_modified(stub, tmp_path):
+    stub.pages[stub.page_path(0)].with_etag = False
+    record, _ = scrape_one(stub, tmp_path)
+
+    again, status = scrape_one(stub, tmp_path, max_age=0)
+
+    assert status == "Unchanged"
+    assert again == record
+    _, headers = stub.requests("GET")[-1]
+    assert "If-None-Match" not in headers
+    assert (
+        headers["If-Modified-Since"] == stub.pages[stub.page_path(0)].last_modified
+    )
+
+
+def test_changed_page_is_fetched_and_parsed_again(stub, tmp_path):
+    scrape_one(stub, tmp_path)
+    page = stub.pages[stub.page_path(0)]
+    first_etag = page.etag
+    page.bump(substance_page(stub.substances[0]["name"], ["new alias"]))
+
+    record, status = scrape_one(stub, tmp_path, max_age=0)
+
+    assert status == "Done with"
+    assert record["aliases"] == ["new alias"]
+    _, headers = stub.requests("GET")[-1]
+    assert headers["If-None-Match"] == first_etag
+    # the new validators are kept, so the next revalidation is a 304 again
+    _, status = scrape_one(stub, tmp_path, max_age=0)
+    assert status == "Unchanged"
+
+
+def test_unreachable_page_falls_back_to_its_cached_copy(stub, tmp_path):
+    scraper(stub, tmp_path).scrape()
+    del stub.pages[stub.page_path(3)]
+
+    records = scraper(stub, tmp_path, max_age=0, max_stale=1).scrape()
+
+    assert [r["name"] for r in records] == [s["name"] for s in stub.substances]
+    assert records[3]["aliases"] == ["alias 3"]
+
+
+def test_too_many_stale_pages_fail_the_scrape(stub, tmp_path, capsys):
+    scraper(stub, tmp_path).scrape()
+    for number in (3, 8):
+        del stub.pages[stub.page_path(number)]
+
+    with pytest.raises(PwScrapeError) as error:
+        scraper(stub, tmp_path, max_age=0, max_stale=1).scrape()
+
+    stale = [stub.substances[3]["name"], stub.substances[8]["name"]]
+    assert error.value.failed == []
+    assert error.value.stale == stale
+    assert "2 substance(s) served from a stale cached page" in capsys.readouterr().out
@@ -0,0 +1,59 @@
+from reduceData import reduce_data, template
+
+
+def write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+
+
+def examples(path):
+    return [
+        line.strip()[2:]
+        for line in path.read_text().splitlines()
+        if line.startswith("    - ")
+    ]
+
+
+def test_template_keeps_case_and_masks_entities():
+    assert template("what is  [MDMA](substance)?") == "what is [substance]?"
+    assert template('What is [lsd]{"entity": "substance"}') == "What is [substance]"
+
+
+def test_examples_are_grouped_across_files(tmp_path):
+    data = tmp_path / "data"
+    write(
+        data / "nlu.yml",
+        "nlu:\n- intent: what_is_substance\n  examples: |\n"
+        + "".join(f"    - what is [{n}](substance)\n" for n in ["lsd", "mdma", "dmt"]),
+    )
+    write(
+        data / "more" / "nlu.yml",
+        "nlu:\n- intent: what_is_substance\n  examples: |\n"
+        + "".join(f"    - what is [{n}](substance)\n" for n in ["2c-b", "ketamine"])
+        + "    - What is [LSD](substance)\n",
+    )
+    write(data / "lookups" / "substance.txt", "lsd\nmdma\n")
+
+    stats = reduce_data(str(data), str(tmp_path / "out"), per_template=2, seed=0)
+
+    out = tmp_path / "out"
+    kept = examples(out / "nlu.yml") + examples(out / "more" / "nlu.yml")
+    # two of the five lowercase ones from both files, the capitalized one on its own
+    assert len(kept) == 3
+    assert "What is [LSD](substance)" in kept
+    assert stats == {"what_is_substance": {"before": 6, "after": 3, "templates": 2}}
+    assert (out / "lookups" / "substance.txt").read_text() == "lsd\nmdma\n"
+
+
+def test_same_seed_keeps_the_same_examples(tmp_path):
+    data = tmp_path / "data"
+    write(
+        data / "nlu.yml",
+        "nlu:\n- intent: what_is_substance\n  examples: |\n"
+        + "".join(f"    - what is [drug{n}](substance)\n" for n in range(20)),
+    )
+
+    reduce_data(str(data), str(tmp_path / "a"), per_template=3, seed=1)
+    reduce_data(str(data), str(tmp_path / "b"), per_template=3, seed=1)
+
+    assert examples(tmp_path / "a" / "nlu.yml") == examples(tmp_path / "b" / "nlu.yml")
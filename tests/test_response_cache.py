@@ -0,0 +1,106 @@
+import logging
+
+from actions.response_cache import ResponseCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_least_recently_used_is_evicted_first():
+    cache = ResponseCache(max_size=2, ttl=0, clock=Clock())
+    cache.put("lsd", "about lsd")
+    cache.put("mdma", "about mdma")
+    assert cache.get("lsd") == "about lsd"
+
+    cache.put("dmt", "about dmt")
+
+    assert cache.get("mdma") is None
+    assert cache.get("lsd") == "about lsd"
+    assert cache.get("dmt") == "about dmt"
+    assert len(cache) == 2
+    assert cache.stats()["evictions"] == 1
+
+
+def test_entries_expire_after_the_ttl():
+    clock = Clock()
+    cache = ResponseCache(max_size=10, ttl=60, clock=clock)
+    cache.put("lsd", "about lsd")
+    clock.now += 60
+    assert cache.get("lsd") == "about lsd"
+
+    clock.now += 1
+
+    assert cache.get("lsd", "missing") == "missing"
+    assert len(cache) == 0
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["expirations"]) == (1, 1, 1)
+
+
+def test_ttl_zero_keeps_entries():
+    clock = Clock()
+    cache = ResponseCache(max_size=10, ttl=0, clock=clock)
+    cache.put("lsd", "about lsd")
+    clock.now += 10**9
+
+    assert cache.get("lsd") == "about lsd"
+
+
+def test_size_zero_turns_caching_off():
+    cache = ResponseCache(max_size=0, clock=Clock())
+    computed = []
+
+    for _ in range(3):
+        value = cache.get_or_compute("lsd", lambda: computed.append(1) or "about lsd")
+
+    assert value == "about lsd"
+    assert len(computed) == 3
+    assert len(cache) == 0
+    assert cache.stats()["misses"] == 3
+
+
+def test_get_or_compute_counts_hits_and_misses():
+    cache = ResponseCache(max_size=10, clock=Clock())
+    computed = []
+
+    for key in ["lsd", "mdma", "lsd", "lsd"]:
+        cache.get_or_compute(key, lambda: computed.append(key) or f"about {key}")
+
+    assert computed == ["lsd", "mdma"]
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (2, 2, 2)
+    assert stats["hit_rate"] == 0.5
+
+
+def test_clear_drops_entries_and_keeps_counters():
+    cache = ResponseCache(max_size=10, clock=Clock())
+    cache.put("lsd", "about lsd")
+    cache.get("lsd")
+
+    cache.clear()
+
+    assert cache.get("lsd") is None
+    stats = cache.stats()
+    assert (stats["size"], stats["hits"], stats["clears"]) == (0, 1, 1)
+
+
+def test_stats_are_logged_every_log_interval(caplog):
+    clock = Clock()
+    cache = ResponseCache(max_size=10, log_interval=300, clock=clock)
+    caplog.set_level(logging.INFO, logger="actions.response_cache")
+
+    cache.get("lsd")
+    clock.now += 299
+    cache.get("lsd")
+    assert not caplog.records
+
+    clock.now += 1
+    cache.get("lsd")
+    cache.get("lsd")
+
+    assert len(caplog.records) == 1
+    assert "'misses': 3" in caplog.records[0].getMessage()
@@ -0,0 +1,146 @@
+# writes the merged substance data out as the knowledge base json, the NLU lookup/synonym
+# tables and the generated what_is_substance intents
+#
+# the writers take any iterable of substances and go over it once, writing as they go, so with
+# read_records the merged data is never all in memory at once (the lookup and intent writers only
+# keep the names)
+
+from actions.knowledge_base import normalize_name, split_alias, substance_names
+from intentGen import intentGen
+from trieRegex import trie_regex
+import json
+import os
+
+# with use_word_boundaries off the RegexFeaturizer matches lookup entries inside words, so short
+# aliases like "e", "k" or "dm" would flag half the tokens of every message as a substance. names
+# this short are still synonyms, so the model can learn them from examples
+lookup_min_length = 3
+
+
+def read_records(path, chunk_size=1 << 16):
+    """yields the items of a json array file one by one, reading it a chunk at a time"""
+    decoder = json.JSONDecoder()
+    with open(path, encoding="utf-8") as f:
+        buffer = ""
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in "[, \t\r\n":
+                pos += 1
+            if buffer[pos : pos + 1] == "]":
+                return
+            try:
+                record, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # the next record doesn't fit in what's been read so far
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    raise ValueError(f"{path} isn't a complete json array")
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+            yield record
+
+
+def kb_chunks(substance_data):
+    """the knowledge base json exactly as json.dump(..., indent=2) writes it, a substance at a time"""
+    yield '{\n  "substances": ['
+    separator = "\n    "
+    for drug in substance_data:
+        # strings can't contain a raw newline in json, so every one is a line break to indent
+        drug_json = json.dumps(drug, ensure_ascii=False, indent=2)
+        yield separator + drug_json.replace("\n", "\n    ")
+        separator = ",\n    "
+    yield "]\n}" if separator == "\n    " else "\n  ]\n}"
+
+
+def write_kb(substance_data, path):
+    # written to a temp file and moved into place so the action server never reloads half a file
+    with open(path + ".tmp", "w") as f:
+        f.writelines(kb_chunks(substance_data))
+    os.replace(path + ".tmp", path)
+
+
+def substance_alias_map(substance_data):
+    """substance name -> list of its (split) aliases"""
+    return {
+        drug["name"]: [a for y in drug["aliases"] for a in split_alias(y)]
+        for drug in substance_data
+    }
+
+
+def lookup_names(substance_data):
+    """substance name -> the names that resolve to it, deduplicated case-insensitively
+
+    canonical names are claimed first, so an alias that is also another substance's name (or an
+    earlier substance's alias) is left out instead of becoming a conflicting synonym
+    """
+    # one pass over the substances, keeping only their names
+    drug_names = [
+        (drug["name"], list(substance_names(drug))) for drug in substance_data
+    ]
+    claimed = set()
+    names = {name: [] for name, _ in drug_names}
+
+    def claim(drug_name, name):
+        key = normalize_name(name)
+        if key and key not in claimed:
+            claimed.add(key)
+            names[drug_name].append(name)
+
+    for drug_name, _ in drug_names:
+        claim(drug_name, drug_name)
+    for drug_name, aliases in drug_names:
+        for name in aliases:
+            claim(drug_name, name)
+    return names
+
+
+def write_lookups(substance_data, path, as_regex=False, min_length=lookup_min_length):
+    """lookup table and synonyms for the substance entity, returns the names left out of the lookup
+
+    as_regex writes the lookup as one prefix-factored regex instead of a list of names, it matches
+    the same strings but is much cheaper for the RegexFeaturizer to run. names shorter than
+    min_length (once normalized) are left out of the lookup
+    """
+    names = lookup_names(substance_data)
+    lookup, too_short = [], []
+    for drug_names in names.values():
+        for name in drug_names:
+            if len(normalize_name(name)) >= min_length:
+                lookup.append(name)
+            else:
+                too_short.append(name)
+
+    with open(path, "w") as fp:
+        fp.write("""version: "2.0"\nnlu:\n""")
+        if as_regex:
+            # lowercased, the featurizer is configured with case_sensitive: false
+            pattern = trie_regex(sorted({normalize_name(name) for name in lookup}))
+            fp.write(f"- regex: substance\n  examples: |\n    - {pattern}\n")
+        else:
+            fp.write("- lookup: substance\n  examples: |\n")
+            for name in lookup:
+                fp.write(f"    - {name}\n")
+        fp.write("\n")
+        # Synonyms to map aliases to one entity
+        for name, drug_names in names.items():
+            # the canonical name isn't always first, it can lose its claim to a substance whose
+            # name only differs in case or spacing
+            aliases = [
+                n for n in drug_names if normalize_name(n) != normalize_name(name)
+            ]
+            # Skip adding synonym if there are no aliases
+            if not aliases:
+                continue
+            fp.write(f"- synonym: {name}\n  examples: |\n")
+            for alias in aliases:
+                fp.write(f"    - {alias}\n")
+    return too_short
+
+
+def write_intents(
+    substance_data, path, seed=None, per_substance=None, max_examples=None
+):
+    generator = intentGen(substance_alias_map(substance_data), seed=seed)
+    with open(path, "w") as fp:
+        fp.writelines(generator.what_is_lines(per_substance, max_examples))
@@ -24,604 +24,457 @@ SOFTWARE."""
 
 # downloads and exports data on all substances from psychonautwiki and tripsit factsheets, combining to form master list with standardized format
 # prioritizes psychonautwiki ROA info (dose/duration) over tripsit factsheets
-# pip3 install beautifulsoup4 requests python-graphql-client
+# pip3 install beautifulsoup4 lxml requests python-graphql-client
 
-import requests
-from bs4 import BeautifulSoup
-from python_graphql_client import GraphqlClient
+import argparse
 import json
 import os
-import re
-import traceback
-from intentGen import intentGen
-
-headers = {
-    "Access-Control-Allow-Origin": "*",
-    "Access-Control-Allow-Methods": "GET",
-    "Access-Control-Allow-Headers": "Content-Type",
-    "Access-Control-Max-Age": "3600",
-    "User-Agent": "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:52.0) Gecko/20100101 Firefox/52.0",
-}
+import sys
+
+# index formats and name handling shared with the action server live in the actions package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests  # noqa: E402
+from actions.dose_index import build_dose_index, save_dose_index  # noqa: E402
+from actions.fuzzy_index import FuzzyIndex  # noqa: E402
+from actions.interaction_matrix import (  # noqa: E402
+    InteractionMatrix,
+    build_interaction_matrix,
+    save_interaction_matrix,
+)
+from actions.packed_kb import write_packed_kb  # noqa: E402
+from actions.reagent_index import (  # noqa: E402
+    build_reagent_index,
+    parse_reagents,
+    save_reagent_index,
+)
+from actions.search_index import (  # noqa: E402
+    SearchIndex,
+    build_search_index,
+    save_search_index,
+)
+from actions.similarity_graph import (  # noqa: E402
+    SimilarityGraph,
+    build_similarity_graph,
+    save_similarity_graph,
+)
+from exportData import (  # noqa: E402
+    lookup_min_length,
+    read_records,
+    write_intents,
+    write_kb,
+    write_lookups,
+)
+from mergeData import merge_substances  # noqa: E402
+from pipeline import Pipeline, Stage  # noqa: E402
+from pwScrape import PwScrapeError, PwScraper, ps_api_url  # noqa: E402
 
 ts_api_url = "https://tripbot.tripsit.me/api/tripsit/getAllDrugs"
-ps_api_url = "https://api.psychonautwiki.org"
-ps_client = GraphqlClient(endpoint=ps_api_url, headers=headers)
+
+# artifacts, paths are relative to the repo root which is where this should be run from
+ts_cache_path = "ts_pn_data/_cached_ts_substances.json"
+pw_cache_path = "ts_pn_data/_cached_pw_substances.json"
+merged_path = "ts_pn_data/_merged_substances.json"
+kb_path = "ts_pn_data/substances_data.json"
+packed_kb_path = "ts_pn_data/substances_data.kb"
+lookups_path = "data/lookups/substances.yml"
+intents_path = "ts_pn_data/generated_intents.yml"
+doses_path = "ts_pn_data/dose_index.npz"
+fuzzy_path = "ts_pn_data/fuzzy_index.jsonl"
+interactions_path = "ts_pn_data/interaction_matrix.npz"
+search_path = "ts_pn_data/search_index.npz"
+reagents_path = "ts_pn_data/reagent_index.npz"
+similarity_path = "ts_pn_data/similarity_graph.npz"
+state_path = "ts_pn_data/_pipeline_state.json"
+
+parser = argparse.ArgumentParser(
+    description="download and merge psychonautwiki and tripsit substance data, then export it for the bot"
+)
+parser.add_argument(
+    "stages",
+    nargs="*",
+    help="stages to bring up to date along with what they depend on (default: all)",
+)
+parser.add_argument(
+    "--force",
+    action="store_true",
+    help="rerun the named stages (or every stage) even if they are up to date",
+)
+parser.add_argument(
+    "--list",
+    action="store_true",
+    help="list the stages and whether they are up to date",
+)
+parser.add_argument(
+    "--refresh",
+    action="store_true",
+    help="download tripsit and revalidate psychonautwiki even if cached copies exist",
+)
+parser.add_argument(
+    "--workers",
+    type=int,
+    default=8,
+    help="number of psychonautwiki pages scraped concurrently (1 scrapes serially)",
+)
+parser.add_argument(
+    "--rate-limit",
+    type=float,
+    default=5.0,
+    help="max requests per second sent to any single host (0 disables limiting)",
+)
+parser.add_argument(
+    "--retries",
+    type=int,
+    default=3,
+    help="times a failed request is retried, with exponential backoff",
+)
+parser.add_argument(
+    "--max-age",
+    type=float,
+    default=12,
+    help="hours a cached page is trusted without revalidating it (lets an interrupted scrape resume)",
+)
+parser.add_argument(
+    "--max-stale",
+    type=int,
+    default=10,
+    help="pages that may fall back to a stale cached copy when they can't be fetched before "
+    "fetch-pw fails",
+)
+parser.add_argument(
+    "--page-size",
+    type=int,
+    default=100,
+    help="substances fetched per psychonautwiki graphql query",
+)
+parser.add_argument(
+    "--pw-api-url",
+    default=ps_api_url,
+    help="psychonautwiki graphql endpoint (point at stubPwApi.py to work offline)",
+)
+parser.add_argument(
+    "--lookup-regex",
+    action="store_true",
+    help="write the substance lookup table as one prefix-factored regex (faster to featurize)",
+)
+parser.add_argument(
+    "--lookup-min-length",
+    type=int,
+    default=lookup_min_length,
+    help="names shorter than this are left out of the substance lookup table (they match inside "
+    "words), they're still synonyms",
+)
+parser.add_argument(
+    "--intent-seed",
+    type=int,
+    default=0,
+    help="seed for picking the generated intent examples, the same seed and data always write the same file",
+)
+parser.add_argument(
+    "--intent-examples",
+    type=int,
+    help="generated examples per substance (default: one per name, sometimes two)",
+)
+parser.add_argument(
+    "--intent-budget",
+    type=int,
+    help="cap on generated examples overall, shared out by how many names each substance has",
+)
+parser.add_argument(
+    "--similar",
+    type=int,
+    default=10,
+    help="most similar substances kept per substance in the similarity graph",
+)
+parser.add_argument(
+    "--fuzzy-distance",
+    type=int,
+    default=2,
+    help="max edits a misspelled substance name can be from a known name and still be matched",
+)
 
 
-def substance_name_match(name, substance):
-    """check if name matches any value in keys we care about"""
-    lower_name = name.lower()
-    return any(
-        [
-            lower_name == substance[key].lower()
-            for key in ["name", "pretty_name"]
-            if key in substance
-        ]
-        + [lower_name == alias.lower() for alias in substance.get("aliases", [])]
+def read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_json(path, data, indent=2):
+    with open(path, "w") as f:
+        json.dump(data, f, indent=indent, ensure_ascii=False)
+
+
+# stages
+
+
+def fetch_ts():
+    ts_response = requests.get(ts_api_url)
+    ts_data = ts_response.json()["data"][0]
+    write_json(ts_cache_path, list(ts_data.values()))
+
+
+def fetch_pw(args):
+    scraper = PwScraper(
+        workers=args.workers,
+        rate_limit=args.rate_limit,
+        retries=args.retries,
+        max_age=args.max_age,
+        max_stale=args.max_stale,
+        page_size=args.page_size,
+        api_url=args.pw_api_url,
     )
+    write_json(pw_cache_path, scraper.scrape())
 
 
-def find_substance_in_data(data, name):
-    return next((s for s in data if substance_name_match(name, s)), None)
-
-
-roa_name_aliases = {
-    "iv": ["intravenous"],
-    "intravenous": ["iv"],
-    "im": ["intramuscular"],
-    "intramuscular": ["im"],
-    "insufflated": ["snorted"],
-    "snorted": ["insufflated"],
-    "vaporized": ["vapourized"],
-    "vapourized": ["vaporized"],
-}
-
-
-def roa_matches_name(roa, name):
-    aliases = roa_name_aliases.get(name.lower(), [])
-    return roa["name"].lower() == name.lower() or roa["name"].lower() in aliases
-
-
-# get tripsit data
-
-
-ts_dose_order = ["Threshold", "Light", "Common", "Strong", "Heavy"]
-ts_combo_ignore = ["benzos"]  # duplicate
-# prettify names in interaction list
-ts_combo_transformations = {
-    "lsd": "LSD",
-    "mushrooms": "Mushrooms",
-    "dmt": "DMT",
-    "mescaline": "Mescaline",
-    "dox": "DOx",
-    "nbomes": "NBOMes",
-    "2c-x": "2C-x",
-    "2c-t-x": "2C-T-x",
-    "amt": "aMT",
-    "5-meo-xxt": "5-MeO-xxT",
-    "cannabis": "Cannabis",
-    "ketamine": "Ketamine",
-    "mxe": "MXE",
-    "dxm": "DXM",
-    "pcp": "PCP",
-    "nitrous": "Nitrous",
-    "amphetamines": "Amphetamines",
-    "mdma": "MDMA",
-    "cocaine": "Cocaine",
-    "caffeine": "Caffeine",
-    "alcohol": "Alcohol",
-    "ghb/gbl": "GHB/GBL",
-    "opioids": "Opioids",
-    "tramadol": "Tramadol",
-    "benzodiazepines": "Benzodiazepines",
-    "maois": "MAOIs",
-    "ssris": "SSRIs",
-}
-
-ts_response = requests.get(ts_api_url)
-ts_data = ts_response.json()["data"][0]
-
-ts_substances_data = list(ts_data.values())
-
-
-# TS has durations split over a few keys, so this finds or creates the duration for the associated ROA
-# and adds a new line item
-def ts_add_formatted_duration(ts_roas, formatted_duration, duration_name):
-    units = formatted_duration.get("_unit", "") or ""
-    if "_unit" in formatted_duration:
-        formatted_duration.pop("_unit")
-
-    def add_to_roa(roa, value):
-        if "duration" not in roa:
-            roa["duration"] = []
-
-        roa["duration"].append({"name": duration_name, "value": value})
-
-    for roa_name, value in formatted_duration.items():
-        value_string = f"{value} {units}".strip()
-
-        # if value present (i.e. just one value for all ROA doses provided above), apply to all ROAs
-        if roa_name == "value":
-            # if TS did not add any doses, do nothing with this value
-            # we could theoretically apply this to all PW doses with missing durations, but we can't be sure
-            # if it applies to all ROAs, so just ignore
-            if not len(ts_roas):
-                break
-
-            for ts_roa in ts_roas:
-                add_to_roa(ts_roa, value_string)
-
-        # add to matching ROA or create new ROA if doesn't exist
-        else:
-            ts_roa = next(
-                (ts_roa for ts_roa in ts_roas if roa_matches_name(ts_roa, roa_name)),
-                None,
-            )
-            # if ROA doesn't exist, make new
-            if not ts_roa:
-                ts_roa = {"name": roa_name}
-                ts_roas.append(ts_roa)
-
-            add_to_roa(ts_roa, value_string)
-
-
-# get psychonautwiki data
-
-
-def pw_clean_common_name(name):
-    name = re.sub(r'^"', "", name)
-    name = re.sub(r'"$', "", name)
-    name = re.sub(r'"?\[\d*\]$', "", name)
-    name = re.sub(r"\s*More names\.$", "", name)
-    name = re.sub(r"\.$", "", name)
-    return name.strip()
-
-
-def pw_should_skip(name, soup):
-    return (
-        name.startswith("Experience:") or len(soup.find_all(text="Common names")) == 0
+def merge():
+    substance_data = merge_substances(
+        read_json(pw_cache_path), read_json(ts_cache_path)
     )
+    write_json(merged_path, substance_data, indent=None)
 
 
-pw_substance_data = []
+def export_kb():
+    write_kb(read_records(merged_path), kb_path)
 
-if os.path.exists("ts_pn_data/_cached_pw_substances.json"):
-    with open("ts_pn_data/_cached_pw_substances.json") as f:
-        pw_substance_data = json.load(f)
 
-if not len(pw_substance_data):
-    offset = 0
-    pw_substance_urls_query = (
-        f"{{substances(limit: 250 offset: {offset}) {{name url}}}}"
-    )
+def export_packed_kb():
+    write_packed_kb(read_json(kb_path)["substances"], packed_kb_path)
 
-    pw_substance_urls_data = ps_client.execute(query=pw_substance_urls_query,)["data"][
-        "substances"
-    ]
 
-    offset = 252
-    while offset <= 340:
-        pw_substance_urls_query = (
-            f"{{substances(limit: 1 offset: {offset}) {{name url}}}}"
-        )
-        offset += 1
-        temp_data = ps_client.execute(query=pw_substance_urls_query,)["data"][
-            "substances"
-        ]
-        print(temp_data)
-        if temp_data is None:
-            continue
-        pw_substance_urls_data.extend(temp_data)
-
-    for idx, substance in enumerate(pw_substance_urls_data):
-        try:
-            url = substance["url"]
-            substance_req = requests.get(url, headers)
-            substance_soup = BeautifulSoup(substance_req.content, "html.parser")
-
-            name = substance_soup.find("h1", id="firstHeading").text
-            if pw_should_skip(name, substance_soup):
-                print(f"Skipping {name} ({idx + 1} / {len(pw_substance_urls_data)})")
-                continue
-
-            # get aliases text
-            common_names_str = substance_soup.find_all(text="Common names")
-
-            cleaned_common_names = (
-                set(
-                    map(
-                        pw_clean_common_name,
-                        common_names_str[0]
-                        .parent.find_next_sibling("td")
-                        .text.split(", "),
-                    )
-                )
-                if len(common_names_str) > 0
-                else set()
-            )
-            cleaned_common_names.add(substance["name"])
-            # don't include name in list of other common names
-            common_names = sorted(filter(lambda n: n != name, cleaned_common_names))
-
-            # scrape ROAs from page
-
-            def get_data_starting_at_row(curr_row):
-                rows = []
-                while curr_row.find("th", {"class": "ROARowHeader"}):
-                    row = {}
-                    row["name"] = (
-                        curr_row.find("th", {"class": "ROARowHeader"}).find("a").text
-                    )
-
-                    row_values = curr_row.find("td", {"class": "RowValues"})
-
-                    row_value_text = row_values.find_all(text=True, recursive=False)
-                    if len(row_value_text):
-                        row["value"] = "".join(row_value_text).strip()
-                    else:
-                        row["value"] = None
-
-                    row_note = row_values.find("span")
-                    if row_note:
-                        row["note"] = re.sub(r"\s*\[\d*\]$", "", row_note.text).strip()
-
-                    rows.append(row)
-
-                    curr_row = curr_row.find_next("tr")
-                return rows, curr_row
-
-            roas = []
-
-            dose_charts = substance_soup.find_all("tr", {"class": "dosechart"})
-            for dose_chart in dose_charts:
-                table = dose_chart.parent.parent
-                roa_name = table.find("tr").find("a").text
-                if not roa_name:
-                    continue
-
-                roa = {
-                    "name": roa_name,
-                    "dosage": [],
-                    "duration": [],
-                }
-
-                # dosage
-
-                curr_row = dose_chart.find_next("tr")
-                roa["dosage"], curr_row = get_data_starting_at_row(curr_row)
-
-                # extract bioavailability
-                if len(roa["dosage"]) and roa["dosage"][0]["name"] == "Bioavailability":
-                    bioavailability = roa["dosage"].pop(0)
-                    roa["bioavailability"] = bioavailability["value"]
-
-                # duration
-
-                if curr_row.find("th", {"class": "ROASubHeader"}):
-                    curr_row = curr_row.find_next("tr")
-                    roa["duration"], _ = get_data_starting_at_row(curr_row)
-
-                if not len(roa["dosage"]):
-                    roa["dosage"] = None
-                if not len(roa["duration"]):
-                    roa["duration"] = None
-
-                roas.append(roa)
-
-            # query PS API for more data on substance
-
-            query = (
-                """
-                {
-                    substances(query: "%s") {
-                        name
-                        class {
-                            chemical
-                            psychoactive
-                        }
-                        tolerance {
-                            full
-                            half
-                            zero
-                        }
-                        toxicity
-                        addictionPotential
-                        crossTolerances
-                    }
-                }
-            """
-                % substance["name"]
-            )
-
-            data = ps_client.execute(query=query)["data"]["substances"]
-            if len(data) == 0:
-                continue
-            elif len(data) > 1:
-                # should never happen?
-                print(f"{name} has more than one dataset... investigate why")
-
-            data = data[0]
-            if "name" in data:
-                data.pop("name")
-
-            pw_substance_data.append(
-                {
-                    "url": url,
-                    "name": name,
-                    "aliases": common_names,
-                    "roas": roas,
-                    "data": data,
-                }
-            )
-            print(
-                f"Done with {name} [{len(roas)} ROA(s)] ({idx + 1} / {len(pw_substance_urls_data)})"
-            )
-
-        except KeyboardInterrupt:
-            print("\nScrape canceled")
-            exit(0)
-        except:
-            print(f"{name} failed:")
-            print(traceback.format_exc())
-            exit(1)
-
-    with open(f"ts_pn_data/_cached_pw_substances.json", "w") as f:
-        f.write(json.dumps(pw_substance_data, indent=2, ensure_ascii=False))
-
-# combine tripsit and psychonautwiki data
-
-
-all_substance_names = sorted(
-    set(
-        list(map(lambda s: s.get("name", "").lower(), pw_substance_data))
-        + list(map(lambda s: s.get("name", "").lower(), ts_substances_data))
+def export_lookups(args):
+    too_short = write_lookups(
+        read_records(merged_path),
+        lookups_path,
+        as_regex=args.lookup_regex,
+        min_length=args.lookup_min_length,
     )
-)
-substance_data = []
-x = 0
-
-for name in all_substance_names:
-    # find PW substance
-    pw_substance = find_substance_in_data(pw_substance_data, name)
-    # remove to get rid of duplicates in final output
-    if pw_substance:
-        pw_substance_data.remove(pw_substance)
-    else:
-        pw_substance = {}
-
-    # find TS substance
-    ts_substance = find_substance_in_data(ts_substances_data, name)
-    # remove to get rid of duplicates in final output
-    if ts_substance:
-        ts_substances_data.remove(ts_substance)
-    else:
-        ts_substance = {}
-
-    # if no substance found in either dataset, skip
-    if not pw_substance and not ts_substance:
-        continue
-
-    ts_properties = ts_substance.get("properties", {})
-
-    # url will always exist for psychonautwiki substance, so tripsit substance must exist if url is None
-    url = pw_substance.get("url") or f"https://drugs.tripsit.me/{ts_substance['name']}"
-
-    ts_links = ts_substance.get("links", {})
-    experiences_url = ts_links.get("experiences")
-
-    # pick display name from available substances found from both datasets
-    names = list(
-        filter(
-            lambda n: n is not None and len(n) > 0,
-            [pw_substance.get("name"), ts_substance.get("pretty_name")],
+    if len(too_short):
+        print(
+            f"Left {len(too_short)} name(s) shorter than {args.lookup_min_length} characters out "
+            f"of the lookup table: {', '.join(too_short)}"
         )
+
+
+def export_intents(args):
+    write_intents(
+        read_records(merged_path),
+        intents_path,
+        seed=args.intent_seed,
+        per_substance=args.intent_examples,
+        max_examples=args.intent_budget,
+    )
+
+
+def export_doses():
+    dose_index = build_dose_index(read_json(kb_path)["substances"])
+    save_dose_index(doses_path, dose_index)
+
+    unparsed = sorted(set(dose_index["unparsed"]))
+    print(
+        f"Parsed {len(dose_index['min'])} dose/duration values, "
+        f"{len(dose_index['unparsed'])} weren't numeric ranges: {unparsed}"
+    )
+
+
+def export_fuzzy(args):
+    fuzzy_index = FuzzyIndex.build(
+        read_json(kb_path)["substances"], args.fuzzy_distance
+    )
+    fuzzy_index.save(fuzzy_path)
+    print(
+        f"Indexed {len(fuzzy_index.keys)} names under {len(fuzzy_index.entries)} deletes"
+    )
+
+
+def export_interactions():
+    interaction_matrix = build_interaction_matrix(read_json(kb_path)["substances"])
+    save_interaction_matrix(interactions_path, interaction_matrix)
+
+    matrix = InteractionMatrix(interaction_matrix)
+    mapped = int((matrix.substance_group >= 0).sum())
+    print(
+        f"Mapped {mapped} substances onto {len(matrix.groups)} combo groups, "
+        f"{len(matrix.asymmetries)} pairs disagree between factsheets"
+    )
+    for line in matrix.asymmetry_report():
+        print(f"  {line}")
+
+
+def export_search():
+    search_index = build_search_index(read_json(kb_path)["substances"])
+    save_search_index(search_path, search_index)
+
+    index = SearchIndex(search_index)
+    print(
+        f"Indexed {len(index)} substances under {len(index.rows)} terms, "
+        f"{len(index.documents)} postings"
+    )
+
+
+def export_reagents():
+    substances = read_json(kb_path)["substances"]
+    reagent_index = build_reagent_index(substances)
+    save_reagent_index(reagents_path, reagent_index)
+
+    tested = sum(1 for s in substances if parse_reagents(s.get("reagents")))
+    print(
+        f"Parsed reagent results of {tested} substances, "
+        f"{len(reagent_index['unparsed'])} results weren't understood: "
+        f"{sorted(reagent_index['unparsed'])}"
+    )
+
+
+def export_similarity(args):
+    graph = build_similarity_graph(read_json(kb_path)["substances"], k=args.similar)
+    save_similarity_graph(similarity_path, graph)
+
+    similarity = SimilarityGraph(graph)
+    linked = sum(1 for i in similarity.substance_ids if similarity.similar(int(i), 1))
+    print(
+        f"Linked {linked} substances to up to {args.similar} similar ones, resolved "
+        f"{len(similarity.groups)} cross-tolerance groups to {len(similarity.members)} members"
     )
-    # people use shorter names
-    name = min(names, key=len)
-
-    # lowercase list of all names, excluding chosen name above
-    aliases = set(
-        map(
-            lambda n: n.lower(),
-            filter(
-                lambda n: n is not None and len(n) > 0,
-                [pw_substance.get("name"), ts_substance.get("pretty_name")]
-                + pw_substance.get("aliases", [])
-                + ts_substance.get("aliases", []),
+
+
+def build_pipeline(args):
+    return Pipeline(
+        [
+            Stage("fetch-ts", fetch_ts, outputs=[ts_cache_path], fetch=True),
+            Stage(
+                "fetch-pw",
+                lambda: fetch_pw(args),
+                outputs=[pw_cache_path],
+                fetch=True,
             ),
-        )
+            Stage(
+                "merge",
+                merge,
+                inputs=[pw_cache_path, ts_cache_path],
+                outputs=[merged_path],
+                sources=["ts_pn_data/mergeData.py"],
+            ),
+            Stage(
+                "export-kb",
+                export_kb,
+                inputs=[merged_path],
+                outputs=[kb_path],
+                sources=["ts_pn_data/exportData.py"],
+            ),
+            Stage(
+                "export-packed-kb",
+                export_packed_kb,
+                inputs=[kb_path],
+                outputs=[packed_kb_path],
+                sources=["actions/packed_kb.py", "actions/knowledge_base.py"],
+            ),
+            Stage(
+                "export-lookups",
+                lambda: export_lookups(args),
+                inputs=[merged_path],
+                outputs=[lookups_path],
+                sources=[
+                    "ts_pn_data/exportData.py",
+                    "ts_pn_data/trieRegex.py",
+                    "actions/knowledge_base.py",
+                ],
+                params={
+                    "regex": args.lookup_regex,
+                    "min_length": args.lookup_min_length,
+                },
+            ),
+            Stage(
+                "export-intents",
+                lambda: export_intents(args),
+                inputs=[merged_path],
+                outputs=[intents_path],
+                sources=["ts_pn_data/exportData.py", "ts_pn_data/intentGen.py"],
+                params={
+                    "seed": args.intent_seed,
+                    "per_substance": args.intent_examples,
+                    "max_examples": args.intent_budget,
+                },
+            ),
+            Stage(
+                "export-doses",
+                export_doses,
+                inputs=[kb_path],
+                outputs=[doses_path],
+                sources=["actions/dose_index.py"],
+            ),
+            Stage(
+                "export-fuzzy",
+                lambda: export_fuzzy(args),
+                inputs=[kb_path],
+                outputs=[fuzzy_path],
+                sources=["actions/fuzzy_index.py", "actions/knowledge_base.py"],
+                params={"max_distance": args.fuzzy_distance},
+            ),
+            Stage(
+                "export-interactions",
+                export_interactions,
+                inputs=[kb_path],
+                outputs=[interactions_path],
+                sources=["actions/interaction_matrix.py", "actions/knowledge_base.py"],
+            ),
+            Stage(
+                "export-search",
+                export_search,
+                inputs=[kb_path],
+                outputs=[search_path],
+                sources=["actions/search_index.py"],
+            ),
+            Stage(
+                "export-reagents",
+                export_reagents,
+                inputs=[kb_path],
+                outputs=[reagents_path],
+                sources=["actions/reagent_index.py"],
+            ),
+            Stage(
+                "export-similarity",
+                lambda: export_similarity(args),
+                inputs=[kb_path],
+                outputs=[similarity_path],
+                sources=["actions/similarity_graph.py"],
+                params={"k": args.similar},
+            ),
+        ],
+        state_path,
     )
-    if name.lower() in aliases:
-        aliases.remove(name.lower())
-    aliases = sorted(aliases)
-
-    summary = ts_properties.get("summary", "").strip()
-    if not len(summary):
-        summary = None
-
-    test_kits = ts_properties.get("test-kits", "").strip()
-    if not len(test_kits):
-        test_kits = None
-
-    ts_bioavailability_str = ts_properties.get("bioavailability", "").strip()
-    ts_bioavailability = {}
-    if len(ts_bioavailability_str):
-        matches = re.findall(
-            r"([a-zA-Z\/]+)[.:\s]+([0-9\.%\s\+/\-]+)", ts_bioavailability_str
-        )
-        if len(matches):
-            for roa_name, value in matches:
-                ts_bioavailability[roa_name.lower()] = value.strip(". \t")
-
-    pw_data = pw_substance.get("data", {})
-
-    classes = pw_data.get("class")
-    toxicity = pw_data.get("toxicity")
-    addiction_potential = pw_data.get("addictionPotential")
-    tolerance = pw_data.get("tolerance")
-    cross_tolerances = pw_data.get("crossTolerances")
-
-    roas = []
-
-    # get PW ROAs
-    pw_roas = pw_substance.get("roas", [])
-
-    # process TS ROAs
-    ts_roas = []
-
-    # TS ROA dosage
-    ts_formatted_dose = ts_substance.get("formatted_dose")
-    if ts_formatted_dose:
-        for roa_name, dose_data in ts_formatted_dose.items():
-            dose_levels = []
-            for dose_level in ts_dose_order:
-                value_string = dose_data.get(dose_level)
-                if value_string is None:
-                    continue
-
-                dose_levels.append(
-                    {"name": dose_level, "value": value_string,}
-                )
-
-            if len(dose_levels):
-                ts_roas.append({"name": roa_name, "dosage": dose_levels})
-
-    # TS ROA durations
-    ts_formatted_onset = ts_substance.get("formatted_onset")
-    if ts_formatted_onset:
-        ts_add_formatted_duration(ts_roas, ts_formatted_onset, "Onset")
-
-    ts_formatted_duration = ts_substance.get("formatted_duration")
-    if ts_formatted_duration:
-        ts_add_formatted_duration(ts_roas, ts_formatted_duration, "Duration")
-
-    ts_formatted_aftereffects = ts_substance.get("formatted_aftereffects")
-    if ts_formatted_aftereffects:
-        ts_add_formatted_duration(ts_roas, ts_formatted_aftereffects, "After effects")
-
-    # merge PW and TS ROAs
-    # prioritize PW for ROAs but use TS to fill in gaps
-
-    roas.extend(pw_roas)
-    for ts_roa in ts_roas:
-        existing_roa = next(
-            (roa for roa in roas if roa_matches_name(roa, ts_roa["name"])), None
+
+
+def main():
+    args = parser.parse_args()
+    pipeline = build_pipeline(args)
+
+    unknown = [s for s in args.stages if s not in pipeline.by_name]
+    if len(unknown):
+        parser.error(
+            f"unknown stage(s) {', '.join(unknown)}, choose from {', '.join(pipeline.by_name)}"
         )
-        # if ROA does not exist, add
-        if not existing_roa:
-            existing_roa = ts_roa
-            roas.append(existing_roa)
-            # we want bioavailability from below, so don't skip
-
-        # if ROA does not already have bioavailability, try to get from TS
-        if not existing_roa.get("bioavailability"):
-            name_lower = ts_roa["name"].lower()
-            name_aliases = roa_name_aliases.get(name_lower, [])
-
-            alias_found = next(
-                (name_alias in ts_bioavailability for name_alias in name_aliases), None
-            )
-            # TS has bioavailability if name or any name alias is found
-            if name_lower in ts_bioavailability or alias_found:
-                existing_roa["bioavailability"] = ts_bioavailability.get(
-                    name_lower
-                ) or ts_bioavailability.get(alias_found)
-
-        # if existing ROA is missing dosage and TS has dosage, add
-        if (not existing_roa.get("dosage") or not len(existing_roa["dosage"])) and (
-            "dosage" in ts_roa and ts_roa["dosage"] and len(ts_roa["dosage"])
-        ):
-            existing_roa["dosage"] = ts_roa["dosage"]
-
-        # if existing ROA is missing duration and TS has duration, add
-        if (not existing_roa.get("duration") or not len(existing_roa["duration"])) and (
-            "duration" in ts_roa and ts_roa["duration"] and len(ts_roa["duration"])
-        ):
-            existing_roa["duration"] = ts_roa["duration"]
-
-    interactions = None
-    combos = ts_substance.get("combos")
-    if combos:
-        interactions = []
-        for key, combo_data in combos.items():
-            if key in ts_combo_ignore:
-                continue
-
-            combo_data["name"] = ts_combo_transformations[key]
-            interactions.append(combo_data)
-        interactions = sorted(interactions, key=lambda i: i["name"])
-
-    substance_data.append(
-        {
-            "id": x,
-            "name": name,
-            "aliases": list(aliases),
-            "aliasesStr": ",".join(aliases),
-            "url": url,
-            "experiencesUrl": experiences_url,
-            "summary": summary,
-            "reagents": test_kits,
-            "classes": classes,
-            "toxicity": toxicity,
-            "addictionPotential": addiction_potential,
-            "tolerance": tolerance,
-            "crossTolerances": cross_tolerances,
-            "roas": roas,
-            "interactions": interactions,
-        }
-    )
-    x += 1
-
-# output
-
-substances_json = {}
-substances_json["substances"] = substance_data
-with open(f"ts_pn_data/substances_data.json", "w") as f:
-    json.dump(substances_json, fp=f, ensure_ascii=False, indent=2)
-
-
-substance_aliases = {}
-
-with open("data/lookups/substances.yml", "w") as fp:
-    # Lookup Table
-    fp.write("""version: "2.0"\nnlu:\n- lookup: substance\n  examples: |\n""")
-    for drug in substances_json["substances"]:
-        fp.write(f"    - {drug['name']}\n")
-        # Add aliases to lookup table too
-        for y in drug["aliases"]:
-            # Check for "or" in aliases and remove
-            if " or " in y:
-                aliases = y.split(" or ")
-                fp.write(f"    - {aliases[0]}\n")
-                fp.write(f"    - {aliases[1]}\n")
-            elif "or " in y:
-                aliases = y.split("or ")
-                fp.write(f"    - {aliases[1]}\n")
-            else:
-                fp.write(f"    - {y}\n")
-    fp.write("\n")
-    # Synonyms to map aliases to one entity
-    for drug in substances_json["substances"]:
-        # Skip adding synonym if there are no aliases
-        substance_aliases[drug["name"]] = []
-        if drug["aliases"] == []:
-            continue
-        fp.write(f"- synonym: {drug['name']}\n  examples: |\n")
-        for y in drug["aliases"]:
-            # Check for "or" in aliases and remove
-            if " or " in y:
-                aliases = y.split(" or ")
-                fp.write(f"    - {aliases[0]}\n")
-                fp.write(f"    - {aliases[1]}\n")
-                substance_aliases[drug["name"]].append(aliases[0])
-                substance_aliases[drug["name"]].append(aliases[1])
-            elif "or " in y:
-                aliases = y.split("or ")
-                fp.write(f"    - {aliases[1]}\n")
-                substance_aliases[drug["name"]].append(aliases[1])
-            else:
-                fp.write(f"    - {y}\n")
-                substance_aliases[drug["name"]].append(y)
-
-with open("ts_pn_data/generated_intents.yml", "w") as fp:
-    fp.write(intentGen(substance_aliases).what_is())
+
+    if args.list:
+        for stage in pipeline.stages:
+            status = "up to date" if pipeline.is_fresh(stage) else "stale"
+            print(f"{stage.name:<16} {status}")
+        return
+
+    force = set()
+    if args.force:
+        force.update(args.stages or pipeline.by_name)
+    if args.refresh:
+        force.update(["fetch-ts", "fetch-pw"])
+
+    try:
+        pipeline.run(args.stages, force)
+    except KeyboardInterrupt:
+        print("\nScrape canceled")
+        exit(0)
+    except PwScrapeError as e:
+        # finished pages are already in the page cache, so rerunning only fetches the failed ones
+        print(e)
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
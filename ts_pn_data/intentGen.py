@@ -1,38 +1,121 @@
-from secrets import choice, randbelow
+import heapq
+import random
+from secrets import SystemRandom
+
+templates = [
+    "what is [{}](substance)?",
+    "what is [{}](substance)",
+    "whats [{}](substance)",
+    "what's [{}](substance)?",
+    "what [{}](substance)",
+]
+unlikely_templates = [
+    "[{}](substance)?",
+    "[{}](substance) is what?",
+    "[{}](substance) is?",
+]
+
+
+def allocate(weights, ceilings, total):
+    """split total examples over substances, every one gets an example before any gets a second and
+    after that they're handed out in proportion to weight, never past a substance's ceiling
+
+    this is Adams' apportionment method, one example at a time to the substance with the most
+    weight per example it already has (ties to the heavier, then the earlier one)
+    """
+    budgets = [0] * len(weights)
+    heap = [(0, -w, -w, i) for i, w in enumerate(weights) if ceilings[i] > 0]
+    heapq.heapify(heap)
+    for _ in range(total):
+        if not heap:
+            break
+        _, _, _, i = heapq.heappop(heap)
+        budgets[i] += 1
+        if budgets[i] < ceilings[i]:
+            heapq.heappush(heap, (1, -weights[i] / budgets[i], -weights[i], i))
+    return budgets
 
 
 class intentGen:
-    def __init__(self, substances):
-        self.names = []
-        for x in substances:
-            self.names.append(x)
-            if not substances[x] == []:
-                for y in substances[x]:
-                    self.names.append(y)
+    def __init__(self, substances, seed=None):
+        """substances maps a substance name to its aliases
 
-    def parse(self, intent_name, intent_list):
-        intent_str = f"- intent: {intent_name}\n  examples: |\n"
+        a seed makes the output the same on every run (so rasa only retrains when the data changes),
+        without one examples are picked at random
+        """
+        self.seed = seed
+        # canonical name first, it's what most people call a substance
+        self.substances = {x: [x] + list(substances[x]) for x in substances}
+        self.names = [y for x in self.substances.values() for y in x]
+
+    def random(self, substance):
+        # one stream per substance, so adding or editing a substance leaves the others' examples alone
+        if self.seed is None:
+            return SystemRandom()
+        return random.Random(f"{self.seed}:{substance}")
+
+    def parse_lines(self, intent_name, intent_list):
+        yield f"- intent: {intent_name}\n  examples: |\n"
         for x in intent_list:
-            intent_str = "".join([intent_str, f"    - {x}\n"])
-        return intent_str
-
-    def what_is(self):
-        what_is_intents = []
-        for name in self.names:
-            unlikely_chance = randbelow(10)
-            templates = [
-                f"what is [{name}](substance)?",
-                f"what is [{name}](substance)",
-                f"whats [{name}](substance)",
-                f"what's [{name}](substance)?",
-                f"what [{name}](substance)",
-            ]
-            what_is_intents.append(choice(templates))
-            if unlikely_chance > 6:
-                unlikely_templates = [
-                    f"[{name}](substance)?",
-                    f"[{name}](substance) is what?",
-                    f"[{name}](substance) is?",
-                ]
-                what_is_intents.append(choice(unlikely_templates))
-        return self.parse("what_is_substance", intent_list=what_is_intents)
+            yield f"    - {x}\n"
+
+    def parse(self, intent_name, intent_list):
+        return "".join(self.parse_lines(intent_name, intent_list))
+
+    def substance_examples(self, names, rnd, budget=None):
+        """examples for one substance's names
+
+        without a budget every name gets a common phrasing and three in ten also an unlikely one.
+        with one, rounds go over the names (canonical name first) until it runs out: a common
+        phrasing each, an unlikely one each, then the remaining phrasings
+        """
+        if budget is None:
+            examples = []
+            for name in names:
+                examples.append(rnd.choice(templates).format(name))
+                if rnd.randrange(10) > 6:
+                    examples.append(rnd.choice(unlikely_templates).format(name))
+            return examples
+
+        phrasings = []
+        for name in names:
+            common = rnd.sample(templates, len(templates))
+            unlikely = rnd.sample(unlikely_templates, len(unlikely_templates))
+            phrasings.append([common[0], unlikely[0]] + common[1:] + unlikely[1:])
+        rounds = len(templates) + len(unlikely_templates)
+        picked = [(i, r) for r in range(rounds) for i in range(len(names))][:budget]
+        # written out name by name
+        return [phrasings[i][r].format(names[i]) for i, r in sorted(picked)]
+
+    def budgets(self, per_substance=None, max_examples=None):
+        """examples to write per substance, None where it isn't limited
+
+        max_examples is spread over substances by how many names they have, a rough measure of how
+        often they're asked about, up to per_substance (or one per name) each
+        """
+        if max_examples is None:
+            return [per_substance] * len(self.substances)
+        weights = [len(names) for names in self.substances.values()]
+        phrasings = len(templates) + len(unlikely_templates)
+        ceilings = [
+            (
+                len(names)
+                if per_substance is None
+                else min(per_substance, len(names) * phrasings)
+            )
+            for names in self.substances.values()
+        ]
+        return allocate(weights, ceilings, max_examples)
+
+    def what_is_examples(self, per_substance=None, max_examples=None):
+        budgets = self.budgets(per_substance, max_examples)
+        for (substance, names), budget in zip(self.substances.items(), budgets):
+            yield from self.substance_examples(names, self.random(substance), budget)
+
+    def what_is_lines(self, per_substance=None, max_examples=None):
+        """the what_is_substance intent a line at a time, for writing it out as it's generated"""
+        what_is_intents = self.what_is_examples(per_substance, max_examples)
+        return self.parse_lines("what_is_substance", intent_list=what_is_intents)
+
+    def what_is(self, per_substance=None, max_examples=None):
+        return "".join(self.what_is_lines(per_substance, max_examples))
@@ -0,0 +1,345 @@
+# merges psychonautwiki and tripsit substance data into the standardized format
+# prioritizes psychonautwiki ROA info (dose/duration) over tripsit factsheets
+
+import re
+
+roa_name_aliases = {
+    "iv": ["intravenous"],
+    "intravenous": ["iv"],
+    "im": ["intramuscular"],
+    "intramuscular": ["im"],
+    "insufflated": ["snorted"],
+    "snorted": ["insufflated"],
+    "vaporized": ["vapourized"],
+    "vapourized": ["vaporized"],
+}
+
+
+def roa_matches_name(roa, name):
+    aliases = roa_name_aliases.get(name.lower(), [])
+    return roa["name"].lower() == name.lower() or roa["name"].lower() in aliases
+
+
+ts_dose_order = ["Threshold", "Light", "Common", "Strong", "Heavy"]
+ts_combo_ignore = ["benzos"]  # duplicate
+# prettify names in interaction list
+ts_combo_transformations = {
+    "lsd": "LSD",
+    "mushrooms": "Mushrooms",
+    "dmt": "DMT",
+    "mescaline": "Mescaline",
+    "dox": "DOx",
+    "nbomes": "NBOMes",
+    "2c-x": "2C-x",
+    "2c-t-x": "2C-T-x",
+    "amt": "aMT",
+    "5-meo-xxt": "5-MeO-xxT",
+    "cannabis": "Cannabis",
+    "ketamine": "Ketamine",
+    "mxe": "MXE",
+    "dxm": "DXM",
+    "pcp": "PCP",
+    "nitrous": "Nitrous",
+    "amphetamines": "Amphetamines",
+    "mdma": "MDMA",
+    "cocaine": "Cocaine",
+    "caffeine": "Caffeine",
+    "alcohol": "Alcohol",
+    "ghb/gbl": "GHB/GBL",
+    "opioids": "Opioids",
+    "tramadol": "Tramadol",
+    "benzodiazepines": "Benzodiazepines",
+    "maois": "MAOIs",
+    "ssris": "SSRIs",
+}
+
+
+# TS has durations split over a few keys, so this finds or creates the duration for the associated ROA
+# and adds a new line item
+def ts_add_formatted_duration(ts_roas, formatted_duration, duration_name):
+    units = formatted_duration.get("_unit", "") or ""
+    if "_unit" in formatted_duration:
+        formatted_duration.pop("_unit")
+
+    def add_to_roa(roa, value):
+        if "duration" not in roa:
+            roa["duration"] = []
+
+        roa["duration"].append({"name": duration_name, "value": value})
+
+    for roa_name, value in formatted_duration.items():
+        value_string = f"{value} {units}".strip()
+
+        # if value present (i.e. just one value for all ROA doses provided above), apply to all ROAs
+        if roa_name == "value":
+            # if TS did not add any doses, do nothing with this value
+            # we could theoretically apply this to all PW doses with missing durations, but we can't be sure
+            # if it applies to all ROAs, so just ignore
+            if not len(ts_roas):
+                break
+
+            for ts_roa in ts_roas:
+                add_to_roa(ts_roa, value_string)
+
+        # add to matching ROA or create new ROA if doesn't exist
+        else:
+            ts_roa = next(
+                (ts_roa for ts_roa in ts_roas if roa_matches_name(ts_roa, roa_name)),
+                None,
+            )
+            # if ROA doesn't exist, make new
+            if not ts_roa:
+                ts_roa = {"name": roa_name}
+                ts_roas.append(ts_roa)
+
+            add_to_roa(ts_roa, value_string)
+
+
+def substance_names(substance):
+    """lowercased values of the keys we match names against"""
+    return [
+        substance[key].lower() for key in ["name", "pretty_name"] if key in substance
+    ] + [alias.lower() for alias in substance.get("aliases", [])]
+
+
+class SubstanceIndex:
+    """lowercased name -> substances lookup over one data source
+
+    taking a substance tombstones it, so later lookups behave as if it had been
+    removed from the source list
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.taken = [False] * len(data)
+        self.by_name = {}
+        for idx, substance in enumerate(data):
+            for name in substance_names(substance):
+                positions = self.by_name.setdefault(name, [])
+                if not len(positions) or positions[-1] != idx:
+                    positions.append(idx)
+        # keep earliest position last so it can be popped once taken
+        for positions in self.by_name.values():
+            positions.reverse()
+
+    def take(self, name):
+        """first untaken substance in source order matching name, or None"""
+        positions = self.by_name.get(name.lower())
+        if not positions:
+            return None
+        while len(positions) and self.taken[positions[-1]]:
+            positions.pop()
+        if not len(positions):
+            return None
+        idx = positions.pop()
+        self.taken[idx] = True
+        return self.data[idx]
+
+
+def merge_substances(pw_substance_data, ts_substances_data):
+    """combine tripsit and psychonautwiki data into one list of substances"""
+    all_substance_names = sorted(
+        set(
+            list(map(lambda s: s.get("name", "").lower(), pw_substance_data))
+            + list(map(lambda s: s.get("name", "").lower(), ts_substances_data))
+        )
+    )
+    pw_index = SubstanceIndex(pw_substance_data)
+    ts_index = SubstanceIndex(ts_substances_data)
+    substance_data = []
+    x = 0
+
+    for name in all_substance_names:
+        # find PW substance, taking it to get rid of duplicates in final output
+        pw_substance = pw_index.take(name) or {}
+
+        # find TS substance, taking it to get rid of duplicates in final output
+        ts_substance = ts_index.take(name) or {}
+
+        # if no substance found in either dataset, skip
+        if not pw_substance and not ts_substance:
+            continue
+
+        ts_properties = ts_substance.get("properties", {})
+
+        # url will always exist for psychonautwiki substance, so tripsit substance must exist if url is None
+        url = (
+            pw_substance.get("url")
+            or f"https://drugs.tripsit.me/{ts_substance['name']}"
+        )
+
+        ts_links = ts_substance.get("links", {})
+        experiences_url = ts_links.get("experiences")
+
+        # pick display name from available substances found from both datasets
+        names = list(
+            filter(
+                lambda n: n is not None and len(n) > 0,
+                [pw_substance.get("name"), ts_substance.get("pretty_name")],
+            )
+        )
+        # people use shorter names
+        name = min(names, key=len)
+
+        # lowercase list of all names, excluding chosen name above
+        aliases = set(
+            map(
+                lambda n: n.lower(),
+                filter(
+                    lambda n: n is not None and len(n) > 0,
+                    [pw_substance.get("name"), ts_substance.get("pretty_name")]
+                    + pw_substance.get("aliases", [])
+                    + ts_substance.get("aliases", []),
+                ),
+            )
+        )
+        if name.lower() in aliases:
+            aliases.remove(name.lower())
+        aliases = sorted(aliases)
+
+        summary = ts_properties.get("summary", "").strip()
+        if not len(summary):
+            summary = None
+
+        test_kits = ts_properties.get("test-kits", "").strip()
+        if not len(test_kits):
+            test_kits = None
+
+        ts_bioavailability_str = ts_properties.get("bioavailability", "").strip()
+        ts_bioavailability = {}
+        if len(ts_bioavailability_str):
+            matches = re.findall(
+                r"([a-zA-Z\/]+)[.:\s]+([0-9\.%\s\+/\-]+)", ts_bioavailability_str
+            )
+            if len(matches):
+                for roa_name, value in matches:
+                    ts_bioavailability[roa_name.lower()] = value.strip(". \t")
+
+        pw_data = pw_substance.get("data", {})
+
+        classes = pw_data.get("class")
+        toxicity = pw_data.get("toxicity")
+        addiction_potential = pw_data.get("addictionPotential")
+        tolerance = pw_data.get("tolerance")
+        cross_tolerances = pw_data.get("crossTolerances")
+
+        roas = []
+
+        # get PW ROAs
+        pw_roas = pw_substance.get("roas", [])
+
+        # process TS ROAs
+        ts_roas = []
+
+        # TS ROA dosage
+        ts_formatted_dose = ts_substance.get("formatted_dose")
+        if ts_formatted_dose:
+            for roa_name, dose_data in ts_formatted_dose.items():
+                dose_levels = []
+                for dose_level in ts_dose_order:
+                    value_string = dose_data.get(dose_level)
+                    if value_string is None:
+                        continue
+
+                    dose_levels.append(
+                        {
+                            "name": dose_level,
+                            "value": value_string,
+                        }
+                    )
+
+                if len(dose_levels):
+                    ts_roas.append({"name": roa_name, "dosage": dose_levels})
+
+        # TS ROA durations
+        ts_formatted_onset = ts_substance.get("formatted_onset")
+        if ts_formatted_onset:
+            ts_add_formatted_duration(ts_roas, ts_formatted_onset, "Onset")
+
+        ts_formatted_duration = ts_substance.get("formatted_duration")
+        if ts_formatted_duration:
+            ts_add_formatted_duration(ts_roas, ts_formatted_duration, "Duration")
+
+        ts_formatted_aftereffects = ts_substance.get("formatted_aftereffects")
+        if ts_formatted_aftereffects:
+            ts_add_formatted_duration(
+                ts_roas, ts_formatted_aftereffects, "After effects"
+            )
+
+        # merge PW and TS ROAs
+        # prioritize PW for ROAs but use TS to fill in gaps
+
+        roas.extend(pw_roas)
+        for ts_roa in ts_roas:
+            existing_roa = next(
+                (roa for roa in roas if roa_matches_name(roa, ts_roa["name"])), None
+            )
+            # if ROA does not exist, add
+            if not existing_roa:
+                existing_roa = ts_roa
+                roas.append(existing_roa)
+                # we want bioavailability from below, so don't skip
+
+            # if ROA does not already have bioavailability, try to get from TS
+            if not existing_roa.get("bioavailability"):
+                name_lower = ts_roa["name"].lower()
+                name_aliases = roa_name_aliases.get(name_lower, [])
+
+                alias_found = next(
+                    (name_alias in ts_bioavailability for name_alias in name_aliases),
+                    None,
+                )
+                # TS has bioavailability if name or any name alias is found
+                if name_lower in ts_bioavailability or alias_found:
+                    existing_roa["bioavailability"] = ts_bioavailability.get(
+                        name_lower
+                    ) or ts_bioavailability.get(alias_found)
+
+            # if existing ROA is missing dosage and TS has dosage, add
+            if (not existing_roa.get("dosage") or not len(existing_roa["dosage"])) and (
+                "dosage" in ts_roa and ts_roa["dosage"] and len(ts_roa["dosage"])
+            ):
+                existing_roa["dosage"] = ts_roa["dosage"]
+
+            # if existing ROA is missing duration and TS has duration, add
+            if (
+                not existing_roa.get("duration") or not len(existing_roa["duration"])
+            ) and (
+                "duration" in ts_roa and ts_roa["duration"] and len(ts_roa["duration"])
+            ):
+                existing_roa["duration"] = ts_roa["duration"]
+
+        interactions = None
+        combos = ts_substance.get("combos")
+        if combos:
+            interactions = []
+            for key, combo_data in combos.items():
+                if key in ts_combo_ignore:
+                    continue
+
+                combo_data["name"] = ts_combo_transformations[key]
+                interactions.append(combo_data)
+            interactions = sorted(interactions, key=lambda i: i["name"])
+
+        substance_data.append(
+            {
+                "id": x,
+                "name": name,
+                "aliases": list(aliases),
+                "aliasesStr": ",".join(aliases),
+                "url": url,
+                "experiencesUrl": experiences_url,
+                "summary": summary,
+                "reagents": test_kits,
+                "classes": classes,
+                "toxicity": toxicity,
+                "addictionPotential": addiction_potential,
+                "tolerance": tolerance,
+                "crossTolerances": cross_tolerances,
+                "roas": roas,
+                "interactions": interactions,
+            }
+        )
+        x += 1
+
+    return substance_data
@@ -0,0 +1,120 @@
+# a small make-style runner for the data pipeline stages in getData.py
+#
+# each stage declares the artifacts it reads and writes plus the source files its output depends on.
+# after a stage runs, the content hashes of its outputs are recorded together with a fingerprint of
+# its inputs, so the next run can skip any stage whose inputs, sources and options are unchanged
+
+import hashlib
+import json
+import os
+import time
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Stage:
+    """a named pipeline step
+
+    fetch stages read remote data, there is nothing local to fingerprint so they only run when
+    their outputs are missing or when explicitly forced
+    """
+
+    def __init__(
+        self, name, run, inputs=(), outputs=(), sources=(), params=None, fetch=False
+    ):
+        self.name = name
+        self.run = run
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.sources = list(sources)
+        self.params = params or {}
+        self.fetch = fetch
+
+
+class Pipeline:
+    def __init__(self, stages, state_path):
+        self.stages = stages
+        self.by_name = {stage.name: stage for stage in stages}
+        self.producers = {output: stage for stage in stages for output in stage.outputs}
+        self.state_path = state_path
+        self.state = {}
+        if os.path.exists(state_path):
+            with open(state_path) as f:
+                self.state = json.load(f)
+
+    def dependencies(self, stage):
+        return [self.producers[i] for i in stage.inputs if i in self.producers]
+
+    def plan(self, targets):
+        """targets plus everything they depend on, in run order"""
+        ordered = []
+
+        def visit(stage):
+            if stage in ordered:
+                return
+            for dependency in self.dependencies(stage):
+                visit(dependency)
+            ordered.append(stage)
+
+        for target in targets:
+            visit(self.by_name[target])
+        return ordered
+
+    def fingerprint(self, stage):
+        digest = hashlib.sha256()
+        digest.update(stage.name.encode("utf-8"))
+        digest.update(json.dumps(stage.params, sort_keys=True).encode("utf-8"))
+        for path in stage.inputs + stage.sources:
+            digest.update(path.encode("utf-8"))
+            digest.update(file_hash(path).encode("utf-8"))
+        return digest.hexdigest()
+
+    def is_fresh(self, stage):
+        if not all(os.path.exists(output) for output in stage.outputs):
+            return False
+        if stage.fetch:
+            return True
+
+        recorded = self.state.get(stage.name)
+        if not recorded or recorded["fingerprint"] != self.fingerprint(stage):
+            return False
+        # outputs edited by hand since the last run count as stale too
+        return all(
+            recorded["outputs"].get(output) == file_hash(output)
+            for output in stage.outputs
+        )
+
+    def record(self, stage):
+        self.state[stage.name] = {
+            "fingerprint": self.fingerprint(stage),
+            "outputs": {output: file_hash(output) for output in stage.outputs},
+        }
+        # saved after every stage so an interrupted run keeps the work it finished
+        with open(self.state_path + ".tmp", "w") as f:
+            json.dump(self.state, f, indent=2, sort_keys=True)
+        os.replace(self.state_path + ".tmp", self.state_path)
+
+    def run(self, targets=None, force=()):
+        """bring targets (default: every stage) up to date, always rerunning stages named in force"""
+        for stage in self.plan(targets or [stage.name for stage in self.stages]):
+            if stage.name not in force and self.is_fresh(stage):
+                print(f"Skipping {stage.name}, up to date")
+                continue
+
+            missing = [i for i in stage.inputs if not os.path.exists(i)]
+            if len(missing):
+                raise FileNotFoundError(
+                    f"{stage.name} is missing its inputs: {', '.join(missing)}"
+                )
+
+            print(f"Running {stage.name}")
+            start = time.perf_counter()
+            stage.run()
+            self.record(stage)
+            print(f"Finished {stage.name} in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,435 @@
+# scrapes substance data from psychonautwiki: the graphql api for the substance listing and
+# metadata, and each substance's wiki page for aliases and ROA dose/duration tables
+
+import requests
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup, SoupStrainer
+from python_graphql_client import GraphqlClient
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import traceback
+
+headers = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "GET",
+    "Access-Control-Allow-Headers": "Content-Type",
+    "Access-Control-Max-Age": "3600",
+    "User-Agent": "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:52.0) Gecko/20100101 Firefox/52.0",
+}
+
+ps_api_url = "https://api.psychonautwiki.org"
+
+retry_statuses = {429, 500, 502, 503, 504}
+
+
+class HostRateLimiter:
+    """spaces requests out so no single host gets more than `rate` requests per second"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.lock = threading.Lock()
+        self.next_slot = {}
+
+    def wait(self, url):
+        if not self.interval:
+            return
+        host = urlparse(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def pw_clean_common_name(name):
+    name = re.sub(r'^"', "", name)
+    name = re.sub(r'"$', "", name)
+    name = re.sub(r'"?\[\d*\]$', "", name)
+    name = re.sub(r"\s*More names\.$", "", name)
+    name = re.sub(r"\.$", "", name)
+    return name.strip()
+
+
+def pw_should_skip(name, common_names_str):
+    return name.startswith("Experience:") or len(common_names_str) == 0
+
+
+# everything we read is in the page heading, the infobox or the dose chart tables, so the rest of
+# the page (navigation, article text, references) is dropped while parsing instead of being built
+# into the tree. every tr lives in a table, so walking rows with find_next behaves the same
+pw_page_strainer = SoupStrainer(["h1", "table"])
+
+
+# substance listing, fetched in pages together with the metadata we keep for each substance
+pw_substance_fields = """
+    name
+    url
+    class {
+        chemical
+        psychoactive
+    }
+    tolerance {
+        full
+        half
+        zero
+    }
+    toxicity
+    addictionPotential
+    crossTolerances
+"""
+
+
+def pw_substance_metadata(substance):
+    return {k: v for k, v in substance.items() if k not in ["name", "url"]}
+
+
+pw_scrape_failed = object()
+
+
+# parse a single psychonautwiki substance page, returns None if the page should be skipped
+# parser="html.parser", parse_only=None gives the original full-page parse, kept to validate against
+def pw_parse_substance(substance, content, parser="lxml", parse_only=pw_page_strainer):
+    url = substance["url"]
+    substance_soup = BeautifulSoup(content, parser, parse_only=parse_only)
+
+    name = substance_soup.find("h1", id="firstHeading").text
+    # get aliases text
+    common_names_str = substance_soup.find_all(string="Common names")
+    if pw_should_skip(name, common_names_str):
+        return None
+
+    cleaned_common_names = (
+        set(
+            map(
+                pw_clean_common_name,
+                common_names_str[0].parent.find_next_sibling("td").text.split(", "),
+            )
+        )
+        if len(common_names_str) > 0
+        else set()
+    )
+    cleaned_common_names.add(substance["name"])
+    # don't include name in list of other common names
+    common_names = sorted(filter(lambda n: n != name, cleaned_common_names))
+
+    # scrape ROAs from page
+
+    def get_data_starting_at_row(curr_row):
+        rows = []
+        while curr_row is not None and curr_row.find("th", {"class": "ROARowHeader"}):
+            row = {}
+            row["name"] = curr_row.find("th", {"class": "ROARowHeader"}).find("a").text
+
+            row_values = curr_row.find("td", {"class": "RowValues"})
+
+            row_value_text = row_values.find_all(string=True, recursive=False)
+            if len(row_value_text):
+                row["value"] = "".join(row_value_text).strip()
+            else:
+                row["value"] = None
+
+            row_note = row_values.find("span")
+            if row_note:
+                row["note"] = re.sub(r"\s*\[\d*\]$", "", row_note.text).strip()
+
+            rows.append(row)
+
+            curr_row = curr_row.find_next("tr")
+        return rows, curr_row
+
+    roas = []
+
+    dose_charts = substance_soup.find_all("tr", {"class": "dosechart"})
+    for dose_chart in dose_charts:
+        table = dose_chart.parent.parent
+        roa_name = table.find("tr").find("a").text
+        if not roa_name:
+            continue
+
+        roa = {
+            "name": roa_name,
+            "dosage": [],
+            "duration": [],
+        }
+
+        # dosage
+
+        curr_row = dose_chart.find_next("tr")
+        roa["dosage"], curr_row = get_data_starting_at_row(curr_row)
+
+        # extract bioavailability
+        if len(roa["dosage"]) and roa["dosage"][0]["name"] == "Bioavailability":
+            bioavailability = roa["dosage"].pop(0)
+            roa["bioavailability"] = bioavailability["value"]
+
+        # duration
+
+        if curr_row is not None and curr_row.find("th", {"class": "ROASubHeader"}):
+            curr_row = curr_row.find_next("tr")
+            roa["duration"], _ = get_data_starting_at_row(curr_row)
+
+        if not len(roa["dosage"]):
+            roa["dosage"] = None
+        if not len(roa["duration"]):
+            roa["duration"] = None
+
+        roas.append(roa)
+
+    return {
+        "url": url,
+        "name": name,
+        "aliases": common_names,
+        "roas": roas,
+    }
+
+
+class PwScrapeError(Exception):
+    def __init__(self, failed, stale=()):
+        problems = []
+        if len(failed):
+            problems.append(
+                f"Failed to scrape {len(failed)} substance(s): {', '.join(failed)}"
+            )
+        if len(stale):
+            problems.append(
+                f"{len(stale)} substance(s) only have a stale cached page: {', '.join(stale)}"
+            )
+        super().__init__("\n".join(problems))
+        self.failed = failed
+        self.stale = stale
+
+
+class PwScraper:
+    """scrapes every psychonautwiki substance, pages are fetched concurrently and cached per url
+
+    a cached page younger than max_age hours is reused without a request, older ones are
+    revalidated with a conditional request and only re-parsed if psychonautwiki reports a change.
+    a page that can't be fetched falls back to its cached copy however old, which is reported, and
+    more than max_stale of those fail the scrape like a page without any copy does
+    """
+
+    def __init__(
+        self,
+        workers=8,
+        rate_limit=5.0,
+        retries=3,
+        max_age=12,
+        max_stale=10,
+        page_size=100,
+        api_url=ps_api_url,
+        cache_dir="ts_pn_data/_pw_cache",
+    ):
+        self.workers = max(1, workers)
+        self.retries = retries
+        self.max_age = max_age
+        self.max_stale = max_stale
+        self.page_size = max(1, page_size)
+        self.api_url = api_url
+        self.cache_dir = cache_dir
+        self.rate_limiter = HostRateLimiter(rate_limit)
+        self.client = GraphqlClient(endpoint=api_url, headers=headers)
+        # one pooled session shared by all scrape workers
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        self.session.mount(
+            "https://",
+            HTTPAdapter(pool_connections=4, pool_maxsize=self.workers),
+        )
+
+    def with_retries(self, url, request):
+        """run request() against url, rate limited and retried with exponential backoff"""
+        for attempt in range(self.retries + 1):
+            self.rate_limiter.wait(url)
+            try:
+                response = request()
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError):
+                if attempt == self.retries:
+                    raise
+            else:
+                if (
+                    not isinstance(response, requests.Response)
+                    or response.status_code not in retry_statuses
+                    or attempt == self.retries
+                ):
+                    return response
+            time.sleep(2**attempt)
+
+    def get(self, url, extra_headers=None):
+        return self.with_retries(
+            url, lambda: self.session.get(url, headers=extra_headers, timeout=30)
+        )
+
+    def execute(self, query):
+        return self.with_retries(self.api_url, lambda: self.client.execute(query=query))
+
+    def fetch_substances(self, offset, limit):
+        """fetch one page of substances, returns (substances, reached_end)"""
+        query = (
+            f"{{substances(limit: {limit} offset: {offset}) {{{pw_substance_fields}}}}}"
+        )
+        page = (self.execute(query).get("data") or {}).get("substances")
+        if page is not None:
+            return page, len(page) < limit
+
+        # the API fails the whole page if any one substance in it can't be resolved,
+        # so split the page to isolate the broken entries
+        if limit == 1:
+            print(
+                f"Skipping substance at offset {offset}, psychonautwiki failed to return it"
+            )
+            return [], False
+        half = limit // 2
+        first, reached_end = self.fetch_substances(offset, half)
+        if reached_end:
+            return first, True
+        second, reached_end = self.fetch_substances(offset + half, limit - half)
+        return first + second, reached_end
+
+    def list_substances(self):
+        substances = []
+        offset = 0
+        reached_end = False
+        while not reached_end:
+            page, reached_end = self.fetch_substances(offset, self.page_size)
+            substances.extend(page)
+            offset += self.page_size
+        print(f"Found {len(substances)} substances on psychonautwiki")
+        return substances
+
+    # per-page cache, one file per substance url holding the validators from the last fetch and the parsed record
+
+    def cache_path(self, url):
+        return os.path.join(
+            self.cache_dir, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".json"
+        )
+
+    def cache_load(self, url):
+        try:
+            with open(self.cache_path(url)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def html_cache_path(self, url):
+        return self.cache_path(url)[: -len(".json")] + ".html.gz"
+
+    def cache_store(self, entry, content=None):
+        """store an entry, and the raw page when given so parser changes can be checked offline"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # write then rename so an interrupted scrape never leaves a truncated entry behind
+        if content is not None:
+            html_path = self.html_cache_path(entry["url"])
+            with gzip.open(html_path + ".tmp", "wb") as f:
+                f.write(content)
+            os.replace(html_path + ".tmp", html_path)
+
+        path = self.cache_path(entry["url"])
+        with open(path + ".tmp", "w") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+    def scrape_substance(self, substance):
+        """fetch a substance page through the cache, returns (record, how it was obtained)"""
+        url = substance["url"]
+        entry = self.cache_load(url)
+
+        if entry and time.time() - entry["fetched_at"] < self.max_age * 3600:
+            return entry["record"], "Cached"
+
+        conditional_headers = {}
+        if entry and entry.get("etag"):
+            conditional_headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            conditional_headers["If-Modified-Since"] = entry["last_modified"]
+
+        substance_req = self.get(url, conditional_headers)
+        if substance_req.status_code == 304 and entry:
+            entry["fetched_at"] = time.time()
+            self.cache_store(entry)
+            return entry["record"], "Unchanged"
+        substance_req.raise_for_status()
+
+        record = pw_parse_substance(substance, substance_req.content)
+        self.cache_store(
+            {
+                "url": url,
+                "name": substance["name"],
+                "etag": substance_req.headers.get("ETag"),
+                "last_modified": substance_req.headers.get("Last-Modified"),
+                "fetched_at": time.time(),
+                "record": record,
+            },
+            substance_req.content,
+        )
+        return record, "Done with"
+
+    def scrape_substance_or_report(self, substance):
+        try:
+            return self.scrape_substance(substance)
+        except Exception:
+            # one report per write so it isn't interleaved with other workers' output
+            print(f"{substance['name']} failed:\n{traceback.format_exc()}")
+            # fall back to the last good copy of the page if we have one
+            entry = self.cache_load(substance["url"])
+            if not entry:
+                return pw_scrape_failed, "Failed"
+            age = (time.time() - entry["fetched_at"]) / 3600
+            return entry["record"], f"Stale ({age:.0f} hours old)"
+
+    def scrape(self):
+        """scrape all substances, raises PwScrapeError after the run if any page could not be scraped
+
+        or if more than max_stale pages could only be served from a stale cached copy
+        """
+        substances = self.list_substances()
+        total = len(substances)
+        pw_substance_data = []
+        failed = []
+        stale = []
+
+        # results are read in input order, so the output is identical to a serial (workers=1) run
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [
+                executor.submit(self.scrape_substance_or_report, substance)
+                for substance in substances
+            ]
+            try:
+                for idx, (substance, future) in enumerate(zip(substances, futures)):
+                    record, status = future.result()
+                    if record is pw_scrape_failed:
+                        print(f"Failed {substance['name']} ({idx + 1} / {total})")
+                        failed.append(substance["name"])
+                    elif record is None:
+                        print(f"Skipping {substance['name']} ({idx + 1} / {total})")
+                    else:
+                        if status.startswith("Stale"):
+                            stale.append(substance["name"])
+                        print(
+                            f"{status} {record['name']} [{len(record['roas'])} ROA(s)] ({idx + 1} / {total})"
+                        )
+                        # metadata comes from the listing query, so it is fresh even when the page was cached
+                        record["data"] = pw_substance_metadata(substance)
+                        pw_substance_data.append(record)
+            except BaseException:
+                # don't start the pages still queued (shutdown's cancel_futures needs python 3.9)
+                for future in futures:
+                    future.cancel()
+                raise
+
+        if len(stale):
+            print(
+                f"{len(stale)} substance(s) served from a stale cached page "
+                f"(at most {self.max_stale} allowed): {', '.join(stale)}"
+            )
+        # finished pages are already in the page cache, so rerunning only fetches the failed ones
+        if len(failed) or len(stale) > self.max_stale:
+            raise PwScrapeError(failed, stale if len(stale) > self.max_stale else [])
+        return pw_substance_data
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+
+# writes a smaller copy of the NLU training data: examples of an intent that only differ in their
+# entity values (what is [mdma](substance), what is [lsd](substance), ...) are grouped by template and
+# only a few of each group are kept, the lookup table already gives the model the entity vocabulary
+#
+#   python3 ts_pn_data/reduceData.py --per-template 3 --out data_reduced
+#   python3 ts_pn_data/reduceData.py --per-template 3 --out data_reduced --evaluate
+#
+# every file under --data is copied to --out with only intent example lines left out, so lookups,
+# synonyms, stories and rules come along unchanged. --out is replaced, so it can't overlap --data.
+# --evaluate then trains an NLU model on both (rasa train nlu, timed) and compares intent and entity
+# F1 on the user messages of tests/test_stories.yml (plus any --test nlu files)
+#
+# only --data is reduced: ts_pn_data/generated_intents.yml isn't under data/ (and rasa doesn't
+# train on it unless it's copied there), copy it into --data first to reduce it too
+
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+
+parser = argparse.ArgumentParser(
+    description="keep a few examples per entity-masked template of every intent"
+)
+parser.add_argument("--data", default="data", help="training data directory")
+parser.add_argument("--out", default="data_reduced", help="where to write the copy")
+parser.add_argument(
+    "--per-template", type=int, default=3, help="examples kept per template"
+)
+parser.add_argument("--seed", type=int, default=0, help="seed for picking examples")
+parser.add_argument(
+    "--report", help="also write the reduction (and evaluation) report here as json"
+)
+parser.add_argument(
+    "--evaluate",
+    action="store_true",
+    help="train nlu models on the full and the reduced data and compare them (needs rasa)",
+)
+parser.add_argument("--config", default="config.yml")
+parser.add_argument(
+    "--test",
+    nargs="*",
+    default=["tests/test_stories.yml"],
+    help="test stories or nlu files with the messages to score (tests/test_stories.yml has no "
+    "entities, add a held out nlu file to score them)",
+)
+
+intent_header = re.compile(r"^- intent: (.+)$")
+example_line = re.compile(r"^\s+- (.*)$")
+# [text](entity), [text](entity:value) and [text]{"entity": ..., ...}
+annotation = re.compile(r"\[([^\]]*)\](?:\(([^)]*)\)|(\{[^}]*\}))")
+
+
+def annotated_entity(match):
+    if match.group(2) is not None:
+        return match.group(2).partition(":")[0]
+    return json.loads(match.group(3)).get("entity")
+
+
+def parse_example(text):
+    """an annotated example -> the plain message and its (entity, text) pairs"""
+    entities = []
+
+    def strip(match):
+        entities.append((annotated_entity(match), match.group(1)))
+        return match.group(1)
+
+    return annotation.sub(strip, text), entities
+
+
+def template(text):
+    """the example with its entity values masked and spacing normalized
+
+    case is kept: "What is [substance]" and "what is [substance]" are different templates, so the
+    casing variants the model learns from aren't reduced away
+    """
+    masked = annotation.sub(lambda m: f"[{annotated_entity(m)}]", text)
+    return " ".join(masked.split())
+
+
+def nlu_examples(lines):
+    """(line number, intent, example) for every intent example in an nlu file's lines"""
+    intent = None
+    for number, line in enumerate(lines):
+        header = intent_header.match(line.rstrip("\n"))
+        if header:
+            intent = header.group(1).strip()
+            continue
+        if line.startswith("- "):
+            # a lookup, synonym or regex block, or another top level key
+            intent = None
+            continue
+        match = example_line.match(line.rstrip("\n"))
+        if intent and match and line.startswith("    "):
+            yield number, intent, match.group(1)
+
+
+def select(examples, per_template, seed):
+    """locations of the examples to keep, per_template from each (intent, template) group
+
+    examples are (location, intent, text), a location being anything sortable that says where the
+    example is ((file, line number) when reducing)
+    """
+    groups = {}
+    for location, intent, text in sorted(examples):
+        groups.setdefault((intent, template(text)), []).append(location)
+    keep = set()
+    for (intent, masked), locations in groups.items():
+        if len(locations) <= per_template:
+            keep.update(locations)
+        else:
+            rnd = random.Random(f"{seed}:{intent}:{masked}")
+            keep.update(rnd.sample(locations, per_template))
+    return keep, groups
+
+
+def overlapping(a, b):
+    """whether one of the two paths is, or is inside, the other"""
+    a, b = os.path.realpath(a), os.path.realpath(b)
+    return os.path.commonpath([a, b]) in (a, b)
+
+
+def reduce_data(data_dir, out_dir, per_template, seed):
+    """copy data_dir to out_dir leaving out examples, returns per intent counts"""
+    if overlapping(data_dir, out_dir):
+        # out_dir is replaced, it can't be (or hold) the data it's copied from
+        raise SystemExit(
+            f"--out {out_dir} overlaps --data {data_dir}, pick another directory"
+        )
+    # an intent's examples are often split over several files, they're grouped across all of them
+    # so a template seen in two files still only keeps per_template examples
+    files = {}
+    examples = []
+    for root, _, names in os.walk(data_dir):
+        for name in sorted(names):
+            path = os.path.relpath(os.path.join(root, name), data_dir)
+            if not name.endswith((".yml", ".yaml")):
+                files[path] = None
+                continue
+            with open(os.path.join(data_dir, path)) as f:
+                files[path] = f.readlines()
+            examples += [
+                ((path, number), intent, text)
+                for number, intent, text in nlu_examples(files[path])
+            ]
+    keep, groups = select(examples, per_template, seed)
+    dropped = {location for location, _, _ in examples} - keep
+
+    if os.path.exists(out_dir):
+        shutil.rmtree(out_dir)
+    os.makedirs(out_dir)
+    for path, lines in files.items():
+        target = os.path.join(out_dir, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if lines is None:
+            shutil.copyfile(os.path.join(data_dir, path), target)
+            continue
+        with open(target, "w") as f:
+            f.writelines(
+                line
+                for number, line in enumerate(lines)
+                if (path, number) not in dropped
+            )
+
+    stats = {}
+    for (intent, _), locations in groups.items():
+        counts = stats.setdefault(intent, {"before": 0, "after": 0, "templates": 0})
+        counts["before"] += len(locations)
+        counts["after"] += len(keep.intersection(locations))
+        counts["templates"] += 1
+    return stats
+
+
+def print_reduction(stats):
+    before = sum(c["before"] for c in stats.values())
+    after = sum(c["after"] for c in stats.values())
+    for intent, counts in sorted(stats.items(), key=lambda i: -i[1]["before"]):
+        if counts["before"] != counts["after"]:
+            print(
+                f"  {intent:<32} {counts['before']:6} -> {counts['after']:5} "
+                f"({counts['templates']} templates)"
+            )
+    print(
+        f"{before} examples -> {after} ({(1 - after / before) * 100 if before else 0:.0f}% fewer), "
+        f"{sum(c['before'] == c['after'] for c in stats.values())} intents unchanged"
+    )
+
+
+# evaluation
+
+
+def test_messages(paths):
+    """(text, intent, entities) of every user message in test stories and nlu files"""
+    messages = []
+    for path in paths:
+        with open(path) as f:
+            lines = f.readlines()
+        if any(line.lstrip().startswith("- user:") for line in lines):
+            messages += story_messages(lines)
+        else:
+            for _, intent, text in nlu_examples(lines):
+                plain, entities = parse_example(text)
+                messages.append((plain, intent, entities))
+    return messages
+
+
+def story_messages(lines):
+    messages = []
+    i = 0
+    while i < len(lines):
+        stripped = lines[i].strip()
+        if not stripped.startswith("- user:"):
+            i += 1
+            continue
+        text = stripped[len("- user:") :].strip()
+        indent = len(lines[i]) - len(lines[i].lstrip())
+        i += 1
+        if text in ("|", ">", ""):
+            # block scalar, the text is on the more indented lines that follow
+            block = []
+            while i < len(lines) and (
+                not lines[i].strip()
+                or len(lines[i]) - len(lines[i].lstrip()) > indent + 2
+            ):
+                block.append(lines[i].strip())
+                i += 1
+            text = " ".join(b for b in block if b)
+        intent = None
+        while i < len(lines) and lines[i].strip().startswith(("intent:", "entities:")):
+            key, _, value = lines[i].strip().partition(":")
+            if key == "intent":
+                intent = value.strip()
+            i += 1
+        plain, entities = parse_example(text.strip("\"'"))
+        messages.append((plain, intent, entities))
+    return messages
+
+
+def f1(true_positives, false_positives, false_negatives):
+    precision = true_positives / (true_positives + false_positives or 1)
+    recall = true_positives / (true_positives + false_negatives or 1)
+    return 2 * precision * recall / (precision + recall or 1)
+
+
+def score(messages, predictions):
+    """weighted intent F1 and micro entity F1, predictions are (intent, [(entity, text)])"""
+    intents = {}
+    for (_, intent, _), (predicted, _) in zip(messages, predictions):
+        for name in {intent, predicted}:
+            intents.setdefault(name, [0, 0, 0])
+        if predicted == intent:
+            intents[intent][0] += 1
+        else:
+            intents[predicted][1] += 1
+            intents[intent][2] += 1
+    support = {name: tp + fn for name, (tp, _, fn) in intents.items()}
+    total = sum(support.values())
+    intent_f1 = (
+        sum(f1(*counts) * support[name] for name, counts in intents.items()) / total
+        if total
+        else 0.0
+    )
+
+    entity_counts = [0, 0, 0]
+    for (_, _, entities), (_, predicted) in zip(messages, predictions):
+        gold = {(e, t.lower()) for e, t in entities}
+        found = {(e, t.lower()) for e, t in predicted}
+        entity_counts[0] += len(gold & found)
+        entity_counts[1] += len(found - gold)
+        entity_counts[2] += len(gold - found)
+    # None when the test messages have no entities and none were predicted
+    entity_f1 = f1(*entity_counts) if any(entity_counts) else None
+    return {"intent_f1": intent_f1, "entity_f1": entity_f1}
+
+
+def train(config, data_dir, out_dir, name):
+    """train an nlu model, returns its path and how long training took"""
+    if shutil.which("rasa") is None:
+        raise SystemExit("--evaluate trains models with rasa, which isn't installed")
+    start = time.perf_counter()
+    subprocess.run(
+        [
+            "rasa",
+            "train",
+            "nlu",
+            "--config",
+            config,
+            "--nlu",
+            data_dir,
+            "--out",
+            out_dir,
+            "--fixed-model-name",
+            name,
+        ],
+        check=True,
+    )
+    return os.path.join(out_dir, f"{name}.tar.gz"), time.perf_counter() - start
+
+
+def predict(model_path, messages):
+    # only needed here, reducing the data works without rasa installed
+    from rasa.model import get_model, get_model_subdirectories
+    from rasa.nlu.model import Interpreter
+
+    _, nlu_model = get_model_subdirectories(get_model(model_path))
+    interpreter = Interpreter.load(nlu_model)
+    predictions = []
+    for text, _, _ in messages:
+        parsed = interpreter.parse(text)
+        entities = [
+            (e["entity"], text[e["start"] : e["end"]]) for e in parsed["entities"]
+        ]
+        predictions.append(((parsed.get("intent") or {}).get("name"), entities))
+    return predictions
+
+
+def evaluate(args):
+    messages = test_messages(args.test)
+    results = {}
+    with tempfile.TemporaryDirectory() as models:
+        for label, data_dir in [("full", args.data), ("reduced", args.out)]:
+            model_path, seconds = train(args.config, data_dir, models, label)
+            results[label] = {"train_seconds": seconds}
+            results[label].update(score(messages, predict(model_path, messages)))
+            entity_f1 = results[label]["entity_f1"]
+            print(
+                f"{label:<8} trained in {seconds:6.1f}s, "
+                f"intent F1 {results[label]['intent_f1']:.3f}, "
+                f"entity F1 {'n/a' if entity_f1 is None else f'{entity_f1:.3f}'} "
+                f"({len(messages)} test messages)"
+            )
+    print(
+        f"training {results['full']['train_seconds'] / results['reduced']['train_seconds']:.1f}x "
+        "faster on the reduced data"
+    )
+    return results
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    stats = reduce_data(args.data, args.out, args.per_template, args.seed)
+    print_reduction(stats)
+    report = {"per_template": args.per_template, "seed": args.seed, "intents": stats}
+    if args.evaluate:
+        report["evaluation"] = evaluate(args)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
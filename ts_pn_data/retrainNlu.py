@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+
+# retrains only what changed since the last model: when getData.py rewrites the substance lookup
+# table or the generated intents, the domain, stories, rules and policies are the same and so is the
+# core model, only the nlu model needs training and only its components whose examples changed need
+# their full epochs
+#
+#   python3 ts_pn_data/retrainNlu.py
+#   python3 ts_pn_data/retrainNlu.py --compare-full
+#
+# the training inputs are hashed in groups and compared with what the last model was trained on
+# (kept in models/.retrain_state.json):
+#
+# - core: the domain, stories, rules and the config's policies, any change trains a full model
+# - nlu config: the config's language and pipeline, a change trains a full model too
+# - nlu data: the examples of every intent and every lookup, synonym and regex, one hash each
+#
+# when only nlu data changed the nlu model is finetuned from the last model (rasa train nlu
+# --finetune), and packaged with the last model's core model into a new model in --out.
+# DIETClassifier and the ResponseSelectors of retrieval intents with changed examples keep their
+# epochs, the other ResponseSelectors get --selector-epochs: rasa has no way to leave them out, and
+# since every component is fed by the same featurizers (a new lookup table changes their regex
+# features) they need a pass over the data anyway. if rasa can't finetune (e.g. the vocabulary
+# outgrew what the featurizers kept room for) the nlu model is trained from scratch instead.
+# --compare-full also times a full rasa train --force on the same data
+
+import argparse
+import copy
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import time
+
+import yaml
+
+parser = argparse.ArgumentParser(
+    description="retrain only the nlu components affected by changed training data"
+)
+parser.add_argument(
+    "--data",
+    nargs="+",
+    default=["data"],
+    help="training data files and directories",
+)
+parser.add_argument("--config", default="config.yml")
+parser.add_argument("--domain", default="domain.yml")
+parser.add_argument("--out", default="models", help="where models are kept")
+parser.add_argument(
+    "--state",
+    help="what the last model was trained on (default: .retrain_state.json in --out)",
+)
+parser.add_argument(
+    "--selector-epochs",
+    type=int,
+    default=1,
+    help="epochs of the ResponseSelectors none of whose examples changed",
+)
+parser.add_argument(
+    "--force", action="store_true", help="train a full model even if nothing changed"
+)
+parser.add_argument(
+    "--dry-run",
+    action="store_true",
+    help="only print what changed and what would be trained",
+)
+parser.add_argument(
+    "--compare-full",
+    action="store_true",
+    help="also time a full rasa train --force on the same data",
+)
+
+top_level = re.compile(r"^(\w+):")
+# - intent: name, - lookup: name, ... at the start of a block of training data
+block_header = re.compile(r"^- (\w+): (.+)$")
+nlu_blocks = ("intent", "lookup", "synonym", "regex")
+# keys of rasa's model fingerprint that describe the core model, kept from the last model
+core_fingerprint_keys = ["config", "core-config", "domain", "nlg", "stories"]
+
+
+def training_files(paths):
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if name.endswith((".yml", ".yaml")):
+                    yield os.path.join(root, name)
+
+
+def data_blocks(lines):
+    """(section, kind, name, lines) of every top level block of a training data file"""
+    section, kind, name, block = None, None, None, []
+    for line in lines:
+        header = block_header.match(line.rstrip("\n"))
+        key = top_level.match(line)
+        if header or key:
+            if block:
+                yield section, kind, name, block
+            block = []
+            if key:
+                section, kind, name = key.group(1), None, None
+            else:
+                kind, name = header.group(1), header.group(2).strip()
+        block.append(line)
+    if block:
+        yield section, kind, name, block
+
+
+def training_inputs(args):
+    """hashes of the core inputs, the nlu config and of every intent, lookup, synonym and regex"""
+    with open(args.config) as f:
+        config = yaml.safe_load(f)
+    core = hashlib.sha256()
+    core.update(json.dumps(config.get("policies"), sort_keys=True).encode())
+    with open(args.domain, "rb") as f:
+        core.update(f.read())
+    nlu_config = hashlib.sha256(
+        json.dumps(
+            [config.get("language"), config.get("pipeline")], sort_keys=True
+        ).encode()
+    )
+
+    nlu = {}
+    for path in training_files(args.data):
+        with open(path) as f:
+            lines = f.readlines()
+        for section, kind, name, block in data_blocks(lines):
+            if section == "version":
+                continue
+            if section == "nlu" and kind in nlu_blocks:
+                # an intent's examples can be spread over files, they hash as one group
+                group = nlu.setdefault(f"{kind}:{name}", hashlib.sha256())
+                group.update("".join(block[1:]).encode())
+            else:
+                core.update("".join(block).encode())
+
+    return {
+        "core": core.hexdigest(),
+        "nlu_config": nlu_config.hexdigest(),
+        "nlu": {group: digest.hexdigest() for group, digest in sorted(nlu.items())},
+    }
+
+
+def changed_groups(old, new):
+    return sorted(
+        group
+        for group in set(old["nlu"]) | set(new["nlu"])
+        if old["nlu"].get(group) != new["nlu"].get(group)
+    )
+
+
+def finetune_config(config, changed, selector_epochs):
+    """the config with fewer epochs for ResponseSelectors of unchanged retrieval intents"""
+    changed_intents = [g.partition(":")[2] for g in changed if g.startswith("intent:")]
+    config = copy.deepcopy(config)
+    full, reduced = [], []
+    for component in config["pipeline"]:
+        if component["name"] == "ResponseSelector":
+            retrieval_intent = component.get("retrieval_intent")
+            label = f"ResponseSelector({retrieval_intent or 'all'})"
+            # a selector without a retrieval intent is trained on all of them
+            touched = any(
+                (
+                    "/" in intent
+                    if retrieval_intent is None
+                    else intent.startswith(f"{retrieval_intent}/")
+                )
+                for intent in changed_intents
+            )
+            if touched:
+                full.append(label)
+            else:
+                component["epochs"] = selector_epochs
+                reduced.append(label)
+        elif "epochs" in component:
+            full.append(component["name"])
+    return config, full, reduced
+
+
+def newest_model(out_dir):
+    models = [
+        os.path.join(out_dir, name)
+        for name in os.listdir(out_dir)
+        if name.endswith(".tar.gz")
+    ]
+    return max(models, key=os.path.getmtime) if models else None
+
+
+def rasa(*command):
+    """run a rasa command, returns whether it succeeded and how long it took"""
+    start = time.perf_counter()
+    result = subprocess.run(["rasa", *command])
+    return result.returncode == 0, time.perf_counter() - start
+
+
+def train_full(args, out_dir, force=False):
+    succeeded, seconds = rasa(
+        "train",
+        "--config",
+        args.config,
+        "--domain",
+        args.domain,
+        "--data",
+        *args.data,
+        "--out",
+        out_dir,
+        *(["--force"] if force else []),
+    )
+    if not succeeded:
+        raise SystemExit("rasa train failed")
+    return newest_model(out_dir), seconds
+
+
+def train_nlu(args, config, last_model, work_dir):
+    """finetune the nlu model of last_model on config, from scratch if that fails"""
+    config_path = os.path.join(work_dir, "config.yml")
+    with open(config_path, "w") as f:
+        yaml.safe_dump(config, f, sort_keys=False)
+    if len(args.data) == 1:
+        nlu_data = args.data[0]
+    else:
+        # rasa train nlu takes one file or directory
+        nlu_data = os.path.join(work_dir, "data")
+        os.makedirs(nlu_data)
+        for number, path in enumerate(training_files(args.data)):
+            shutil.copyfile(
+                path, os.path.join(nlu_data, f"{number}_{os.path.basename(path)}")
+            )
+
+    command = ["train", "nlu", "--nlu", nlu_data, "--out", work_dir]
+    command += ["--fixed-model-name", "nlu"]
+    succeeded, seconds = rasa(
+        *command,
+        "--config",
+        config_path,
+        "--finetune",
+        last_model,
+        "--epoch-fraction",
+        "1.0",
+    )
+    if not succeeded:
+        print("Couldn't finetune the last nlu model, training it from scratch")
+        succeeded, scratch_seconds = rasa(*command, "--config", args.config)
+        seconds += scratch_seconds
+        if not succeeded:
+            raise SystemExit("rasa train nlu failed")
+    return os.path.join(work_dir, "nlu.tar.gz"), seconds
+
+
+def package(last_model, nlu_model, out_dir, work_dir):
+    """a new model of last_model's core model and nlu_model's nlu model, returns its path"""
+    model_dir = os.path.join(work_dir, "model")
+    nlu_dir = os.path.join(work_dir, "nlu")
+    with tarfile.open(last_model) as tar:
+        tar.extractall(model_dir)
+    with tarfile.open(nlu_model) as tar:
+        tar.extractall(nlu_dir)
+    shutil.rmtree(os.path.join(model_dir, "nlu"), ignore_errors=True)
+    shutil.copytree(os.path.join(nlu_dir, "nlu"), os.path.join(model_dir, "nlu"))
+
+    # rasa compares the fingerprint with the training data to decide what to retrain, the nlu
+    # model's fingerprint only saw nlu data
+    with open(os.path.join(model_dir, "fingerprint.json")) as f:
+        last_fingerprint = json.load(f)
+    with open(os.path.join(nlu_dir, "fingerprint.json")) as f:
+        fingerprint = json.load(f)
+    fingerprint.update(
+        {k: last_fingerprint[k] for k in core_fingerprint_keys if k in last_fingerprint}
+    )
+    with open(os.path.join(model_dir, "fingerprint.json"), "w") as f:
+        json.dump(fingerprint, f)
+
+    path = os.path.join(out_dir, f"{time.strftime('%Y%m%d-%H%M%S')}.tar.gz")
+    with tarfile.open(path, "w:gz") as tar:
+        for name in sorted(os.listdir(model_dir)):
+            tar.add(os.path.join(model_dir, name), arcname=name)
+    return path
+
+
+def plan(state, inputs, force):
+    """what to train: ("full", reason), ("nlu", changed groups) or (None, None)"""
+    if force:
+        return "full", "--force"
+    if state is None or not os.path.exists(state["model"]):
+        return "full", "there's no earlier model to start from"
+    if state["inputs"]["core"] != inputs["core"]:
+        return "full", "the domain, stories, rules or policies changed"
+    if state["inputs"]["nlu_config"] != inputs["nlu_config"]:
+        return "full", "the nlu pipeline changed"
+    changed = changed_groups(state["inputs"], inputs)
+    if changed:
+        return "nlu", changed
+    return None, None
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    state_path = args.state or os.path.join(args.out, ".retrain_state.json")
+    state = None
+    if os.path.exists(state_path):
+        with open(state_path) as f:
+            state = json.load(f)
+    inputs = training_inputs(args)
+    mode, detail = plan(state, inputs, args.force)
+
+    if mode is None:
+        print(f"Nothing changed since {state['model']} was trained")
+        raise SystemExit(0)
+    if mode == "full":
+        print(f"Training a full model, {detail}")
+    else:
+        with open(args.config) as f:
+            config, full, reduced = finetune_config(
+                yaml.safe_load(f), detail, args.selector_epochs
+            )
+        shown = ", ".join(detail[:10]) + (", ..." if len(detail) > 10 else "")
+        print(f"{len(detail)} nlu groups changed: {shown}")
+        print(
+            f"Finetuning the nlu model of {state['model']}: {', '.join(full)} at their epochs, "
+            f"{', '.join(reduced) or 'no selectors'} at {args.selector_epochs}, core model reused"
+        )
+    if args.dry_run:
+        raise SystemExit(0)
+    if shutil.which("rasa") is None:
+        raise SystemExit("retraining needs rasa, which isn't installed")
+
+    os.makedirs(args.out, exist_ok=True)
+    start = time.perf_counter()
+    if mode == "full":
+        model, _ = train_full(args, args.out, force=args.force)
+    else:
+        with tempfile.TemporaryDirectory() as work_dir:
+            nlu_model, _ = train_nlu(args, config, state["model"], work_dir)
+            model = package(state["model"], nlu_model, args.out, work_dir)
+    seconds = time.perf_counter() - start
+    print(f"Trained {model} in {seconds:.1f}s ({mode})")
+
+    with open(state_path, "w") as f:
+        json.dump({"model": model, "trained_at": time.time(), "inputs": inputs}, f)
+
+    if args.compare_full:
+        with tempfile.TemporaryDirectory() as out_dir:
+            _, full_seconds = train_full(args, out_dir, force=True)
+        print(
+            f"A full rasa train took {full_seconds:.1f}s, "
+            f"{full_seconds / seconds:.1f}x as long as this one"
+        )
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+# minimal stand-in for the psychonautwiki graphql api, serving the substance listing from
+# _cached_pw_substances.json so the batched listing in getData.py can be exercised offline
+#
+#   python3 ts_pn_data/stubPwApi.py --port 8765 --fail-offsets 250,251
+#   python3 ts_pn_data/getData.py --refresh --pw-api-url http://localhost:8765
+#
+# only understands `substances(limit: N offset: M)` queries, which is all getData.py sends.
+# with --pages the substance urls point at the stub too, which serves a small wiki page for each
+# (heading and common names) with an ETag and Last-Modified, answering conditional requests for an
+# unchanged page with 304 like the wiki does. tests/test_pw_scrape.py runs the scraper against it
+
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import json
+import re
+
+parser = argparse.ArgumentParser(description="stub psychonautwiki graphql server")
+parser.add_argument("--port", type=int, default=8765)
+parser.add_argument(
+    "--data",
+    default="ts_pn_data/_cached_pw_substances.json",
+    help="psychonautwiki cache to serve substances from",
+)
+parser.add_argument(
+    "--pages",
+    action="store_true",
+    help="also serve the substance pages, with the listed urls pointing here",
+)
+parser.add_argument(
+    "--fail-offsets",
+    default="",
+    help="comma separated offsets the api refuses to return, like the real one does for some substances",
+)
+
+substances_query = re.compile(r"substances\(\s*limit:\s*(\d+)\s+offset:\s*(\d+)\s*\)")
+
+
+def api_substance(pw_substance):
+    """shape a cached record the way the api returns it"""
+    return {
+        "name": pw_substance["name"],
+        "url": pw_substance["url"],
+        **pw_substance["data"],
+    }
+
+
+def substance_page(name, aliases):
+    """the parts of a wiki page the scraper reads: the heading and the common names row"""
+    return (
+        f'<html><body><h1 id="firstHeading">{name}</h1>'
+        f"<table><tr><th>Common names</th><td>{', '.join(aliases)}</td></tr></table>"
+        "</body></html>"
+    ).encode("utf-8")
+
+
+class StubPage:
+    """a served page, bump() it to make it a new revision. with_etag=False only sends Last-Modified"""
+
+    def __init__(self, content, revision=1, with_etag=True):
+        self.content = content
+        self.revision = revision
+        self.with_etag = with_etag
+
+    @property
+    def etag(self):
+        return f'"r{self.revision}"' if self.with_etag else None
+
+    @property
+    def last_modified(self):
+        return formatdate(1600000000 + self.revision * 3600, usegmt=True)
+
+    def bump(self, content=None):
+        self.revision += 1
+        if content is not None:
+            self.content = content
+
+
+def make_handler(substances, fail_offsets, pages=None, log=None):
+    """handler class for the api and, when given, pages by path; requests are appended to log"""
+    pages = pages if pages is not None else {}
+    log = log if log is not None else []
+
+    class StubPwApiHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            page = pages.get(self.path)
+            log.append(("GET", self.path, dict(self.headers)))
+            if page is None:
+                self.respond(404, {"errors": [{"message": "no such page"}]})
+                return
+            if (
+                page.etag
+                and self.headers.get("If-None-Match") == page.etag
+                or (
+                    "If-None-Match" not in self.headers
+                    and self.headers.get("If-Modified-Since") == page.last_modified
+                )
+            ):
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(page.content)))
+            if page.etag:
+                self.send_header("ETag", page.etag)
+            self.send_header("Last-Modified", page.last_modified)
+            self.end_headers()
+            self.wfile.write(page.content)
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            match = substances_query.search(body.get("query", ""))
+            if not match:
+                self.respond(400, {"errors": [{"message": "unsupported query"}]})
+                return
+
+            limit, offset = int(match.group(1)), int(match.group(2))
+            log.append(("POST", (offset, limit), dict(self.headers)))
+            if any(offset <= o < offset + limit for o in fail_offsets):
+                self.respond(
+                    200,
+                    {
+                        "data": {"substances": None},
+                        "errors": [{"message": "could not resolve substance"}],
+                    },
+                )
+                return
+
+            page = substances[offset : offset + limit]
+            self.respond(200, {"data": {"substances": page}})
+
+        def respond(self, status, payload):
+            content = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubPwApiHandler
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    with open(args.data) as f:
+        substances = list(map(api_substance, json.load(f)))
+    fail_offsets = {int(o) for o in args.fail_offsets.split(",") if o.strip()}
+    pages = {}
+    if args.pages:
+        for substance in substances:
+            path = "/wiki/" + substance["url"].rsplit("/", 1)[-1]
+            pages[path] = StubPage(substance_page(substance["name"], []))
+            substance["url"] = f"http://localhost:{args.port}{path}"
+
+    server = ThreadingHTTPServer(
+        ("localhost", args.port), make_handler(substances, fail_offsets, pages)
+    )
+    print(f"Serving {len(substances)} substances on http://localhost:{args.port}")
+    server.serve_forever()
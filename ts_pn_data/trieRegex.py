@@ -0,0 +1,53 @@
+# builds one prefix-factored regex out of a word list
+#
+# a lookup table is turned into a plain alternation (a|ab|abc|b...) by the RegexFeaturizer, which
+# the regex engine tries alternative by alternative at every position of every message. merging the
+# words into a trie first and writing that out (a(?:bc?)?|b) means each character is only tested
+# once per branch point, whatever the number of words sharing the prefix
+
+import re
+
+
+def build_trie(words):
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        # end of word marker
+        node[""] = {}
+    return trie
+
+
+def trie_pattern(node):
+    """regex for the words below a trie node, None when the node only ends a word"""
+    if "" in node and len(node) == 1:
+        return None
+
+    branches = []
+    single_chars = []
+    for char in sorted(k for k in node if k):
+        rest = trie_pattern(node[char])
+        if rest is None:
+            single_chars.append(re.escape(char))
+        else:
+            branches.append(re.escape(char) + rest)
+
+    only_chars = not branches
+    if len(single_chars) == 1:
+        branches.append(single_chars[0])
+    elif single_chars:
+        branches.append(f"[{''.join(single_chars)}]")
+
+    pattern = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+    if "" in node:
+        # a word also ends here, the rest is optional. a group or a single character can take the ?
+        # as is, a longer sequence needs grouping first
+        grouped = len(branches) > 1 or only_chars
+        pattern = f"{pattern}?" if grouped else f"(?:{pattern})?"
+    return pattern
+
+
+def trie_regex(words):
+    """a regex matching exactly the given words (compare case-insensitively by lowercasing them)"""
+    return trie_pattern(build_trie(words)) or ""